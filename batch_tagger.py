@@ -0,0 +1,379 @@
+"""
+대사 시트(xlsx/CSV)를 봇과 같은 키워드 분류기로 다시 태깅하는 일괄 처리 도구입니다.
+파일을 청크 단위로 읽어 여러 프로세스에서 분류하고, 라벨 분포와 기존 라벨과의 불일치를 보고한 뒤
+검증을 통과한 결과만 봇이 읽을 수 있는 형식으로 기록합니다.
+
+    python batch_tagger.py girlfriend_mode_reactive_200.xlsx --output reactive_tagged.xlsx
+    python batch_tagger.py lines.csv --output lines_tagged.csv --mode overwrite --workers 8
+    python batch_tagger.py character_table_flowtagged.xlsx --mode check
+
+--mode fill(기본값)은 비어 있는 라벨과, 봇이 값 그대로 비교하는 컬럼(감정)에서 분류기가 낼 수 없는 라벨만 채우고, overwrite는 분류 결과로 모두 바꾸며,
+check는 기록하지 않고 보고만 합니다(고칠 라벨이 있으면 종료 코드 1).
+xlsx를 xlsx로 기록할 때는 대사 시트 외의 시트(system_prompt_린 등)를 그대로 옮겨 원본 대신 바로 쓸 수 있습니다.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from dialogue_store import STORE_COLUMNS, normalize_initiator, normalize_label
+from keyword_classifier import KeywordClassifier
+from nudge_scheduler import NUDGE_SITUATIONS
+
+logger = logging.getLogger('린_봇')
+
+LINE_SHEET = "lines_린"
+# 시트 컬럼 -> 분류표 (봇이 새 대사를 저장할 때 쓰는 분류표와 같음)
+TAG_TASKS = {"감정": "emotion", "상황": "situation", "대화 흐름": "conversational_flow"}
+# 후보 색인이 라벨 값 그대로 비교하는 컬럼. 분류기가 낼 수 없는 값이면 그 대사는 후보에 오르지 않음
+# 대화 흐름은 유저 흐름별 조건으로 거르는데, 일반은 조건이 없고 질문형은 회피형만 빼므로 어떤 값이든 후보가 될 수 있어 검사하지 않음
+CHECKED_COLUMNS = ("감정",)
+
+_classifier = None
+
+
+def _init_worker(keywords_path):
+    global _classifier
+    _classifier = KeywordClassifier.from_file(keywords_path)
+
+
+def tag_lines(lines):
+    """
+    대사 목록을 한 줄씩 한 번만 훑어 {분류표: 라벨} 목록을 반환합니다. 작업 프로세스에서 실행됩니다.
+    """
+    tasks = tuple(TAG_TASKS.values())
+    return [_classifier.classify(line, tasks) for line in lines]
+
+
+def known_labels(classifier):
+    """
+    컬럼별로 분류기가 낼 수 있는 라벨 집합(기본값 포함)을 반환합니다.
+    """
+    labels = {}
+    for column, task in TAG_TASKS.items():
+        table = classifier.tables[task]
+        labels[column] = {table["default"], *(entry["label"] for entry in table["labels"])}
+    return labels
+
+
+def _csv_value(name, value):
+    # CSV는 모든 값이 문자열이므로 빈 칸과 is_initiator를 엑셀에서 읽은 값과 같은 형태로 맞춤
+    if value == "":
+        return None
+    if name == "is_initiator":
+        lowered = value.strip().lower()
+        if lowered in ("true", "1"):
+            return True
+        if lowered in ("false", "0"):
+            return False
+    return value
+
+
+def open_rows(path, sheet_name=LINE_SHEET):
+    """
+    대사 파일을 (헤더, 행 반복자, 닫기 함수)로 엽니다. 파일 전체를 메모리에 올리지 않고 한 행씩 읽습니다.
+    """
+    if path.lower().endswith(".csv"):
+        f = open(path, encoding="utf-8-sig", newline="")
+        reader = csv.reader(f)
+        header = next(reader, [])
+        rows = ([_csv_value(name, value) for name, value in zip(header, row)] for row in reader)
+        return header, rows, f.close
+
+    import openpyxl  # xlsx를 읽을 때만 로드
+
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    rows = workbook[sheet_name].iter_rows(values_only=True)
+    header = [str(name) for name in next(rows, ()) if name is not None]
+    return header, (list(row[:len(header)]) for row in rows), workbook.close
+
+
+class OutputWriter:
+    """
+    태깅한 행을 xlsx(쓰기 전용 모드) 또는 CSV로 한 행씩 기록합니다.
+    """
+
+    def __init__(self, path, header, sheet_name=LINE_SHEET, source=None):
+        self.path = path
+        self._csv_file = None
+        if path.lower().endswith(".csv"):
+            self._csv_file = open(path, "w", encoding="utf-8-sig", newline="")
+            self._writer = csv.writer(self._csv_file)
+            self._writer.writerow(header)
+            return
+
+        import openpyxl
+
+        self._workbook = openpyxl.Workbook(write_only=True)
+        if source is not None and source.lower().endswith(".xlsx"):
+            self._copy_other_sheets(openpyxl, source, sheet_name)
+        self._sheet = self._workbook.create_sheet(sheet_name)
+        self._sheet.append(header)
+
+    def _copy_other_sheets(self, openpyxl, source, sheet_name):
+        workbook = openpyxl.load_workbook(source, read_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                if worksheet.title == sheet_name:
+                    continue
+                copied = self._workbook.create_sheet(worksheet.title)
+                for row in worksheet.iter_rows(values_only=True):
+                    copied.append(row)
+        finally:
+            workbook.close()
+
+    def append(self, row):
+        if self._csv_file is not None:
+            self._writer.writerow(["" if value is None else value for value in row])
+        else:
+            self._sheet.append(row)
+
+    def close(self):
+        if self._csv_file is not None:
+            self._csv_file.close()
+        else:
+            with open(self.path, "wb") as f:
+                self._workbook.save(f)
+
+
+def read_chunks(rows, line_column, chunk_size, report):
+    """
+    빈 대사와 중복 대사를 걸러 내며 행을 chunk_size개씩 묶어 돌려줍니다. 봇도 같은 대사를 한 번만 저장합니다.
+    """
+    seen = set()
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, chunk_size))
+        if not batch:
+            return
+        chunk = []
+        for row in batch:
+            line = normalize_label(row[line_column])
+            if line is None or not line.strip():
+                report["dropped_empty"] += 1
+            elif line in seen:
+                report["dropped_duplicate"] += 1
+            else:
+                seen.add(line)
+                row[line_column] = line
+                chunk.append(row)
+        report["read"] += len(batch)
+        if chunk:
+            yield chunk
+
+
+def tagged_chunks(chunks, line_column, workers, keywords_path):
+    """
+    청크를 작업 프로세스에 나눠 분류하고, 읽은 순서대로 (청크, 분류 결과)를 돌려줍니다.
+    진행 중인 청크를 프로세스 수의 두 배로 제한해 큰 파일도 일정한 메모리로 처리합니다.
+    """
+    if workers <= 1:
+        _init_worker(keywords_path)
+        for chunk in chunks:
+            yield chunk, tag_lines([row[line_column] for row in chunk])
+        return
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(keywords_path,)) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(tag_lines, [row[line_column] for row in chunk])))
+            if len(pending) >= workers * 2:
+                chunk, future = pending.popleft()
+                yield chunk, future.result()
+        while pending:
+            chunk, future = pending.popleft()
+            yield chunk, future.result()
+
+
+def resolve_label(mode, column, current, tagged, labels, is_initiator=False):
+    """
+    기존 라벨과 분류 결과 중 기록할 값을 고릅니다.
+    린이 먼저 말 거는 대사의 상황은 자동 메시지 대사를 고르는 값이고 분류기가 낼 수 없으므로, 비어 있지 않으면 그대로 둡니다.
+    """
+    if column == "상황" and is_initiator and current is not None:
+        return current
+    if mode == "overwrite" or current is None:
+        return tagged
+    if column in CHECKED_COLUMNS and current not in labels[column]:
+        return tagged
+    return current
+
+
+def verify_output(path, sheet_name, expected_rows, labels, expected_nudges=None):
+    """
+    기록한 파일을 다시 읽어 봇이 요구하는 컬럼과 라벨, 행 수를 확인합니다. 문제가 있으면 ValueError를 발생시킵니다.
+    expected_nudges는 {자동 메시지 상황: 원본의 먼저 말 거는 대사 수}이며, 기록한 파일에서 그 대사가 줄어들면 실패합니다.
+    """
+    nudges = Counter()
+    header, rows, close = open_rows(path, sheet_name)
+    try:
+        missing = [name for name in STORE_COLUMNS if name not in header]
+        if missing:
+            raise ValueError(f"필요한 컬럼이 없습니다: {', '.join(missing)}")
+        positions = {name: header.index(name) for name in STORE_COLUMNS}
+        count = 0
+        for row in rows:
+            count += 1
+            if normalize_label(row[positions["대사"]]) is None:
+                raise ValueError(f"{count}번째 행의 대사가 비어 있습니다.")
+            for column in CHECKED_COLUMNS:
+                if normalize_label(row[positions[column]]) not in labels[column]:
+                    raise ValueError(f"{count}번째 행의 {column} 라벨을 봇이 사용할 수 없습니다: {row[positions[column]]}")
+            if normalize_initiator(row[positions["is_initiator"]]) is True:
+                nudges[normalize_label(row[positions["상황"]])] += 1
+        if count != expected_rows:
+            raise ValueError(f"기록한 행 수가 다릅니다: {count}개 (예상 {expected_rows}개)")
+        if not count:
+            raise ValueError("기록한 대사가 없습니다.")
+        for situation, expected in (expected_nudges or {}).items():
+            if nudges[situation] < expected:
+                raise ValueError(f"'{situation}' 자동 메시지 대사가 {expected}개에서 {nudges[situation]}개로 줄었습니다.")
+    finally:
+        close()
+
+
+def retag(source, output=None, mode="fill", workers=1, chunk_size=2000,
+          keywords_path="classifier_keywords.json", sheet_name=LINE_SHEET):
+    """
+    source의 대사 시트를 다시 태깅하고 보고서(dict)를 반환합니다.
+    output이 있으면 임시 파일에 기록해 검증한 뒤 교체하므로, 검증에 실패하면 기존 output은 그대로 남습니다.
+    """
+    labels = known_labels(KeywordClassifier.from_file(keywords_path))
+    report = {
+        "source": source, "mode": mode, "workers": workers,
+        "read": 0, "written": 0, "dropped_empty": 0, "dropped_duplicate": 0,
+        "added_columns": [], "empty": Counter(), "unknown": Counter(), "changed": Counter(), "nudges": Counter(),
+        "mismatches": {column: Counter() for column in TAG_TASKS},
+        "before": {column: Counter() for column in TAG_TASKS},
+        "after": {column: Counter() for column in TAG_TASKS},
+    }
+    started_at = time.perf_counter()
+
+    header, rows, close = open_rows(source, sheet_name)
+    writer = None
+    tmp_path = None
+    try:
+        if "대사" not in header:
+            raise ValueError(f"{source}에 '대사' 컬럼이 없습니다.")
+        # 봇이 요구하는 컬럼이 없으면 추가 (라벨 컬럼은 분류 결과로, is_initiator는 반응형 대사로 채움)
+        report["added_columns"] = [name for name in STORE_COLUMNS if name not in header]
+        header = header + report["added_columns"]
+        width = len(header)
+        rows = (row + [None] * (width - len(row)) for row in rows)
+        positions = {name: header.index(name) for name in STORE_COLUMNS}
+        initiator_column = positions["is_initiator"]
+
+        if output is not None and mode != "check":
+            base, ext = os.path.splitext(output)
+            tmp_path = f"{base}.{os.getpid()}.tmp{ext}"
+            writer = OutputWriter(tmp_path, header, sheet_name, source)
+
+        chunks = read_chunks(rows, positions["대사"], chunk_size, report)
+        for chunk, results in tagged_chunks(chunks, positions["대사"], workers, keywords_path):
+            for row, tagged in zip(chunk, results):
+                is_initiator = normalize_initiator(row[initiator_column])
+                if is_initiator is None:
+                    row[initiator_column] = is_initiator = False
+                if is_initiator and normalize_label(row[positions["상황"]]) in NUDGE_SITUATIONS:
+                    report["nudges"][normalize_label(row[positions["상황"]])] += 1
+                for column, task in TAG_TASKS.items():
+                    position = positions[column]
+                    current = normalize_label(row[position])
+                    report["before"][column][current] += 1
+                    if current is None:
+                        report["empty"][column] += 1
+                    elif column in CHECKED_COLUMNS and current not in labels[column]:
+                        report["unknown"][column] += 1
+                    if current is not None and current != tagged[task]:
+                        report["mismatches"][column][(current, tagged[task])] += 1
+                    value = resolve_label(mode, column, current, tagged[task], labels, is_initiator)
+                    if value != current:
+                        report["changed"][column] += 1
+                    report["after"][column][value] += 1
+                    row[position] = value
+                if writer is not None:
+                    writer.append(row)
+                report["written"] += 1
+    finally:
+        close()
+        if writer is not None:
+            writer.close()
+
+    try:
+        if tmp_path is not None:
+            verify_output(tmp_path, sheet_name, report["written"], labels, report["nudges"])
+            os.replace(tmp_path, output)
+            report["output"] = output
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    report["elapsed"] = time.perf_counter() - started_at
+    return report
+
+
+def print_report(report, top=5):
+    elapsed = report["elapsed"]
+    print(f"{report['source']}: 대사 {report['read']}행 읽음, {report['written']}행 태깅 "
+          f"(빈 대사 {report['dropped_empty']}개, 중복 {report['dropped_duplicate']}개 제외), "
+          f"{elapsed:.2f}초, {report['read'] / elapsed if elapsed else 0:.0f}행/초, 프로세스 {report['workers']}개")
+    if report["added_columns"]:
+        print(f"추가한 컬럼: {', '.join(report['added_columns'])}")
+    for column in TAG_TASKS:
+        print(f"[{column}] 빈 값 {report['empty'][column]}개, 봇이 쓰지 않는 라벨 {report['unknown'][column]}개, "
+              f"분류 결과와 다름 {sum(report['mismatches'][column].values())}개, 바꾼 값 {report['changed'][column]}개")
+        print(f"  기존 분포: {dict(report['before'][column].most_common())}")
+        print(f"  결과 분포: {dict(report['after'][column].most_common())}")
+        for (current, tagged), count in report["mismatches"][column].most_common(top):
+            print(f"  불일치 {current} -> {tagged}: {count}개")
+    if report["nudges"]:
+        print(f"자동 메시지 대사(상황 유지): {dict(report['nudges'])}")
+    if report.get("output"):
+        print(f"검증 후 기록: {report['output']}")
+
+
+def report_to_json(report):
+    # Counter의 튜플 키는 JSON으로 쓸 수 없으므로 "기존 -> 분류" 문자열로 바꿈
+    converted = dict(report)
+    converted["mismatches"] = {column: {f"{current} -> {tagged}": count for (current, tagged), count in counter.items()}
+                               for column, counter in report["mismatches"].items()}
+    return converted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="대사 시트를 봇의 키워드 분류기로 일괄 태깅하고 검증합니다.")
+    parser.add_argument("source", help="대사 파일 (.xlsx 또는 .csv)")
+    parser.add_argument("--output", help="태깅 결과를 기록할 파일 (.xlsx 또는 .csv)")
+    parser.add_argument("--mode", choices=("fill", "overwrite", "check"), default="fill")
+    parser.add_argument("--sheet", default=LINE_SHEET, help="xlsx의 대사 시트 이름")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="분류 작업 프로세스 수")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="한 번에 작업 프로세스로 보낼 행 수")
+    parser.add_argument("--keywords", default=os.getenv("CLASSIFIER_KEYWORDS_PATH", "classifier_keywords.json"))
+    parser.add_argument("--top", type=int, default=5, help="컬럼별로 보여 줄 불일치 유형 수")
+    parser.add_argument("--json", help="보고서를 JSON으로 저장할 경로")
+    args = parser.parse_args(argv)
+    if args.mode != "check" and not args.output:
+        parser.error("--mode check가 아니면 --output이 필요합니다.")
+
+    try:
+        report = retag(args.source, args.output, args.mode, args.workers, args.chunk_size, args.keywords, args.sheet)
+    except Exception as e:
+        print(f"일괄 태깅 실패: {str(e)}", file=sys.stderr)
+        return 1
+    print_report(report, args.top)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report_to_json(report), f, ensure_ascii=False, indent=2)
+
+    if args.mode == "check" and (sum(report["empty"].values()) or sum(report["unknown"].values())):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
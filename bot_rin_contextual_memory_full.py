@@ -1,13 +1,31 @@
 import os
+import asyncio
 import discord
-import pandas as pd
 from discord.ext import commands, tasks
 from dotenv import load_dotenv
 import random
-from datetime import datetime
 import anthropic  # 클로드 API 클라이언트
 import logging  # 로깅 추가
-import time  # 재시도 메커니즘을 위한 타임아웃
+import hashlib
+import time
+from array import array
+from line_store import LineJournal
+from dialogue_snapshot import load_dialogue_data, file_fingerprint, CHARACTER_TABLE_PATH, REACTIVE_TABLE_PATH, DEFAULT_SNAPSHOT_PATH
+from dialogue_index import CandidateIndex
+from similarity_index import SimilarityIndex
+from dialogue_store import DialogueStore
+from keyword_classifier import KeywordClassifier
+from bounded_cache import BoundedCache, cached, normalize_text
+from session_store import SessionStore
+from candidate_ranker import rank_positions
+from reply_streamer import StreamingReply
+from channel_queue import ChannelWorkQueue
+from nudge_scheduler import NudgeScheduler
+from upstream_governor import UpstreamGovernor, CircuitBreaker, CircuitOpenError
+from prompt_builder import MIN_CACHE_TOKENS, build_cached_request, cached_prefix_tokens, UsageTracker
+from conversation_memory import build_summary_request, MemoryStats
+from speculation_policy import SpeculationPolicy
+from metrics import MetricsRegistry, SamplingProfiler, start_http_server
 
 # 로깅 설정
 logging.basicConfig(
@@ -34,27 +52,208 @@ if not DISCORD_BOT_TOKEN:
     logger.critical("DISCORD_BOT_TOKEN 환경 변수가 설정되지 않았습니다. 프로그램을 종료합니다.")
     raise ValueError("DISCORD_BOT_TOKEN 환경 변수가 필요합니다.")
 
-# 클로드 API 클라이언트 초기화
+# 클로드 API 클라이언트 초기화 (이벤트 루프를 막지 않도록 비동기 클라이언트 사용)
+# 재시도는 속도 제한과 회로 차단기를 거치도록 claude_governor만 담당하고, SDK 자체 재시도는 끔
 try:
-    client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
+    client = anthropic.AsyncAnthropic(api_key=CLAUDE_API_KEY, max_retries=0)
     logger.info("Claude API 클라이언트 초기화 성공")
 except Exception as e:
     logger.critical(f"Claude API 클라이언트 초기화 실패: {str(e)}")
     raise
 
-# 전역 캐시 및 대화 이력
-recent_responses = []
-conversation_history = []
-last_message_time = {}
-last_bot_message = {}
+# 처리 단계별 지연 시간과 호출/토큰/캐시 지표 (METRICS_PORT가 0이 아니면 로컬 HTTP로 노출)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+metrics_registry = MetricsRegistry()
+stage_latency = metrics_registry.histogram("rin_stage_latency_seconds", "메시지 처리 단계별 소요 시간(초)")
+first_visible_latency = metrics_registry.histogram("rin_stream_first_visible_seconds", "스트리밍 응답의 첫 문장이 채널에 보이기까지 걸린 시간(초)")
+claude_api_calls = metrics_registry.counter("rin_claude_api_calls_total", "Claude API 호출 시도 수")
+claude_tokens = metrics_registry.counter("rin_claude_tokens_total", "Claude API 토큰 사용량")
+reply_sources = metrics_registry.counter("rin_reply_source_total", "응답을 만든 경로별 횟수")
+selection_none = metrics_registry.counter("rin_selection_none_total", "후보 대사 평가에서 적절한 대사가 없다고 답한 횟수")
+retrievals = metrics_registry.counter("rin_similarity_retrieval_total", "후보가 부족해 유사 대사 검색으로 보충한 횟수 (찾았는지 여부별)")
+speculative_generations = metrics_registry.counter("rin_speculative_generation_total", "후보 평가와 동시에 시작한 대사 생성 요청의 결말별 횟수")
+PIPELINE_STAGES = ("classify", "candidate_lookup", "selection", "generation", "persistence", "send")
+CLAUDE_CALL_KINDS = ("selection", "generation", "stream", "summary")
 
-def is_redundant_response(reply):
-    return any(reply[:10] in r for r in recent_responses)
+def record_claude_tokens(kind, usage):
+    """
+    응답의 usage를 토큰 종류별 카운터에 더합니다.
+    """
+    for token_type in ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens"):
+        claude_tokens.inc(getattr(usage, token_type, None) or 0, kind=kind, type=token_type)
+
+# 동시에 진행할 수 있는 Claude 요청 수 제한
+CLAUDE_MAX_CONCURRENCY = int(os.getenv("CLAUDE_MAX_CONCURRENCY", "4"))
+claude_semaphore = asyncio.Semaphore(CLAUDE_MAX_CONCURRENCY)
+
+def is_retryable_error(exc):
+    """
+    타임아웃, 연결 오류, 속도 제한(429), 서버 오류(5xx)만 재시도 대상으로 봅니다.
+    """
+    if isinstance(exc, (anthropic.APITimeoutError, anthropic.APIConnectionError)):
+        return True
+    if isinstance(exc, anthropic.APIStatusError):
+        return exc.status_code == 429 or exc.status_code >= 500
+    return False
+
+def retry_after_seconds(exc):
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+def estimate_request_tokens(request):
+    """
+    분당 토큰 제한용으로 요청 토큰 수를 넉넉하게 추정합니다. 한글은 대략 한 글자가 토큰 하나 정도입니다.
+    """
+    return len(str(request.get("system", ""))) + len(str(request.get("messages", ""))) + request.get("max_tokens", 0)
+
+# 모든 Claude 호출이 공유하는 속도 제한, 재시도, 회로 차단기
+claude_governor = UpstreamGovernor(
+    requests_per_minute=int(os.getenv("CLAUDE_RPM", "50")),
+    tokens_per_minute=int(os.getenv("CLAUDE_TPM", "50000")),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5")),
+        reset_timeout=float(os.getenv("CIRCUIT_RESET_SECONDS", "30")),
+    ),
+    is_retryable=is_retryable_error,
+    retry_after=retry_after_seconds,
+)
+
+async def request_claude(max_retries=3, kind="generation", **kwargs):
+    """
+    Claude API를 비동기로 호출합니다. 속도 제한과 재시도, 회로 차단은 claude_governor가 맡고,
+    재시도 횟수를 모두 소진하면 마지막 예외를, 회로가 열려 있으면 CircuitOpenError를 전달합니다.
+    kind는 지표에서 호출 용도(selection/generation)를 구분하는 라벨입니다.
+    """
+    async def send():
+        async with claude_semaphore:
+            claude_api_calls.inc(kind=kind)
+            return await client.messages.create(timeout=30, **kwargs)  # 30초 타임아웃 설정
+
+    response = await claude_governor.call(send, estimate_request_tokens(kwargs), max_retries)
+    record_claude_tokens(kind, response.usage)
+    return response
+
+async def stream_claude_reply(channel, request):
+    """
+    Claude 응답을 스트리밍으로 받아 채널에 점진적으로 보여주고, StreamingReply를 반환합니다.
+    화면에 아무것도 보이기 전에 실패하면 예외를 전달하고, 일부가 보인 뒤 끊기면 받은 데까지로 마무리합니다.
+    """
+    streamer = StreamingReply(channel, replace_repetitive_phrases, clean_reply_text, STREAM_EDIT_INTERVAL)
+    started_at = time.perf_counter()
+    final_message = None
+    interrupted = False
+
+    async def read_stream(pending):
+        # 동시 호출 제한은 스트림을 읽는 동안에만 잡고, 디스코드 전송/수정은 stream_once에서 제한 밖으로 처리
+        nonlocal final_message
+        try:
+            async with claude_semaphore:
+                claude_api_calls.inc(kind="stream")
+                async with client.messages.stream(timeout=30, **request) as stream:
+                    async for text in stream.text_stream:
+                        pending.put_nowait(text)
+                    final_message = await stream.get_final_message()
+        finally:
+            pending.put_nowait(None)  # 스트림 끝 (성공/실패 모두)
+
+    async def stream_once():
+        nonlocal interrupted
+        pending = asyncio.Queue()
+        reader = asyncio.create_task(read_stream(pending))
+        try:
+            done = False
+            while not done:
+                # 디스코드 전송을 기다리는 사이 쌓인 조각은 한꺼번에 반영
+                chunks = [await pending.get()]
+                while not pending.empty():
+                    chunks.append(pending.get_nowait())
+                done = chunks[-1] is None
+                text = "".join(chunk for chunk in chunks if chunk is not None)
+                if text:
+                    await streamer.feed(text)
+            await reader
+        except Exception as e:
+            if streamer.message is None:
+                raise
+            interrupted = True
+            logger.error(f"스트리밍 응답이 중간에 끊겼습니다: {str(e)}")
+        finally:
+            if not reader.done():
+                reader.cancel()
+
+    # 스트리밍은 재시도하지 않고, 실패하면 호출한 쪽에서 일반 요청으로 넘어감
+    await claude_governor.call(stream_once, estimate_request_tokens(request), max_retries=1)
+    await streamer.finish(completed=not interrupted)
+    if final_message is not None:
+        fallback_usage.record(final_message.usage, time.perf_counter() - started_at)
+        record_claude_tokens("stream", final_message.usage)
+    if streamer.first_visible_latency is not None:
+        first_visible_latency.observe(streamer.first_visible_latency)
+        logger.info(f"스트리밍 응답 첫 표시까지 {streamer.first_visible_latency:.2f}초")
+    return streamer
+
+# 샤딩: SHARD_COUNT가 있으면 AutoShardedBot으로 실행하고, SHARD_IDS(쉼표 구분)로 이 프로세스가 맡을 샤드를 지정
+# 디스코드는 서버(길드) 단위로 샤드를 나누므로 채널별 상태는 프로세스마다 자연스럽게 나뉨
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0"))
+SHARD_IDS = [int(shard_id) for shard_id in os.getenv("SHARD_IDS", "").split(",") if shard_id.strip()]
+# 여러 프로세스가 저널과 스냅샷을 공유할 때 엑셀 반영과 스냅샷 갱신은 한 프로세스만 담당
+LINE_STORE_WRITER = os.getenv("LINE_STORE_WRITER", "1") == "1"
+
+def shard_scoped_path(path):
+    """
+    프로세스가 맡은 샤드가 정해져 있으면 경로에 샤드 번호를 붙여 프로세스별 파일을 사용합니다.
+    """
+    if not path or not SHARD_IDS:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard{'-'.join(str(shard_id) for shard_id in SHARD_IDS)}{ext}"
 
-def update_response_cache(reply):
-    recent_responses.append(reply)
-    if len(recent_responses) > 10:
-        recent_responses.pop(0)
+# 대화 기억: 최근 이력은 그대로, 더 오래된 대화는 백그라운드에서 요약해 요청당 토큰 예산 안에서 보냄
+MEMORY_RECENT_MESSAGES = int(os.getenv("MEMORY_RECENT_MESSAGES", "8"))
+MEMORY_FOLD_BATCH = int(os.getenv("MEMORY_FOLD_BATCH", "4"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("MEMORY_TOKEN_BUDGET", "1200"))  # 요약과 최근 이력을 합친 요청당 최대 토큰
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "300"))
+# 모델의 최소 캐시 길이(토큰). 캐시 표시는 항상 붙이고, 이보다 짧은 캐시 구간의 비율만 !토큰에 보고
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", str(MIN_CACHE_TOKENS)))
+memory_stats = MemoryStats()
+summary_tasks = {}  # 채널 ID -> 진행 중인 요약 갱신 태스크
+
+# 채널별 대화 세션 (대화 이력, 지난 대화 요약, 최근 응답 캐시)
+session_store = SessionStore(
+    max_sessions=int(os.getenv("SESSION_MAX_COUNT", "5000")),
+    idle_ttl=float(os.getenv("SESSION_IDLE_TTL", "86400")),
+    recent_messages=MEMORY_RECENT_MESSAGES,
+    fold_batch=MEMORY_FOLD_BATCH,
+    response_window=int(os.getenv("ANTI_REPEAT_WINDOW", "10")),  # 중복 응답 검사에 쓰는 최근 응답 수
+)
+SESSION_SNAPSHOT_PATH = shard_scoped_path(os.getenv("SESSION_SNAPSHOT_PATH", ""))  # 비어 있으면 스냅샷을 남기지 않음
+if SESSION_SNAPSHOT_PATH:
+    try:
+        restored = session_store.restore(SESSION_SNAPSHOT_PATH)
+        logger.info(f"대화 세션 {restored}개 복원 완료")
+    except Exception as e:
+        logger.error(f"대화 세션 복원 중 오류: {str(e)}")
+
+# 대사 생성 호출의 프롬프트 캐시 사용량
+fallback_usage = UsageTracker()
+
+# 대사 생성 응답을 스트리밍으로 보여줄지 여부와 메시지 수정 간격(초)
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.2"))
+
+# 후보 평가와 대사 생성을 동시에 시작할지: off/on/auto (auto는 최근 후보 평가 적중률이 기준 이하일 때만)
+speculation_policy = SpeculationPolicy(
+    mode=os.getenv("SPECULATIVE_GENERATION", "off"),
+    max_hit_rate=float(os.getenv("SPECULATIVE_MAX_HIT_RATE", "0.5")),
+    window=int(os.getenv("SPECULATIVE_WINDOW", "200")),
+    min_samples=int(os.getenv("SPECULATIVE_MIN_SAMPLES", "20")),
+)
 
 # 확장된 유사 표현 사전
 extended_replace_map = {
@@ -72,162 +271,165 @@ def replace_repetitive_phrases(text):
             text = text.replace(original, random.choice(variants))
     return text
 
+def clean_reply_text(reply, final=True):
+    """
+    응답 앞뒤의 따옴표와 "[린의 응답]" 머리말을 제거합니다.
+    final=False이면 아직 생성 중인 응답이므로 끝부분의 따옴표는 건드리지 않습니다.
+    """
+    if reply.startswith('"') and reply.endswith('"') and final:
+        reply = reply[1:-1]
+    elif reply.startswith('"'):
+        reply = reply[1:]
+    elif reply.endswith('"') and final:
+        reply = reply[:-1]
+
+    if reply.startswith("[린의 응답]"):
+        reply = reply[len("[린의 응답]"):].lstrip()
+    return reply
+
+# 대사 스냅샷 경로 (원본 엑셀이 바뀌었을 때만 다시 파싱)
+DIALOGUE_SNAPSHOT_PATH = os.getenv("DIALOGUE_SNAPSHOT_PATH", DEFAULT_SNAPSHOT_PATH)
+
+# 새로 생성된 대사는 저널에 모아 두었다가 백그라운드에서 엑셀에 반영 (여러 프로세스가 같은 저널을 공유해도 됨)
+line_journal = LineJournal(os.getenv("LINE_JOURNAL_PATH", "lines_journal.sqlite3"))
+
+# 감정이 같은 후보가 RETRIEVAL_MIN_POOL개보다 적으면, 흐름 조건만 맞는 대사 중 유저 발화와 비슷한 대사를 후보에 더함 (0이면 사용 안 함)
+RETRIEVAL_MIN_POOL = int(os.getenv("RETRIEVAL_MIN_POOL", "3"))
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", "0.05"))
+SIMILARITY_DIMS = int(os.getenv("SIMILARITY_DIMS", "256"))
+
+# 봇이 필요로 하는 대사 시트 컬럼
+REQUIRED_LINE_COLUMNS = ("대사", "감정", "대화 흐름", "상황", "is_initiator")
+
+def source_fingerprints():
+    """
+    원본 엑셀 파일들의 수정 시각과 크기를 반환합니다.
+    """
+    return {path: file_fingerprint(path) for path in (CHARACTER_TABLE_PATH, REACTIVE_TABLE_PATH)}
+
+def validate_character_data(prompt_columns, line_columns):
+    """
+    새로 읽은 데이터(컬럼 이름 -> 값 목록)가 봇이 사용하는 형식인지 확인합니다. 문제가 있으면 ValueError를 발생시킵니다.
+    """
+    if not prompt_columns.get("프롬프트"):
+        raise ValueError("system_prompt_린 시트에 '프롬프트' 컬럼이 없습니다.")
+    missing = [name for name in REQUIRED_LINE_COLUMNS if name not in line_columns]
+    if missing:
+        raise ValueError(f"lines_린 시트에 필요한 컬럼이 없습니다: {', '.join(missing)}")
+    if not line_columns["대사"]:
+        raise ValueError("lines_린 시트에 대사가 없습니다.")
+
+def build_character_data():
+    """
+    대사 데이터를 읽고 검증한 뒤 대사 저장소와 후보 색인, 유사도 색인까지 만들어 반환합니다.
+    전역 상태를 건드리지 않아 워커 스레드에서 실행할 수 있습니다.
+    """
+    fingerprints = source_fingerprints()
+    data = load_dialogue_data(DIALOGUE_SNAPSHOT_PATH, CHARACTER_TABLE_PATH, REACTIVE_TABLE_PATH, write=LINE_STORE_WRITER)
+    validate_character_data(data["prompt"], data["lines"])
+    dialogue_store = DialogueStore.from_columns(data["lines"])
+
+    # 아직 엑셀에 반영되지 않은 저널 대사 병합
+    for row in line_journal.rows():
+        if row["대사"] not in dialogue_store:
+            dialogue_store.append(row)
+    system_prompt = data["prompt"]["프롬프트"][0]
+    candidate_index = CandidateIndex.from_store(dialogue_store)
+    similarity_index = SimilarityIndex.from_store(dialogue_store, SIMILARITY_DIMS)
+    return dialogue_store, system_prompt, candidate_index, similarity_index, fingerprints
+
 # 캐릭터 데이터 로드: system_prompt와 대사 DB 모두 포함
 def load_character_data():
     try:
-        df_prompt = pd.read_excel("character_table_flowtagged.xlsx", sheet_name="system_prompt_린")
-        # 'lines_린' 시트는 여자친구 모드 대사(반응형, is_initiator == False)와 린이 먼저 말 거는 대사( is_initiator == True) 모두 포함
-        df_lines_initiator = pd.read_excel("character_table_flowtagged.xlsx", sheet_name="lines_린")
-        df_lines_reactive = pd.read_excel("girlfriend_mode_reactive_200.xlsx", sheet_name="lines_린")
-        df_lines = pd.concat([df_lines_initiator, df_lines_reactive], ignore_index=True)
-        system_prompt = df_prompt.iloc[0]["프롬프트"]
+        character_data = build_character_data()
         logger.info("캐릭터 데이터 로드 성공")
-        return df_prompt, df_lines, system_prompt
+        return character_data
     except Exception as e:
         logger.error(f"캐릭터 데이터 로드 오류: {str(e)}")
         # 기본값 반환
-        return pd.DataFrame(), pd.DataFrame(), "나는 린, 여자친구 역할을 하는 AI 어시스턴트야."
+        return DialogueStore(), "나는 린, 여자친구 역할을 하는 AI 어시스턴트야.", CandidateIndex(), SimilarityIndex(SIMILARITY_DIMS), {}
 
-df_prompt, df_lines, system_prompt = load_character_data()
-emotion_cache = {}
+dialogue_store, system_prompt, candidate_index, similarity_index, loaded_fingerprints = load_character_data()
+character_data_version = 0  # 리로드로 데이터를 교체할 때마다 1씩 증가
+reload_lock = asyncio.Lock()
+# 키워드 분류표 로드: 감정/감정 강도/대화 흐름/상황 분류를 한 번의 스캔으로 처리
+try:
+    keyword_classifier = KeywordClassifier.from_file(os.getenv("CLASSIFIER_KEYWORDS_PATH", "classifier_keywords.json"))
+    logger.info("키워드 분류표 로드 성공")
+except Exception as e:
+    logger.critical(f"키워드 분류표 로드 실패: {str(e)}")
+    raise
 
-def classify_emotion_with_cache(message):
-    """
-    메시지의 감정을 분석하여 분류합니다. 캐시를 통해 이미 분석한 메시지는 재활용합니다.
-    """
-    try:
-        if message in emotion_cache:
-            return emotion_cache[message]
-
-        text = message.lower()
-        emotion = "조심스러움"  # 기본값
-
-        emotion_keywords = {
-            "기쁨": ["안녕", "하이", "반가워", "좋은 아침", "잘 잤어", "웃어", "기쁘다", "좋아"],
-            "애정": ["사랑해", "좋아해", "보고 싶어", "너밖에 없어", "함께 있고 싶어"],
-            "설렘": ["두근", "설레", "떨려", "긴장"],
-            "감동": ["고마워", "감사", "감동"],
-        }
-
-        for emo, keywords in emotion_keywords.items():
-            if any(kw in text for kw in keywords):
-                emotion = emo
-                break
-
-        emotion_cache[message] = emotion
-        return emotion
-    except Exception as e:
-        logger.error(f"감정 분류 중 오류: {str(e)}")
-        return "조심스러움"  # 오류 발생 시 기본값 반환
+# 유저 메시지와 린의 대사에 적용하는 분류표
+MESSAGE_TASKS = ("emotion", "emotion_level", "user_flow")
+LINE_TASKS = ("situation", "conversational_flow")
 
-def analyze_emotion_level(text):
-    """
-    텍스트의 감정 강도를 분석합니다.
-    """
-    try:
-        text = text.lower()
-        high_keywords = ["사랑", "좋아해", "고백", "소중한", "널 좋아해"]
-        medium_keywords = ["보고 싶어", "기다렸어", "설레", "감동", "그리워"]
-        if any(word in text for word in high_keywords):
-            return "very_high"
-        elif any(word in text for word in medium_keywords):
-            return "high"
-        elif "?" in text:
-            return "low"
-        else:
-            return "very_low"
-    except Exception as e:
-        logger.error(f"감정 수준 분석 중 오류: {str(e)}")
-        return "very_low"  # 오류 발생 시 기본값 반환
+# 분류 결과 캐시: 정규화한 텍스트 기준, 최대 항목 수와 TTL(초, 0이면 만료 없음)로 메모리 사용량 제한
+CLASSIFIER_CACHE_SIZE = int(os.getenv("CLASSIFIER_CACHE_SIZE", "10000"))
+CLASSIFIER_CACHE_TTL = float(os.getenv("CLASSIFIER_CACHE_TTL", "3600"))
+classifier_cache = BoundedCache(maxsize=CLASSIFIER_CACHE_SIZE, ttl=CLASSIFIER_CACHE_TTL or None)
 
-def classify_situation(line):
+@cached(classifier_cache)
+def analyze_message(message):
     """
-    텍스트의 상황을 분류합니다.
+    유저 메시지를 한 번만 훑어 감정, 감정 강도, 대화 흐름을 함께 분석합니다.
     """
     try:
-        text = str(line).lower()
-        if any(kw in text for kw in ["안녕", "하이", "좋은 아침", "잘 잤어", "반가워"]):
-            return "인사"
-        elif any(kw in text for kw in ["사랑", "고백", "좋아해", "보고 싶어"]):
-            return "애정 표현"
-        elif any(kw in text for kw in ["생일", "축하", "기념일", "선물"]):
-            return "기념일/축하"
-        elif any(kw in text for kw in ["왜", "무슨", "뭐야", "언제"]):
-            return "질문 응답"
-        else:
-            return "일반"
+        return keyword_classifier.classify(message, MESSAGE_TASKS)
     except Exception as e:
-        logger.error(f"상황 분류 중 오류: {str(e)}")
-        return "일반"  # 오류 발생 시 기본값 반환
+        logger.error(f"메시지 분석 중 오류: {str(e)}")
+        return {"emotion": "조심스러움", "emotion_level": "very_low", "user_flow": "일반"}
 
+@cached(classifier_cache)
 def guess_user_flow(message):
     """
     사용자 메시지의 의도와 흐름을 분석합니다.
     """
     try:
-        text = message.lower()
-
-        flow_keywords = {
-            "질문형": ["?", "왜", "무슨", "어떻게", "언제", "뭐야", "그게"],
-            "요청형": ["도와줘", "해줘", "줄래", "좀", "같이", "해줄 수 있어"],
-            "감정표현": ["슬퍼", "기뻐", "짜증", "좋아해", "사랑해", "보고 싶어", "설레", "긴장"],
-            "상황시작형": ["안녕", "하이", "처음", "반가워", "잘 잤어", "굿모닝"],
-        }
-
-        for flow, keywords in flow_keywords.items():
-            if any(kw in text for kw in keywords):
-                return flow
-
-        return "일반"
+        return keyword_classifier.classify(message, ("user_flow",))["user_flow"]
     except Exception as e:
         logger.error(f"사용자 흐름 추측 중 오류: {str(e)}")
         return "일반"  # 오류 발생 시 기본값 반환
 
-def get_response_by_emotion_and_context(df_lines, emotion, user_message):
+@cached(classifier_cache)
+def classify_line(line):
     """
-    감정과 문맥에 맞는 응답 후보를 반환합니다.
+    린의 대사를 한 번만 훑어 상황과 대화 흐름을 함께 분류합니다.
     """
     try:
-        user_flow = guess_user_flow(user_message)
-
-        filtered = df_lines[df_lines["is_initiator"] == False]
-
-        if user_flow == "상황시작형":
-            filtered = filtered[filtered["상황"].str.contains("인사", na=False)]
-        elif user_flow == "질문형":
-            filtered = filtered[filtered["대화 흐름"] != "회피형"]
-        elif user_flow == "요청형":
-            filtered = filtered[filtered["대화 흐름"].isin(["반응형", "자기감정표현"])]
-        elif user_flow == "감정표현":
-            filtered = filtered[filtered["대화 흐름"].isin(["반응형", "자기감정표현", "일반"])]
-
-        filtered = filtered[filtered["감정"].str.lower() == emotion.lower()]
-        return filtered
+        return keyword_classifier.classify(line, LINE_TASKS)
     except Exception as e:
-        logger.error(f"감정 및 문맥별 응답 검색 중 오류: {str(e)}")
-        return pd.DataFrame()  # 오류 발생 시 빈 DataFrame 반환
+        logger.error(f"대사 분류 중 오류: {str(e)}")
+        return {"situation": "일반", "conversational_flow": "일반"}
 
-def classify_conversational_flow(line):
+# 유저 흐름별 후보 대사 조건: (대화 흐름, 상황) -> 포함 여부
+flow_filters = {
+    "상황시작형": lambda flow, situation: situation is not None and "인사" in situation,
+    "질문형": lambda flow, situation: flow != "회피형",
+    "요청형": lambda flow, situation: flow in ("반응형", "자기감정표현"),
+    "감정표현": lambda flow, situation: flow in ("반응형", "자기감정표현", "일반"),
+}
+
+def get_response_by_emotion_and_context(dialogue_store, candidate_index, emotion, user_message, user_flow=None, similarity_index=None):
     """
-    대화의 흐름과 유형을 분류합니다.
+    감정과 문맥에 맞는 응답 후보의 행 위치를 오름차순 목록으로 반환합니다. 이미 분석한 user_flow가 있으면 다시 분석하지 않습니다.
+    similarity_index가 있고 감정이 같은 후보가 부족하면, 흐름 조건만 맞는 대사 중 유저 발화와 비슷한 대사를 더합니다.
     """
     try:
-        line = str(line)
-        if any(kw in line for kw in ["왜", "뭐", "무슨", "어떻게", "언제", "그게", "그래서"]) or line.strip().endswith("?"):
-            return "질문형"
-        elif any(kw in line for kw in ["흥", "됐거든", "됐어", "하아", "짜증", "말하기도 싫다", "그만해"]):
-            return "회피형"
-        elif any(kw in line for kw in ["알겠어", "그래", "응", "좋아", "해줄게", "고마워", "미안", "맞아", "정말"]):
-            return "반응형"
-        elif any(kw in line for kw in ["난", "나는", "내가", "기분", "꿈", "오늘", "생각", "느낌", "내일", "기억"]):
-            return "자기감정표현"
-        elif any(kw in line for kw in ["생일", "축하", "기념일", "소개", "처음", "반가워"]):
-            return "상황시작형"
-        else:
-            return "일반"
+        if user_flow is None:
+            user_flow = guess_user_flow(user_message)
+        flow_filter = flow_filters.get(user_flow)
+        positions = candidate_index.lookup(False, emotion, flow_filter)
+        if similarity_index is not None and len(positions) < RETRIEVAL_MIN_POOL:
+            related = candidate_index.lookup(False, None, flow_filter)
+            similar = similarity_index.search(user_message, related, RETRIEVAL_TOP_K, RETRIEVAL_MIN_SCORE)
+            retrievals.inc(result="added" if similar else "empty")
+            positions = sorted(set(positions).union(position for position, _ in similar))
+        return positions
     except Exception as e:
-        logger.error(f"대화 흐름 분류 중 오류: {str(e)}")
-        return "일반"  # 오류 발생 시 기본값 반환
+        logger.error(f"감정 및 문맥별 응답 검색 중 오류: {str(e)}")
+        return []  # 오류 발생 시 빈 목록 반환
 
 ##############################################
 # 새롭게 통합한 Claude 프롬프트 템플릿 및 평가 함수 #
@@ -271,75 +473,170 @@ def build_claude_prompt(user_input, candidates, emotion, emotion_level, user_flo
 """
     return prompt
 
-def evaluate_candidate_responses(user_input, candidates, emotion, emotion_level, user_flow, conversation_count):
+async def evaluate_candidate_responses(user_input, candidates, emotion, emotion_level, user_flow, conversation_count):
     """
     새롭게 구성한 프롬프트 템플릿을 사용하여 Claude API로부터 후보 대사 평가 결과를 받습니다.
+    API 호출이 끝내 실패하면 예외를 그대로 전달합니다.
     """
     prompt = build_claude_prompt(user_input, candidates, emotion, emotion_level, user_flow, conversation_count)
-    
-    max_retries = 3
-    retry_delay = 1  # 초 단위 재시도 간격
-    
-    for attempt in range(max_retries):
-        try:
-            message = client.messages.create(
-                model="claude-3-haiku-20240307",  # 사용중인 Claude 모델
-                max_tokens=100,
-                temperature=0.5,
-                system="후보 대사 중에서 가장 적절한 것을 선택하세요.",
-                messages=[
-                    {"role": "user", "content": prompt}
-                ],
-                timeout=30  # 30초 타임아웃 설정
-            )
-            
-            answer = message.content[0].text.strip()
-            
-            # 후보 대사 중 직접 언급된 대사가 있으면 선택
-            for cand in candidates:
-                if cand.strip() in answer:
-                    return cand.strip()
-            
-            if answer == "없음":
-                return None
-            
-            # 숫자 인덱스 형태의 응답 처리
-            try:
-                idx = int(answer)
-                if 1 <= idx <= len(candidates):
-                    return candidates[idx - 1].strip()
-            except:
-                pass
-            
-            return None
-            
-        except anthropic.APITimeoutError:
-            logger.warning(f"Claude API 타임아웃. 재시도 {attempt+1}/{max_retries}")
-            time.sleep(retry_delay)
-            retry_delay *= 2  # 지수 백오프 적용
-            
-        except anthropic.APIError as e:
-            logger.error(f"Claude API 호출 오류: {str(e)}")
-            if attempt < max_retries - 1:
-                logger.info(f"재시도 {attempt+1}/{max_retries}")
-                time.sleep(retry_delay)
-                retry_delay *= 2
-            else:
-                logger.error("최대 재시도 횟수 초과")
-                return None
-                
-        except Exception as e:
-            logger.error(f"후보 대사 평가 중 오류: {str(e)}")
-            return None
-            
+
+    message = await request_claude(
+        kind="selection",
+        model="claude-3-haiku-20240307",  # 사용중인 Claude 모델
+        max_tokens=100,
+        temperature=0.5,
+        system="후보 대사 중에서 가장 적절한 것을 선택하세요.",
+        messages=[
+            {"role": "user", "content": prompt}
+        ]
+    )
+
+    answer = message.content[0].text.strip()
+
+    # 후보 대사 중 직접 언급된 대사가 있으면 선택
+    for cand in candidates:
+        if cand.strip() in answer:
+            return cand.strip()
+
+    if answer == "없음":
+        selection_none.inc()
+        return None
+
+    # 숫자 인덱스 형태의 응답 처리
+    try:
+        idx = int(answer)
+        if 1 <= idx <= len(candidates):
+            return candidates[idx - 1].strip()
+    except:
+        pass
+
     return None
 
+# 후보 선택 결과 캐시: 같은 입력/후보/분석 조합이면 Claude 호출 없이 이전 선택을 재사용
+SELECTION_CACHE_SIZE = int(os.getenv("SELECTION_CACHE_SIZE", "5000"))
+SELECTION_CACHE_TTL = float(os.getenv("SELECTION_CACHE_TTL", "900"))
+selection_cache = BoundedCache(maxsize=SELECTION_CACHE_SIZE, ttl=SELECTION_CACHE_TTL or None)
+selection_cache_counters = {"api_calls_avoided": 0, "redundant_hits": 0}
+CANDIDATE_TOP_K = int(os.getenv("CANDIDATE_TOP_K", "12"))  # 선택 프롬프트에 넣을 최대 후보 수 (0 이하이면 제한 없음)
+_NOT_CACHED = object()
+
+def selection_signature(user_input, positions, emotion, emotion_level, user_flow, conversation_count):
+    """
+    후보 선택 캐시 키를 만듭니다. 후보 집합은 중복 필터 전의 전체 풀로 해시해 최근 응답이 바뀌어도 키가 유지되게 합니다.
+    행 위치는 리로드하면 다른 대사를 가리킬 수 있으므로 캐릭터 데이터 세대도 키에 넣습니다.
+    """
+    input_fingerprint = hashlib.sha1(normalize_text(user_input).encode("utf-8")).hexdigest()
+    candidate_hash = hashlib.sha1(array("I", positions).tobytes()).hexdigest()
+    conversation_stage = min(conversation_count // 4, 3)  # 대화 누적 횟수는 구간으로만 구분
+    return (character_data_version, input_fingerprint, candidate_hash, emotion, emotion_level, user_flow, conversation_stage)
+
+async def select_candidate_response(session, user_input, store, similarity, positions, emotion, emotion_level, user_flow,
+                                    before_evaluate=None):
+    """
+    중복되지 않은 후보 중에서 응답을 고릅니다. 캐시에 같은 조건의 선택 결과가 있으면 API 호출을 건너뜁니다.
+    캐시된 대사가 그사이 최근 응답과 겹치게 되었다면 캐시를 쓰지 않고 다시 평가합니다.
+    positions는 store의 후보 행 위치이고 similarity는 같은 세대의 유사도 색인이며, before_evaluate는 Claude에 평가를 요청하기 직전에 호출됩니다.
+    """
+    conversation_count = session.conversation_count
+    signature = selection_signature(user_input, positions, emotion, emotion_level, user_flow, conversation_count)
+    cached_choice = selection_cache.get(signature, _NOT_CACHED)
+    if cached_choice is not _NOT_CACHED:
+        if cached_choice is None or not session.is_redundant_response(cached_choice):
+            selection_cache_counters["api_calls_avoided"] += 1
+            if cached_choice is not None:
+                reply_sources.inc(source="selection_cache")
+            return cached_choice
+        selection_cache_counters["redundant_hits"] += 1
+
+    # 선택 프롬프트 크기를 줄이기 위해 최근 응답과 겹치지 않는 후보 중 로컬 점수 상위 후보만 Claude에 전달
+    ranked = rank_positions(user_input, positions, store, similarity, CANDIDATE_TOP_K, user_flow, emotion,
+                            session.recent_responses, skip=session.is_redundant_response)
+    if not ranked:
+        return None
+    candidate_list = store.lines_at(ranked)
+    if len(positions) > len(candidate_list):
+        logger.info(f"후보 대사 {len(positions)}개 중 상위 {len(candidate_list)}개만 평가")
+
+    if before_evaluate is not None:
+        before_evaluate()
+    try:
+        with stage_latency.time(stage="selection"):
+            evaluated = await evaluate_candidate_responses(user_input, candidate_list, emotion, emotion_level, user_flow, conversation_count)
+    except CircuitOpenError:
+        logger.warning("Claude API 회로 차단 중이라 후보 대사 평가를 건너뜁니다.")
+        return None
+    except anthropic.APIError as e:
+        logger.error(f"후보 대사 평가 실패: {str(e)}")
+        return None  # 실패한 결과는 캐시하지 않음
+    except Exception as e:
+        logger.error(f"후보 대사 평가 중 오류: {str(e)}")
+        return None
+
+    selection_cache.set(signature, evaluated)
+    speculation_policy.record_selection(evaluated is not None)
+    if evaluated is not None:
+        reply_sources.inc(source="candidate")
+    return evaluated
+
+def pick_local_response(session, user_input, emotion, user_flow):
+    """
+    Claude API를 쓸 수 없을 때 대사 저장소의 반응형 대사 중에서 로컬 점수가 가장 높은 대사를 고릅니다.
+    감정과 흐름이 모두 맞는 대사가 없으면 흐름만, 그것도 없으면 전체 반응형 대사에서 고릅니다.
+    """
+    flow_filter = flow_filters.get(user_flow)
+    positions = (candidate_index.lookup(False, emotion, flow_filter)
+                 or candidate_index.lookup(False, None, flow_filter)
+                 or candidate_index.lookup(False))
+    if not positions:
+        return None
+    ranked = (rank_positions(user_input, positions, dialogue_store, similarity_index, 1, user_flow, emotion,
+                             session.recent_responses, skip=session.is_redundant_response)
+              or rank_positions(user_input, positions, dialogue_store, similarity_index, 1, user_flow, emotion,
+                                session.recent_responses))
+    return dialogue_store.lines[ranked[0]]
+
+def schedule_summary(channel_id, session):
+    """
+    요약 대기열에 대화가 있고 그 채널의 요약 갱신이 진행 중이 아니면 백그라운드에서 갱신을 시작합니다.
+    """
+    if session.pending_summary and channel_id not in summary_tasks:
+        summary_tasks[channel_id] = asyncio.create_task(refresh_summary(channel_id, session))
+
+async def refresh_summary(channel_id, session):
+    """
+    기존 요약에 요약 대기열의 대화를 반영해 새 요약을 만듭니다. 실패하면 대기열을 그대로 두고 다음 턴에 다시 시도합니다.
+    """
+    try:
+        folded = list(session.pending_summary)
+        request = build_summary_request(
+            session.summary,
+            folded,
+            max_chars=SUMMARY_MAX_CHARS,
+            model="claude-3-haiku-20240307",
+            max_tokens=SUMMARY_MAX_CHARS * 2,
+            temperature=0.2
+        )
+        response = await request_claude(max_retries=1, kind="summary", **request)
+        memory_stats.record_summary(response.usage)
+        session.apply_summary(response.content[0].text.strip(), folded)
+    except CircuitOpenError:
+        pass
+    except anthropic.APIError as e:
+        logger.warning(f"대화 요약 갱신 실패 (채널: {channel_id}): {str(e)}")
+    except Exception as e:
+        logger.error(f"대화 요약 갱신 중 오류 (채널: {channel_id}): {str(e)}")
+    finally:
+        summary_tasks.pop(channel_id, None)
+
 ##############################################
 # Discord 봇 설정 및 이벤트 핸들러           #
 ##############################################
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix="!", intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS or None)
+else:
+    bot = commands.Bot(command_prefix="!", intents=intents)
 
 # 대상 채널 설정 (여자친구 모드 대사 발화를 위한 채널)
 TARGET_CHANNEL_ID = 1353766662553468958
@@ -351,22 +648,42 @@ async def on_ready():
     """
     try:
         logger.info(f"봇 온라인: {bot.user}")
+        if SHARD_COUNT:
+            logger.info(f"샤드 {SHARD_IDS or '전체'} / {SHARD_COUNT}개 담당, 엑셀 기록 담당: {LINE_STORE_WRITER}")
         
-        if not check_user_response.is_running():
-            check_user_response.start()
-            logger.info("사용자 응답 체크 태스크 시작")
+        global nudge_task, metrics_server
+        if METRICS_PORT and metrics_server is None:
+            try:
+                metrics_server = await start_http_server(metrics_registry, METRICS_HOST, METRICS_PORT)
+                logger.info(f"지표 엔드포인트 시작: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+            except OSError as e:
+                logger.error(f"지표 엔드포인트 시작 중 오류: {str(e)}")
+
+        if nudge_task is None:
+            nudge_task = asyncio.create_task(nudge_scheduler.run())
+            logger.info("자동 메시지 스케줄러 시작")
             
         if not reload_character_data.is_running():
             reload_character_data.start()
             logger.info("캐릭터 데이터 리로드 태스크 시작")
+
+        if not flush_line_journal.is_running():
+            flush_line_journal.start()
+            logger.info("대사 저널 기록 태스크 시작")
+
+        if LINE_STORE_WRITER and not compact_line_journal.is_running():
+            compact_line_journal.start()
+            logger.info("대사 저널 엑셀 반영 태스크 시작")
+
+        if not maintain_sessions.is_running():
+            maintain_sessions.start()
+            logger.info("대화 세션 정리 태스크 시작")
             
     except Exception as e:
         logger.error(f"봇 초기화 중 오류: {str(e)}")
 
 @bot.event
 async def on_message(message):
-    global conversation_history, last_message_time, last_bot_message
-    
     author = getattr(message, 'author', None)
     if author is None:
         logger.error("메시지에서 author 속성을 찾을 수 없습니다.")
@@ -380,56 +697,52 @@ async def on_message(message):
         logger.error("메시지에서 채널 ID를 찾을 수 없습니다.")
         return
         
-    last_message_time[channel_id] = datetime.now()
+    nudge_scheduler.user_spoke(channel_id)
     
     user_input = message.content.strip() if hasattr(message, 'content') else ""
     if not user_input:
         logger.error("메시지에서 content 속성을 찾을 수 없거나 내용이 비어 있습니다.")
         return
-    
-    emotion = classify_emotion_with_cache(user_input)
-    emotion_level = analyze_emotion_level(user_input)
-    user_flow = guess_user_flow(user_input)
-    
-    pool = get_response_by_emotion_and_context(df_lines, emotion, user_input)
-    reply = ""
-    if not pool.empty:
-        candidate_list = [cand for cand in pool["대사"].tolist() if not is_redundant_response(cand)]
-        if candidate_list:
-            conversation_count = len(conversation_history) // 2  # 유저와 린 간의 대화 횟수 계산
-            evaluated = evaluate_candidate_responses(user_input, candidate_list, emotion, emotion_level, user_flow, conversation_count)
-            if evaluated is not None:
-                reply = evaluated
 
-    if not reply:
-        history = []
-        for item in conversation_history[-8:]:
-            history.append({"role": item["role"], "content": item["content"]})
-            
-        if user_flow == "질문형":
-            instructions = """- 유저가 질문했어. 회피하지 말고 정확하게 답해.
+    # 같은 채널의 연속 메시지는 대기열에서 한 턴으로 합쳐 순서대로 처리
+    channel_queue.submit(channel_id, user_input)
+
+    try:
+        await bot.process_commands(message)
+    except Exception as e:
+        logger.error(f"명령어 처리 중 오류: {str(e)}")
+
+def build_generation_request(session, user_input, emotion, emotion_level, user_flow):
+    """
+    유저 발화와 분석 결과, 채널의 대화 기억으로 대사 생성 요청 인자를 만듭니다. 보낼 대화 이력도 함께 반환합니다.
+    """
+    # 최근 이력은 그대로, 그 이전 대화는 요약으로 토큰 예산 안에서 전달
+    history = session.memory_window(MEMORY_TOKEN_BUDGET)
+        
+    if user_flow == "질문형":
+        instructions = """- 유저가 질문했어. 회피하지 말고 정확하게 답해.
 - 린답게 시크하거나 츤데레처럼 말하되, 질문의 핵심은 놓치지 마."""
-        elif user_flow == "감정표현":
-            instructions = """- 유저가 감정을 드러냈어. 공감하거나 짧고 쿨하게 반응해.
+    elif user_flow == "감정표현":
+        instructions = """- 유저가 감정을 드러냈어. 공감하거나 짧고 쿨하게 반응해.
 - 말 돌리거나 되묻지 마. 한마디로 린스럽게 반응해."""
-        elif user_flow == "요청형":
-            instructions = """- 유저가 뭔가 부탁했어. 가능하면 도와주되, 린답게 툭툭거리면서도 챙겨주는 느낌으로."""
-        elif user_flow == "상황시작형":
-            instructions = """- 유저가 먼저 인사했어. 린답게 자연스럽게 인사 받아줘.
+    elif user_flow == "요청형":
+        instructions = """- 유저가 뭔가 부탁했어. 가능하면 도와주되, 린답게 툭툭거리면서도 챙겨주는 느낌으로."""
+    elif user_flow == "상황시작형":
+        instructions = """- 유저가 먼저 인사했어. 린답게 자연스럽게 인사 받아줘.
 - 너무 감정적으로 몰입하지 말고, 평소처럼 귀엽거나 시크하게 대응해."""
-        else:
-            instructions = """- 일반 대화야. 린 특유의 성격을 유지해서 자연스럽게 이어가."""
-            
-        if emotion_level == "very_high":
-            extra_instructions = "유저의 감정이 매우 강하게 드러났으니, 진심 어린 따뜻한 응답을 해줘."
-        elif emotion_level == "high":
-            extra_instructions = "유저의 감정이 다소 강하게 나타났으니, 부드럽고 따뜻하게 응답해줘."
-        elif emotion_level == "low":
-            extra_instructions = "유저의 발화가 단순한 질문이나 평범한 인사라면, 간결하게 응답해."
-        else:
-            extra_instructions = "유저 발화에 감정 표현이 거의 없으니, 간단한 인사 정도로 응답해."
-            
-        user_message = f"""
+    else:
+        instructions = """- 일반 대화야. 린 특유의 성격을 유지해서 자연스럽게 이어가."""
+        
+    if emotion_level == "very_high":
+        extra_instructions = "유저의 감정이 매우 강하게 드러났으니, 진심 어린 따뜻한 응답을 해줘."
+    elif emotion_level == "high":
+        extra_instructions = "유저의 감정이 다소 강하게 나타났으니, 부드럽고 따뜻하게 응답해줘."
+    elif emotion_level == "low":
+        extra_instructions = "유저의 발화가 단순한 질문이나 평범한 인사라면, 간결하게 응답해."
+    else:
+        extra_instructions = "유저 발화에 감정 표현이 거의 없으니, 간단한 인사 정도로 응답해."
+        
+    user_message = f"""
 [유저 발화]
 {user_input}
 
@@ -444,155 +757,387 @@ async def on_message(message):
 - 대답은 1~2문장으로 짧고 임팩트 있게, 상대방에게 사랑스러움을 전달해.
 """
 
-        max_retries = 3
-        retry_delay = 1
-        
-        for attempt in range(max_retries):
+    request = build_cached_request(
+        system_prompt,
+        history,
+        user_message,
+        summary=session.summary,
+        model="claude-3-haiku-20240307",
+        max_tokens=300,
+        temperature=0.7
+    )
+    return history, request
+
+async def respond_to_turn(channel_id, user_inputs):
+    """
+    채널 대기열에서 합쳐진 유저 메시지들에 대해 분류 → 후보 선택 → 생성 → 전송을 수행합니다.
+    """
+    user_input = "\n".join(user_inputs)
+    session = session_store.get(channel_id)
+    with stage_latency.time(stage="classify"):
+        analysis = analyze_message(user_input)
+    emotion = analysis["emotion"]
+    emotion_level = analysis["emotion_level"]
+    user_flow = analysis["user_flow"]
+    
+    channel = bot.get_channel(channel_id)
+    with stage_latency.time(stage="candidate_lookup"):
+        # 리로드로 전역 데이터가 바뀌어도 이번 턴은 같은 세대의 저장소와 색인을 씀
+        store, similarity = dialogue_store, similarity_index
+        pool_positions = get_response_by_emotion_and_context(store, candidate_index, emotion, user_input, user_flow,
+                                                             similarity if RETRIEVAL_MIN_POOL else None)
+    reply = ""
+    streamed = None  # 스트리밍으로 이미 채널에 보낸 응답
+    history = request = None
+    speculative = None  # 후보 평가와 동시에 시작한 대사 생성 태스크
+    speculative_started_at = None
+
+    def start_speculative_generation():
+        nonlocal history, request, speculative, speculative_started_at
+        if speculation_policy.should_speculate():
+            history, request = build_generation_request(session, user_input, emotion, emotion_level, user_flow)
+            speculation_policy.record_start()
+            speculative_started_at = time.perf_counter()
+            speculative = asyncio.create_task(request_claude(**request))
+
+    if pool_positions:
+        evaluated = await select_candidate_response(session, user_input, store, similarity, pool_positions, emotion,
+                                                    emotion_level, user_flow, before_evaluate=start_speculative_generation)
+        if evaluated is not None:
+            reply = evaluated
+
+    if speculative is not None and reply:
+        # 후보 대사를 쓰게 되었으므로 생성 요청은 취소 (이미 끝났다면 결과만 버림)
+        finished = speculative.done()
+        speculative.cancel()
+        speculative.add_done_callback(lambda task: task.cancelled() or task.exception())
+        speculation_policy.record_result(used=False, finished=finished)
+        speculative_generations.inc(outcome="discarded" if finished else "cancelled")
+        speculative = None
+
+    if not reply:
+        if request is None:
+            history, request = build_generation_request(session, user_input, emotion, emotion_level, user_flow)
+        memory_stats.record_request(*session.memory_usage(history))
+        fallback_usage.record_prefix(cached_prefix_tokens(request), PROMPT_CACHE_MIN_TOKENS)
+        generation_started_at = speculative_started_at or time.perf_counter()
+        if speculative is not None:
+            # 후보 평가와 함께 이미 보낸 생성 요청의 결과를 기다림 (스트리밍하지 않음)
+            speculation_policy.record_result(used=True, finished=speculative.done())
+            speculative_generations.inc(outcome="used")
+        elif STREAM_REPLIES and channel:
             try:
-                message_response = client.messages.create(
-                    model="claude-3-haiku-20240307",
-                    max_tokens=300,
-                    temperature=0.7,
-                    system=system_prompt,
-                    messages=[
-                        *history,
-                        {"role": "user", "content": user_message}
-                    ],
-                    timeout=30
-                )
-                
-                reply = message_response.content[0].text.strip()
-                break
-                
-            except anthropic.APITimeoutError:
-                logger.warning(f"Claude API 타임아웃. 재시도 {attempt+1}/{max_retries}")
-                time.sleep(retry_delay)
-                retry_delay *= 2
-                
-            except anthropic.APIError as e:
-                logger.error(f"Claude API 호출 오류: {str(e)}")
-                if attempt < max_retries - 1:
-                    logger.info(f"재시도 {attempt+1}/{max_retries}")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2
-                else:
-                    logger.error("최대 재시도 횟수 초과")
-                    reply = "네트워크 오류가 발생했어. 잠시 후에 다시 말해줄래?"
-                    
+                streamed = await stream_claude_reply(channel, request)
+                reply = streamed.raw_text.strip()
+                reply_sources.inc(source="stream")
             except Exception as e:
-                logger.error(f"메시지 생성 중 오류: {str(e)}")
-                reply = "죄송해요, 응답을 생성하는 중에 오류가 발생했어요."
-                break
-        
-        conversation_history.append({"role": "user", "content": user_input})
-        conversation_history.append({"role": "assistant", "content": reply})
-        if len(conversation_history) > 16:
-            conversation_history = conversation_history[-16:]
+                logger.warning(f"스트리밍 응답 실패, 일반 요청으로 재시도합니다: {str(e)}")
+
+        try:
+            if speculative is not None:
+                message_response = await speculative
+                fallback_usage.record(message_response.usage, time.perf_counter() - speculative_started_at)
+                reply = message_response.content[0].text.strip()
+                reply_sources.inc(source="generation")
+            elif streamed is None:
+                started_at = time.perf_counter()
+                message_response = await request_claude(**request)
+                fallback_usage.record(message_response.usage, time.perf_counter() - started_at)
+                reply = message_response.content[0].text.strip()
+                reply_sources.inc(source="generation")
+
+        except CircuitOpenError:
+            # API가 불안정한 동안에는 기다리지 않고 로컬 대사로 응답
+            reply = pick_local_response(session, user_input, emotion, user_flow) or "네트워크 오류가 발생했어. 잠시 후에 다시 말해줄래?"
+            reply_sources.inc(source="local")
+            logger.warning("Claude API 회로 차단 중이라 로컬 대사로 응답합니다.")
+
+        except anthropic.APIError as e:
+            logger.error(f"응답 생성 실패: {str(e)}")
+            reply = "네트워크 오류가 발생했어. 잠시 후에 다시 말해줄래?"
+
+        except Exception as e:
+            logger.error(f"메시지 생성 중 오류: {str(e)}")
+            reply = "죄송해요, 응답을 생성하는 중에 오류가 발생했어요."
+        stage_latency.observe(time.perf_counter() - generation_started_at, stage="generation")
+
+        session.add_turn(user_input, reply)
+        schedule_summary(channel_id, session)
             
-        if reply not in df_lines["대사"].values:
+        persistence_started_at = time.perf_counter()
+        # 중간에 끊긴 스트리밍 응답은 다른 유저에게 후보로 나가지 않도록 저장하지 않음
+        if (streamed is None or streamed.completed) and reply not in dialogue_store:
             try:
+                line_labels = classify_line(reply)
                 new_row = {
-                    "상황": classify_situation(reply),
+                    "상황": line_labels["situation"],
                     "말투/성격": "Claude",
                     "대사": reply,
                     "감정": emotion,
                     "감정/톤": emotion,
-                    "대화 흐름": classify_conversational_flow(reply),
+                    "대화 흐름": line_labels["conversational_flow"],
                     "is_initiator": False
                 }
-                df_lines.loc[len(df_lines)] = new_row
-                with pd.ExcelWriter("character_table_flowtagged.xlsx", engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
-                    df_lines.to_excel(writer, sheet_name="lines_린", index=False)
-                logger.info("새로운 대사 저장 완료")
+                position = dialogue_store.append(new_row)
+                candidate_index.add(position, new_row)
+                similarity_index.add(position, reply)
+                line_journal.append(new_row)
+                logger.info("새로운 대사 저널 추가 완료")
             except Exception as e:
                 logger.error(f"대사 저장 중 오류: {str(e)}")
+        stage_latency.observe(time.perf_counter() - persistence_started_at, stage="persistence")
     
-    reply = replace_repetitive_phrases(reply)
-    update_response_cache(reply)
-    last_bot_message[channel_id] = datetime.now()
-    
-    channel = bot.get_channel(channel_id)
-    if channel:
-        clean_reply = reply
-        if clean_reply.startswith('"') and clean_reply.endswith('"'):
-            clean_reply = clean_reply[1:-1]
-        elif clean_reply.startswith('"'):
-            clean_reply = clean_reply[1:]
-        elif clean_reply.endswith('"'):
-            clean_reply = clean_reply[:-1]
-        
-        if clean_reply.startswith("[린의 응답]"):
-            clean_reply = clean_reply[len("[린의 응답]"):].lstrip()
-            
-        await channel.send(clean_reply)
+    if streamed is not None:
+        reply = streamed.processed_text.strip()  # 문장 단위로 이미 치환됨
     else:
+        reply = replace_repetitive_phrases(reply)
+    session.update_response_cache(reply)
+    nudge_scheduler.bot_spoke(channel_id)
+    
+    if not channel:
         logger.error(f"채널 ID {channel_id}에 대한 채널을 찾을 수 없습니다.")
-        
+    elif streamed is None:
+        with stage_latency.time(stage="send"):
+            await channel.send(clean_reply_text(reply))
+
+# 채널별 메시지 대기열: 짧은 시간 안의 연속 메시지 병합과 과부하 시 메시지 제한
+channel_queue = ChannelWorkQueue(
+    respond_to_turn,
+    debounce=float(os.getenv("MESSAGE_DEBOUNCE", "1.0")),
+    max_wait=float(os.getenv("MESSAGE_MAX_WAIT", "4.0")),
+    max_depth=int(os.getenv("CHANNEL_QUEUE_DEPTH", "10")),
+    max_channels=int(os.getenv("MAX_ACTIVE_CHANNELS", "1000")),
+)
+
+def initiator_lines(situation):
+    """
+    린이 먼저 말 거는 대사(is_initiator == True) 중 상황이 일치하는 대사 목록을 색인에서 가져옵니다.
+    """
+    positions = candidate_index.lookup(True, None, lambda flow, line_situation: line_situation == situation)
+    return dialogue_store.lines_at(positions)
+
+async def send_nudge(channel_id, situation):
+    """
+    유저 응답이 없는 채널에 상황에 맞는 자동 메시지를 전송합니다. 전송했으면 True를 반환합니다.
+    """
+    channel = bot.get_channel(channel_id)
+    if not channel:
+        return False
+    candidates = initiator_lines(situation)
+    if not candidates:
+        return False
+
+    message_to_send = clean_reply_text(random.choice(candidates))
+    await channel.send(message_to_send)
+    logger.info(f"자동 메시지 전송 (채널: {channel_id}): {message_to_send[:20]}...")
+    return True
+
+# 유저 응답이 없는 채널에 보낼 자동 메시지 예약 (한국 시간 새벽 1시~오전 9시는 보내지 않음)
+nudge_scheduler = NudgeScheduler(send_nudge)
+nudge_task = None
+
+# 다른 객체가 세고 있는 값은 수집할 때 읽어 옴
+metrics_registry.counter("rin_claude_retries_total", "Claude API 재시도 수", lambda: claude_governor.retries)
+metrics_registry.counter("rin_claude_rejected_total", "회로 차단으로 보내지 않은 Claude 호출 수", lambda: claude_governor.rejected)
+metrics_registry.gauge("rin_circuit_open", "Claude API 회로 차단기가 닫혀 있지 않으면 1", lambda: claude_governor.breaker.state != CircuitBreaker.CLOSED)
+metrics_registry.counter("rin_classifier_cache_hits_total", "분류 캐시 적중 수", lambda: classifier_cache.hits)
+metrics_registry.counter("rin_classifier_cache_misses_total", "분류 캐시 실패 수", lambda: classifier_cache.misses)
+metrics_registry.gauge("rin_classifier_cache_size", "분류 캐시 항목 수", lambda: len(classifier_cache))
+metrics_registry.counter("rin_selection_cache_hits_total", "선택 캐시 적중 수", lambda: selection_cache.hits)
+metrics_registry.counter("rin_selection_cache_misses_total", "선택 캐시 실패 수", lambda: selection_cache.misses)
+metrics_registry.gauge("rin_selection_cache_size", "선택 캐시 항목 수", lambda: len(selection_cache))
+metrics_registry.gauge("rin_sessions", "메모리에 있는 대화 세션 수", lambda: len(session_store))
+metrics_registry.gauge("rin_history_messages", "모든 세션의 대화 이력 메시지 수", session_store.history_size)
+metrics_registry.gauge("rin_memory_saved_tokens_per_request", "요약으로 아낀 요청당 평균 입력 토큰", lambda: memory_stats.summary()["saved_tokens_per_request"])
+metrics_registry.gauge("rin_selection_hit_rate", "최근 후보 평가에서 적절한 대사를 고른 비율", lambda: speculation_policy.hit_rate() or 0.0)
+metrics_registry.gauge("rin_queue_depth", "채널 대기열에 쌓인 메시지 수", channel_queue.depth)
+metrics_registry.counter("rin_queue_shed_total", "과부하로 버린 메시지 수", lambda: channel_queue.shed_count)
+metrics_registry.gauge("rin_scheduled_nudges", "예약된 자동 메시지 수", lambda: len(nudge_scheduler))
+metrics_registry.gauge("rin_dialogue_lines", "대사 DB의 대사 수", lambda: len(dialogue_store))
+metrics_registry.gauge("rin_journal_pending", "저널에 아직 기록되지 않은 대사 수", line_journal.pending_count)
+metrics_server = None
+profiler_lock = asyncio.Lock()
+
+async def refresh_character_data(force=False):
+    """
+    원본 엑셀이 바뀌었으면 워커 스레드에서 다시 읽고 검증한 뒤, 데이터와 색인을 한 번에 교체합니다.
+    읽는 동안 on_message가 추가한 대사는 교체 직전에 새 데이터에 옮겨 담습니다. 교체했으면 True를 반환합니다.
+    """
+    global dialogue_store, system_prompt, candidate_index, similarity_index, loaded_fingerprints, character_data_version
+
+    async with reload_lock:
+        if not force and await asyncio.to_thread(source_fingerprints) == loaded_fingerprints:
+            return False
+
+        reload_started_len = len(dialogue_store)
+        new_store, new_system_prompt, new_index, new_similarity, new_fingerprints = await asyncio.to_thread(build_character_data)
+
+        # 리로드 도중 추가된 대사 반영 (이 구간에는 await가 없으므로 다른 메시지 처리와 섞이지 않음)
+        for row in dialogue_store.records(reload_started_len):
+            if row["대사"] not in new_store:
+                position = new_store.append(row)
+                new_index.add(position, row)
+                new_similarity.add(position, row["대사"])
+
+        dialogue_store, system_prompt, candidate_index, similarity_index, loaded_fingerprints = (
+            new_store, new_system_prompt, new_index, new_similarity, new_fingerprints
+        )
+        character_data_version += 1
+        return True
+
+@tasks.loop(minutes=1)
+async def reload_character_data():
+    """
+    원본 엑셀의 변경 여부를 주기적으로 확인하고, 바뀐 경우에만 캐릭터 데이터를 다시 로드합니다.
+    """
     try:
-        await bot.process_commands(message)
+        if await refresh_character_data():
+            logger.info("캐릭터 데이터 리로드 완료")
     except Exception as e:
-        logger.error(f"명령어 처리 중 오류: {str(e)}")
+        logger.error(f"캐릭터 데이터 리로드 중 오류: {str(e)}")
+
+@tasks.loop(seconds=10)
+async def flush_line_journal():
+    """
+    대기 중인 새 대사를 백그라운드 스레드에서 저널에 기록합니다.
+    """
+    try:
+        with stage_latency.time(stage="journal_flush"):
+            await asyncio.to_thread(line_journal.flush)
+    except Exception as e:
+        logger.error(f"대사 저널 기록 중 오류: {str(e)}")
+
+@tasks.loop(minutes=30)
+async def compact_line_journal():
+    """
+    저널에 쌓인 대사를 주기적으로 엑셀 파일에 반영합니다.
+    """
+    try:
+        # 리로드가 엑셀과 저널을 읽는 도중에 반영이 끼어들지 않도록 같은 잠금 사용
+        async with reload_lock:
+            with stage_latency.time(stage="excel_compaction"):
+                count = await asyncio.to_thread(line_journal.compact, CHARACTER_TABLE_PATH, "lines_린")
+        if count:
+            logger.info(f"대사 {count}개 엑셀 반영 완료")
+    except Exception as e:
+        logger.error(f"대사 저널 엑셀 반영 중 오류: {str(e)}")
 
 @tasks.loop(minutes=5)
-async def check_user_response():
+async def maintain_sessions():
     """
-    유저 응답이 없는 채널을 체크하고 필요시 자동 메시지를 전송합니다.
+    오래 쉬고 있는 대화 세션을 정리하고, 설정된 경우 세션 스냅샷을 백그라운드 스레드에서 기록합니다.
     """
     try:
-        current_time = datetime.now()
-        
-        # 한국 시간 기준 새벽 1시부터 오전 9시까지는 메시지 전송하지 않음
-        kst_hour = (current_time.hour + 9) % 24  # UTC에서 KST로 변환 (UTC+9)
-        if 1 <= kst_hour < 9:
-            logger.info(f"한국 시간 {kst_hour}시: 취침 시간이므로 자동 메시지를 전송하지 않습니다.")
-            return
-            
-        for channel_id, last_bot_time in last_bot_message.items():
-            if channel_id not in last_message_time or last_message_time[channel_id] < last_bot_time:
-                time_diff = (current_time - last_bot_time).total_seconds() / 3600
-                if 1 <= time_diff <= 2:
-                    channel = bot.get_channel(channel_id)
-                    if channel:
-                        if 1 <= time_diff <= 1.5:
-                            candidates = df_lines[
-                                (df_lines["is_initiator"] == True) & 
-                                (df_lines["상황"] == "린이 먼저 말 거는")
-                            ]
-                        else:
-                            candidates = df_lines[
-                                (df_lines["is_initiator"] == True) & 
-                                (df_lines["상황"] == "무시당함")
-                            ]
-                        
-                        if not candidates.empty:
-                            message_to_send = random.choice(candidates["대사"].tolist())
-                            if message_to_send.startswith('"') and message_to_send.endswith('"'):
-                                message_to_send = message_to_send[1:-1]
-                            elif message_to_send.startswith('"'):
-                                message_to_send = message_to_send[1:]
-                            elif message_to_send.endswith('"'):
-                                message_to_send = message_to_send[:-1]
-                            
-                            if message_to_send.startswith("[린의 응답]"):
-                                message_to_send = message_to_send[len("[린의 응답]"):].lstrip()
-                                
-                            await channel.send(message_to_send)
-                            logger.info(f"자동 메시지 전송 (채널: {channel_id}): {message_to_send[:20]}...")
-                            last_bot_message[channel_id] = current_time
+        evicted = session_store.evict_idle()
+        if evicted:
+            logger.info(f"유휴 대화 세션 {evicted}개 정리")
+        if SESSION_SNAPSHOT_PATH:
+            await asyncio.to_thread(SessionStore.write_snapshot, session_store.to_snapshot(), SESSION_SNAPSHOT_PATH)
     except Exception as e:
-        logger.error(f"사용자 응답 체크 중 오류: {str(e)}")
+        logger.error(f"대화 세션 정리 중 오류: {str(e)}")
 
-@tasks.loop(minutes=60)
-async def reload_character_data():
+@bot.command(name="내보내기")
+async def export_lines(ctx):
     """
-    캐릭터 데이터를 주기적으로 다시 로드합니다.
+    사용자 명령으로 저널에 쌓인 대사를 즉시 엑셀 파일에 반영합니다.
     """
+    if not LINE_STORE_WRITER:
+        await ctx.send("ℹ️ 이 프로세스는 엑셀 기록 담당이 아닙니다. 새 대사는 기록 담당 프로세스가 주기적으로 반영합니다.")
+        return
     try:
-        global df_prompt, df_lines, system_prompt
-        df_prompt, df_lines, system_prompt = load_character_data()
-        logger.info("캐릭터 데이터 리로드 완료")
+        async with reload_lock:
+            count = await asyncio.to_thread(line_journal.compact, CHARACTER_TABLE_PATH, "lines_린")
+        await ctx.send(f"💾 새 대사 {count}개 엑셀 반영 완료!")
+        logger.info(f"사용자 {ctx.author}의 요청으로 대사 {count}개 엑셀 반영 완료")
     except Exception as e:
-        logger.error(f"캐릭터 데이터 리로드 중 오류: {str(e)}")
+        logger.error(f"대사 내보내기 중 오류: {str(e)}")
+        await ctx.send("❌ 대사 내보내기 중 오류가 발생했습니다.")
+
+@bot.command(name="캐시")
+async def cache_stats(ctx):
+    """
+    분류 결과 캐시와 후보 선택 캐시의 크기, 적중률, 메모리 사용량을 보여줍니다.
+    """
+    stats = classifier_cache.stats()
+    selection = selection_cache.stats()
+    await ctx.send(
+        f"🗂️ 분류 캐시: {stats['size']}/{stats['maxsize']}개, "
+        f"적중률 {stats['hit_rate']:.1%} (적중 {stats['hits']} / 실패 {stats['misses']}), "
+        f"제거 {stats['evictions']}개, 약 {stats['memory_bytes'] / 1024:.1f}KB\n"
+        f"🎯 선택 캐시: {selection['size']}/{selection['maxsize']}개, "
+        f"적중률 {selection['hit_rate']:.1%}, 절약한 API 호출 {selection_cache_counters['api_calls_avoided']}회, "
+        f"중복으로 무효화 {selection_cache_counters['redundant_hits']}회"
+    )
+
+@bot.command(name="토큰")
+async def token_stats(ctx):
+    """
+    대사 생성 호출의 프롬프트 캐시 적중률과 절감 효과를 보여줍니다.
+    """
+    summary = fallback_usage.summary()
+    memory = memory_stats.summary()
+    await ctx.send(
+        f"🧾 생성 호출 {summary['calls']}회, 입력 토큰 {summary['input_tokens']}개 중 캐시 읽기 {summary['cache_read_ratio']:.1%}, "
+        f"입력 비용 절감 {summary['input_cost_saving']:.1%}, "
+        f"평균 지연 캐시 {summary['avg_latency_cached']:.2f}초 / 비캐시 {summary['avg_latency_uncached']:.2f}초, "
+        f"캐시 구간 평균 {summary['avg_prefix_tokens']:.0f}토큰 (최소 {PROMPT_CACHE_MIN_TOKENS}토큰 미만 {summary['short_prefix_ratio']:.1%})\n"
+        f"🧠 대화 기억: 요청당 평균 {memory['avg_sent_tokens']:.0f}토큰 전송 (전체 대화 {memory['avg_full_tokens']:.0f}토큰), "
+        f"요약 갱신 {memory['summary_calls']}회 ({memory['summary_tokens']}토큰) 포함 요청당 {memory['saved_tokens_per_request']:.0f}토큰 절약"
+    )
+
+@bot.command(name="지표")
+@commands.is_owner()
+async def metrics_stats(ctx):
+    """
+    처리 단계별 지연 시간(p50/p95)과 주요 카운터를 보여줍니다.
+    """
+    lines = []
+    for stage in PIPELINE_STAGES:
+        p50 = stage_latency.quantile(0.5, stage=stage)
+        p95 = stage_latency.quantile(0.95, stage=stage)
+        if p50 is not None:
+            lines.append(f"- {stage}: p50 ≤{p50}초, p95 ≤{p95}초")
+    if first_visible_latency.quantile(0.5) is not None:
+        lines.append(f"- 스트리밍 첫 표시: p50 ≤{first_visible_latency.quantile(0.5)}초, p95 ≤{first_visible_latency.quantile(0.95)}초")
+    sources = ", ".join(f"{source} {int(reply_sources.value(source=source))}"
+                        for source in ("candidate", "selection_cache", "stream", "generation", "local"))
+    calls = ", ".join(f"{kind} {int(claude_api_calls.value(kind=kind))}" for kind in CLAUDE_CALL_KINDS)
+    speculation = speculation_policy.stats()
+    await ctx.send(
+        "📈 단계별 지연 시간\n" + ("\n".join(lines) or "- 아직 기록 없음") + "\n"
+        f"응답 경로: {sources}\n"
+        f"API 호출: {calls}, 재시도 {claude_governor.retries}, 회로 차단 {claude_governor.rejected}, "
+        f"'없음' 선택 {int(selection_none.value())}, "
+        f"유사 대사 보충 {int(retrievals.value(result='added'))}회 (못 찾음 {int(retrievals.value(result='empty'))}회)\n"
+        f"동시 생성({speculation['mode']}): 시작 {speculation['started']}, 사용 {speculation['used']}, "
+        f"취소 {speculation['cancelled']}, 폐기 {speculation['discarded']}\n"
+        f"세션 {len(session_store)}개, 대기열 {channel_queue.depth()}개, 대사 {len(dialogue_store)}개"
+    )
+
+@bot.command(name="프로파일")
+@commands.is_owner()
+async def profile_pipeline(ctx, seconds: float = 30.0):
+    """
+    지정한 시간(초) 동안 메시지 처리 경로를 샘플링 프로파일링하고, 가장 오래 실행된 함수를 보여줍니다.
+    전체 스택은 flamegraph용 collapsed 파일로 저장합니다.
+    """
+    if profiler_lock.locked():
+        await ctx.send("⏳ 이미 프로파일링 중입니다.")
+        return
+    async with profiler_lock:
+        seconds = max(1.0, min(seconds, 300.0))
+        profiler = SamplingProfiler(PROFILE_SAMPLE_INTERVAL, focus=("respond_to_turn", "on_message"))
+        await ctx.send(f"🔬 {seconds:.0f}초 동안 프로파일링합니다.")
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            await asyncio.to_thread(profiler.stop)
+        path = f"profile_{int(time.time())}.collapsed"
+        await asyncio.to_thread(profiler.write_collapsed, path)
+        top = "\n".join(f"- {name}: {count}" for name, count in profiler.top_functions(8)) or "- 메시지 처리 중인 표본 없음"
+        await ctx.send(f"🔬 표본 {profiler.samples}개 중 메시지 처리 {sum(profiler.stacks.values())}개 ({path})\n{top}")
+        logger.info(f"사용자 {ctx.author}의 요청으로 프로파일 저장: {path}")
 
 @bot.command(name="업데이트")
 async def manual_reload(ctx):
@@ -600,17 +1145,21 @@ async def manual_reload(ctx):
     사용자 명령으로 캐릭터 데이터를 수동으로 다시 로드합니다.
     """
     try:
-        global df_prompt, df_lines, system_prompt
-        df_prompt, df_lines, system_prompt = load_character_data()
+        await refresh_character_data(force=True)
         await ctx.send("📚 캐릭터 데이터 리로드 완료!")
         logger.info(f"사용자 {ctx.author}의 요청으로 캐릭터 데이터 수동 리로드 완료")
     except Exception as e:
         logger.error(f"수동 리로드 중 오류: {str(e)}")
         await ctx.send("❌ 데이터 리로드 중 오류가 발생했습니다.")
 
-try:
-    logger.info("봇 실행 시작...")
-    bot.run(DISCORD_BOT_TOKEN)
-except Exception as e:
-    logger.critical(f"봇 실행 중 오류: {str(e)}")
-    raise
+if __name__ == "__main__":
+    try:
+        logger.info("봇 실행 시작...")
+        bot.run(DISCORD_BOT_TOKEN)
+    except Exception as e:
+        logger.critical(f"봇 실행 중 오류: {str(e)}")
+        raise
+    finally:
+        line_journal.close()
+        if SESSION_SNAPSHOT_PATH:
+            SessionStore.write_snapshot(session_store.to_snapshot(), SESSION_SNAPSHOT_PATH)
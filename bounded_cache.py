@@ -0,0 +1,126 @@
+import functools
+import sys
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def normalize_text(text):
+    """
+    캐시 키로 쓰기 위해 대소문자와 공백을 정규화합니다.
+    """
+    return " ".join(str(text).lower().split())
+
+
+_ENTRY_OVERHEAD = sys.getsizeof((None, None, 0)) + 100  # 항목 튜플과 OrderedDict 슬롯/연결 노드의 대략적인 크기
+
+
+def _deep_size(obj):
+    # 키와 값에 흔히 쓰는 컨테이너(튜플, 리스트, 집합, 딕셔너리)는 안에 든 객체 크기까지 더함
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (tuple, list, set, frozenset)):
+        size += sum(_deep_size(item) for item in obj)
+    elif isinstance(obj, dict):
+        size += sum(_deep_size(key) + _deep_size(value) for key, value in obj.items())
+    return size
+
+
+def _entry_size(key, value):
+    return _ENTRY_OVERHEAD + _deep_size(key) + _deep_size(value)
+
+
+class BoundedCache:
+    """
+    최대 항목 수와 선택적 TTL을 가진 LRU 캐시입니다. 적중/실패 횟수와 대략적인 메모리 사용량을 함께 기록합니다.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (value, 만료 시각, 크기)
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at, _ = entry
+        if expires_at is not None and expires_at <= self.clock():
+            self._remove(key)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if key in self._data:
+            self._remove(key)
+        expires_at = self.clock() + self.ttl if self.ttl is not None else None
+        size = _entry_size(key, value)
+        self._data[key] = (value, expires_at, size)
+        self._bytes += size
+        while len(self._data) > self.maxsize:
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        self._remove(key)
+        return entry[0]
+
+    def _remove(self, key):
+        _, _, size = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def stats(self):
+        """
+        캐시 크기 산정을 위한 통계를 반환합니다. memory_bytes는 키와 값(안에 든 객체 포함)과 항목 관리 비용의 대략적인 합이며,
+        여러 항목이 함께 쓰는 문자열도 항목마다 더하므로 실제보다 크게 잡힐 수 있습니다.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_bytes": self._bytes,
+        }
+
+
+def cached(cache, normalize=normalize_text):
+    """
+    텍스트 하나를 받는 분류 함수를 캐시로 감쌉니다. 정규화한 텍스트로 함수를 호출하고 그 결과를 저장합니다.
+    같은 캐시를 여러 함수가 공유할 수 있도록 함수 이름을 키에 포함합니다.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(text):
+            normalized = normalize(text)
+            key = (fn.__name__, normalized)
+            result = cache.get(key, _MISSING)
+            if result is _MISSING:
+                result = fn(normalized)
+                cache.set(key, result)
+            return result
+        wrapper.cache = cache
+        return wrapper
+    return decorator
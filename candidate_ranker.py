@@ -0,0 +1,98 @@
+import random
+
+import numpy as np
+
+# 유저 대화 흐름별로 잘 이어지는 대사 흐름과 가중치
+FLOW_PREFERENCES = {
+    "질문형": {"반응형": 0.3, "질문형": 0.2, "자기감정표현": 0.1},
+    "요청형": {"반응형": 0.3, "자기감정표현": 0.1},
+    "감정표현": {"자기감정표현": 0.3, "반응형": 0.2},
+    "상황시작형": {"상황시작형": 0.3, "반응형": 0.1},
+    "일반": {"일반": 0.1, "반응형": 0.1, "자기감정표현": 0.1},
+}
+EMOTION_WEIGHT = 0.3  # 유저 감정과 같은 감정의 대사에 주는 가산점
+RECENCY_WEIGHT = 0.5  # 최근 응답과 표현이 겹치는 정도에 주는 감점
+
+
+def char_ngrams(text, n=2):
+    """
+    공백을 제외한 문자 n-gram 집합을 반환합니다. n보다 짧은 텍스트는 텍스트 자체를 사용합니다.
+    """
+    text = "".join(str(text).lower().split())
+    if len(text) < n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def rank_candidates(user_input, candidates, top_k, user_flow="일반", emotion=None, recent_responses=(), rng=random):
+    """
+    후보 대사를 로컬 점수로 정렬해 상위 top_k개의 대사만 반환합니다.
+    candidates는 (대사, 대화 흐름, 감정) 튜플 목록이며, 점수는 유저 발화와의 문자 2-gram 겹침,
+    흐름/감정 가중치, 최근 응답과의 표현 겹침 감점으로 계산합니다. 동점은 무작위로 섞어 매번 같은 후보만 남지 않게 합니다.
+    top_k가 0 이하이면 후보를 줄이지 않습니다.
+    """
+    if top_k <= 0 or len(candidates) <= top_k:  # 0 이하이면 제한 없음
+        return [line for line, _, _ in candidates]
+
+    user_grams = char_ngrams(user_input)
+    recent_grams = set()
+    for response in recent_responses:
+        recent_grams |= char_ngrams(response)
+    flow_weights = FLOW_PREFERENCES.get(user_flow, {})
+
+    scored = []
+    for line, flow, line_emotion in candidates:
+        grams = char_ngrams(line)
+        score = 0.0
+        if grams:
+            score += len(grams & user_grams) / len(grams | user_grams)
+            score -= RECENCY_WEIGHT * len(grams & recent_grams) / len(grams)
+        score += flow_weights.get(flow, 0.0)
+        if emotion is not None and line_emotion == emotion:
+            score += EMOTION_WEIGHT
+        scored.append((score, line))
+
+    rng.shuffle(scored)
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [line for _, line in scored[:top_k]]
+
+
+def rank_positions(user_input, positions, store, similarity_index, top_k, user_flow="일반", emotion=None,
+                   recent_responses=(), rng=random, skip=None):
+    """
+    rank_candidates와 같은 점수로 저장소의 행 위치를 정렬해 상위 top_k개의 위치를 반환합니다(0 이하이면 제한 없음).
+    대사별 2-gram은 유사도 색인에 미리 저장해 둔 것을 쓰고 점수는 NumPy로 한꺼번에 계산하므로, 후보가 많아도 이벤트 루프를 오래 막지 않습니다.
+    skip은 대사를 받아 제외 여부를 돌려주는 함수이며, 점수 순으로 훑으면서 필요한 만큼만 확인합니다.
+    """
+    if top_k <= 0 or len(positions) <= top_k:
+        ordered = positions
+    else:
+        user_grams = char_ngrams(user_input)
+        recent_grams = set()
+        for response in recent_responses:
+            recent_grams |= char_ngrams(response)
+        sizes, shared_user, shared_recent = similarity_index.bigram_overlaps(positions, user_grams, recent_grams)
+        has_grams = sizes > 0
+        safe_sizes = np.maximum(sizes, 1)
+        scores = np.where(has_grams, shared_user / (safe_sizes + len(user_grams) - shared_user)
+                          - RECENCY_WEIGHT * shared_recent / safe_sizes, 0.0)
+
+        flow_weights = FLOW_PREFERENCES.get(user_flow, {})
+        flow_bonus = np.array([flow_weights.get(value, 0.0) for value in store.flows.values])
+        index = np.asarray(positions, dtype=np.intp)
+        scores = scores + flow_bonus[np.frombuffer(store.flow_codes, dtype=np.uint32)[index]]
+        emotion_code = store.emotions.find(emotion) if emotion is not None else None
+        if emotion_code is not None:
+            scores = scores + EMOTION_WEIGHT * (np.frombuffer(store.emotion_codes, dtype=np.uint32)[index] == emotion_code)
+
+        tiebreak = np.random.default_rng(rng.getrandbits(64)).random(len(positions))
+        ordered = index[np.lexsort((tiebreak, -scores))].tolist()
+
+    ranked = []
+    for position in ordered:
+        if skip is not None and skip(store.lines[position]):
+            continue
+        ranked.append(position)
+        if len(ranked) == top_k:
+            break
+    return ranked
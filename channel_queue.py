@@ -0,0 +1,98 @@
+import asyncio
+import logging
+
+logger = logging.getLogger('린_봇')
+
+
+class ChannelWorkQueue:
+    """
+    채널별 메시지 작업 대기열입니다.
+    채널마다 작업자 하나가 순서대로 처리하므로 한 채널의 응답이 뒤섞이지 않고,
+    debounce 시간 안에 연달아 들어온 메시지는 한 턴으로 합쳐 handler(channel_id, items)를 한 번만 호출합니다.
+    """
+
+    def __init__(self, handler, debounce=1.0, max_wait=4.0, max_depth=10, max_channels=1000):
+        self.handler = handler
+        self.debounce = debounce
+        self.max_wait = max_wait
+        self.max_depth = max_depth
+        self.max_channels = max_channels
+        self.shed_count = 0  # 과부하로 버린 메시지 수
+        self.merged_count = 0  # 다른 메시지와 합쳐져 따로 처리되지 않은 메시지 수
+        self._buffers = {}
+        self._last_arrival = {}
+        self._wakeups = {}
+        self._workers = {}
+
+    def depth(self):
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    def active_channels(self):
+        return len(self._workers)
+
+    def submit(self, channel_id, item):
+        """
+        메시지를 채널 대기열에 넣습니다. 처리 중인 채널 수가 상한에 닿아 받지 못하면 False를 반환합니다.
+        채널 대기열이 가득 차면 가장 오래된 메시지를 버립니다.
+        """
+        loop = asyncio.get_running_loop()
+        if channel_id not in self._workers and len(self._workers) >= self.max_channels:
+            self.shed_count += 1
+            logger.warning(f"처리 중인 채널 수 상한 초과로 메시지를 받지 않습니다 (채널: {channel_id})")
+            return False
+
+        buffer = self._buffers.setdefault(channel_id, [])
+        if len(buffer) >= self.max_depth:
+            buffer.pop(0)
+            self.shed_count += 1
+            logger.warning(f"채널 대기열이 가득 차 가장 오래된 메시지를 버립니다 (채널: {channel_id})")
+        buffer.append(item)
+        self._last_arrival[channel_id] = loop.time()
+
+        if channel_id in self._wakeups:
+            self._wakeups[channel_id].set()
+        if channel_id not in self._workers:
+            self._wakeups[channel_id] = asyncio.Event()
+            self._workers[channel_id] = loop.create_task(self._work(channel_id))
+        return True
+
+    async def _wait_for_quiet(self, channel_id):
+        # 마지막 메시지 이후 debounce만큼 조용해지거나, 최대 max_wait까지 기다림
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        wakeup = self._wakeups[channel_id]
+        while True:
+            deadline = min(self._last_arrival[channel_id] + self.debounce, started_at + self.max_wait)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self, channel_id):
+        try:
+            while self._buffers.get(channel_id):
+                await self._wait_for_quiet(channel_id)
+                batch = self._buffers[channel_id]
+                self._buffers[channel_id] = []
+                self.merged_count += len(batch) - 1
+                try:
+                    await self.handler(channel_id, batch)
+                except Exception as e:
+                    logger.error(f"채널 작업 처리 중 오류 (채널: {channel_id}): {str(e)}")
+        finally:
+            # 대기열 확인과 정리 사이에 await가 없으므로 새 메시지가 누락되지 않음
+            self._buffers.pop(channel_id, None)
+            self._last_arrival.pop(channel_id, None)
+            self._wakeups.pop(channel_id, None)
+            self._workers.pop(channel_id, None)
+
+    async def join(self):
+        """
+        현재 대기 중인 모든 작업이 끝날 때까지 기다립니다.
+        """
+        while self._workers:
+            await asyncio.gather(*list(self._workers.values()), return_exceptions=True)
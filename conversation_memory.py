@@ -0,0 +1,80 @@
+import logging
+
+logger = logging.getLogger('린_봇')
+
+SUMMARY_SYSTEM_PROMPT = (
+    "너는 대화 기록을 요약하는 도우미야. 린(유저의 여자친구 역할 캐릭터)과 유저의 대화에서 "
+    "이후 대화에 필요한 사실, 약속, 유저의 감정과 관심사만 짧게 정리해."
+)
+SUMMARY_HEADER = "[지난 대화 요약]"
+
+
+def estimate_tokens(text):
+    """
+    토큰 수를 빠르게 추정합니다. 한글 등 ASCII가 아닌 글자는 한 글자에 토큰 하나, ASCII는 네 글자에 토큰 하나로 봅니다.
+    """
+    ascii_chars = sum(1 for char in text if char < "\x80")
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+def message_tokens(message):
+    """
+    이력 메시지의 토큰 수를 반환합니다. 처음 계산할 때 메시지에 기록해 두고 다시 계산하지 않습니다.
+    """
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = message["tokens"] = estimate_tokens(message["content"])
+    return tokens
+
+
+def summary_block(summary):
+    return f"{SUMMARY_HEADER}\n{summary}"
+
+
+def build_summary_request(summary, messages, max_chars=300, **params):
+    """
+    기존 요약에 새로 밀려난 대화를 반영해 요약을 갱신하는 요청 인자를 만듭니다.
+    """
+    speakers = {"user": "유저", "assistant": "린"}
+    transcript = "\n".join(f"{speakers.get(message['role'], message['role'])}: {message['content']}" for message in messages)
+    prompt = (
+        f"[기존 요약]\n{summary or '없음'}\n\n"
+        f"[새로 추가된 대화]\n{transcript}\n\n"
+        f"기존 요약에 새 대화를 반영해 {max_chars}자 이내의 한국어 요약 하나만 출력해."
+    )
+    return {"system": SUMMARY_SYSTEM_PROMPT, "messages": [{"role": "user", "content": prompt}], **params}
+
+
+class MemoryStats:
+    """
+    대사 생성 요청마다 실제로 보낸 기억 토큰(요약+최근 이력)과, 요약 없이 지금까지의 대화를 모두 보냈을 때의 토큰을 누적합니다.
+    요약 갱신 호출에 든 토큰은 절감량에서 뺍니다.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.sent_tokens = 0
+        self.full_tokens = 0
+        self.summary_calls = 0
+        self.summary_tokens = 0
+
+    def record_request(self, sent_tokens, full_tokens):
+        self.requests += 1
+        self.sent_tokens += sent_tokens
+        self.full_tokens += full_tokens
+
+    def record_summary(self, usage):
+        self.summary_calls += 1
+        self.summary_tokens += (getattr(usage, "input_tokens", 0) or 0) + (getattr(usage, "output_tokens", 0) or 0)
+
+    def summary(self):
+        requests = self.requests or 1
+        saved = self.full_tokens - self.sent_tokens - self.summary_tokens
+        return {
+            "requests": self.requests,
+            "avg_sent_tokens": self.sent_tokens / requests,
+            "avg_full_tokens": self.full_tokens / requests,
+            "summary_calls": self.summary_calls,
+            "summary_tokens": self.summary_tokens,
+            "saved_tokens_per_request": saved / requests,
+        }
@@ -0,0 +1,130 @@
+"""
+대사 테이블의 행 위치를 조건별로 묶어 두는 후보 색인입니다.
+
+    python dialogue_index.py --lines 100000
+"""
+import argparse
+import logging
+import random
+import time
+from array import array
+
+from dialogue_store import DialogueStore, _synthetic_rows, normalize_initiator, normalize_label
+
+logger = logging.getLogger('린_봇')
+
+
+class CandidateIndex:
+    """
+    대사 테이블의 행 위치를 (is_initiator, 감정, 대화 흐름, 상황) 키로 묶어 둔 색인입니다.
+    후보 검색 시 전체 테이블을 훑지 않고, 조건에 맞는 묶음만 모아서 반환합니다.
+    """
+
+    def __init__(self):
+        # (is_initiator, 소문자 감정) -> {(대화 흐름, 상황): [행 위치, ...]}
+        self._groups = {}
+        self.size = 0
+
+    @classmethod
+    def from_store(cls, store):
+        index = cls()
+        for position, (is_initiator, emotion, flow, situation) in enumerate(store.index_keys()):
+            index._add(position, is_initiator, emotion, flow, situation)
+        return index
+
+    def _add(self, position, is_initiator, emotion, flow, situation):
+        emotion = normalize_label(emotion)
+        head = (normalize_initiator(is_initiator), emotion.lower() if emotion is not None else None)
+        key = (normalize_label(flow), normalize_label(situation))
+        self._groups.setdefault(head, {}).setdefault(key, array("I")).append(position)
+        self.size += 1
+
+    def add(self, position, row):
+        """
+        새로 추가된 행 하나를 색인에 반영합니다.
+        """
+        self._add(position, row.get("is_initiator"), row.get("감정"), row.get("대화 흐름"), row.get("상황"))
+
+    def lookup(self, is_initiator, emotion=None, accept=None):
+        """
+        조건에 맞는 행 위치를 원래 테이블 순서대로 반환합니다.
+        emotion이 None이면 감정과 무관하게 찾고, accept는 (대화 흐름, 상황)을 받아 포함 여부를 돌려주는 함수입니다.
+        """
+        if emotion is None:
+            heads = [groups for (initiator, _), groups in self._groups.items() if initiator is is_initiator]
+        else:
+            groups = self._groups.get((is_initiator, emotion.lower()))
+            heads = [groups] if groups else []
+
+        positions = []
+        for groups in heads:
+            for (flow, situation), rows in groups.items():
+                if accept is None or accept(flow, situation):
+                    positions.extend(rows)
+        positions.sort()
+        return positions
+
+
+# 유저 흐름별 후보 조건 (봇의 flow_filters와 같은 조건을 DataFrame 마스크와 색인 필터 두 형태로 둠)
+_BENCH_FLOWS = {
+    "상황시작형": (lambda df: df["상황"].str.contains("인사", na=False),
+                 lambda flow, situation: situation is not None and "인사" in situation),
+    "질문형": (lambda df: df["대화 흐름"] != "회피형", lambda flow, situation: flow != "회피형"),
+    "요청형": (lambda df: df["대화 흐름"].isin(["반응형", "자기감정표현"]),
+             lambda flow, situation: flow in ("반응형", "자기감정표현")),
+    "일반": (None, None),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DataFrame 마스크 필터와 후보 색인의 후보 검색 비용을 비교합니다.")
+    parser.add_argument("--lines", type=int, default=100000, help="대사 수")
+    parser.add_argument("--lookups", type=int, default=200, help="측정할 검색 횟수 (메시지마다 한 번)")
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    rng = random.Random(0)
+    rows = list(_synthetic_rows(args.lines, rng))
+    columns = {name: [row[name] for row in rows] for name in rows[0]}
+    df_lines = pd.DataFrame(columns)
+    store = DialogueStore.from_columns(columns)
+
+    started_at = time.perf_counter()
+    index = CandidateIndex.from_store(store)
+    build_seconds = time.perf_counter() - started_at
+
+    emotions = ["기쁨", "애정", "설렘", "감동", "조심스러움"]
+    queries = [(rng.choice(emotions), rng.choice(list(_BENCH_FLOWS))) for _ in range(args.lookups)]
+
+    # 이전 방식: 메시지마다 전체 테이블에 마스크를 씌움
+    df_latencies = []
+    df_found = []
+    for emotion, user_flow in queries:
+        started_at = time.perf_counter()
+        filtered = df_lines[df_lines["is_initiator"] == False]
+        mask, _ = _BENCH_FLOWS[user_flow]
+        if mask is not None:
+            filtered = filtered[mask(filtered)]
+        filtered = filtered[filtered["감정"].str.lower() == emotion.lower()]
+        df_latencies.append(time.perf_counter() - started_at)
+        df_found.append(len(filtered))
+
+    index_latencies = []
+    index_found = []
+    for emotion, user_flow in queries:
+        started_at = time.perf_counter()
+        positions = index.lookup(False, emotion, _BENCH_FLOWS[user_flow][1])
+        index_latencies.append(time.perf_counter() - started_at)
+        index_found.append(len(positions))
+
+    assert df_found == index_found, "두 방식의 후보 수가 다릅니다"
+    for name, latencies in (("DataFrame", df_latencies), ("색인", index_latencies)):
+        latencies.sort()
+        print(f"{name}: 검색 p50 {latencies[len(latencies) // 2] * 1000:.3f}ms "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.3f}ms")
+    print(f"대사 {args.lines}개, 색인 구축 {build_seconds:.2f}초, 평균 후보 {sum(index_found) / len(index_found):.0f}개")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+대사 엑셀 파일을 컬럼 단위 스냅샷으로 미리 컴파일합니다.
+봇은 시작할 때 스냅샷만 읽고, 원본 엑셀은 수정 시각이나 내용 해시가 바뀌었을 때만 다시 파싱합니다.
+
+    python dialogue_snapshot.py [--force]
+"""
+import argparse
+import hashlib
+import logging
+import os
+import pickle
+import time
+
+logger = logging.getLogger('린_봇')
+
+SNAPSHOT_VERSION = 1
+CHARACTER_TABLE_PATH = "character_table_flowtagged.xlsx"
+REACTIVE_TABLE_PATH = "girlfriend_mode_reactive_200.xlsx"
+DEFAULT_SNAPSHOT_PATH = "dialogue_snapshot.pkl"
+
+
+def file_fingerprint(path):
+    stat = os.stat(path)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _columns(df):
+    return {name: df[name].tolist() for name in df.columns}
+
+
+def parse_sources(character_path=CHARACTER_TABLE_PATH, reactive_path=REACTIVE_TABLE_PATH):
+    """
+    원본 엑셀을 파싱해 시스템 프롬프트 시트와 대사 시트를 컬럼 목록 형태로 반환합니다.
+    """
+    import pandas as pd  # 엑셀 파싱이 필요할 때만 로드
+
+    df_prompt = pd.read_excel(character_path, sheet_name="system_prompt_린")
+    # 'lines_린' 시트는 여자친구 모드 대사(반응형, is_initiator == False)와 린이 먼저 말 거는 대사( is_initiator == True) 모두 포함
+    df_lines_initiator = pd.read_excel(character_path, sheet_name="lines_린")
+    df_lines_reactive = pd.read_excel(reactive_path, sheet_name="lines_린")
+    df_lines = pd.concat([df_lines_initiator, df_lines_reactive], ignore_index=True)
+    return {"prompt": _columns(df_prompt), "lines": _columns(df_lines)}
+
+
+def build_snapshot(snapshot_path=DEFAULT_SNAPSHOT_PATH, character_path=CHARACTER_TABLE_PATH,
+                   reactive_path=REACTIVE_TABLE_PATH, write=True):
+    """
+    원본 엑셀을 파싱해 스냅샷 파일을 새로 기록하고, 기록한 데이터를 반환합니다. write=False이면 기록하지 않습니다.
+    """
+    sources = {}
+    for path in (character_path, reactive_path):
+        sources[path] = {**file_fingerprint(path), "sha256": file_digest(path)}
+    data = {"version": SNAPSHOT_VERSION, "sources": sources, **parse_sources(character_path, reactive_path)}
+    if write:
+        _write_snapshot(data, snapshot_path)
+    return data
+
+
+def _write_snapshot(data, snapshot_path):
+    tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"  # 여러 프로세스가 동시에 기록해도 임시 파일이 겹치지 않도록
+    with open(tmp_path, "wb") as f:
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, snapshot_path)
+
+
+def load_snapshot(snapshot_path=DEFAULT_SNAPSHOT_PATH, character_path=CHARACTER_TABLE_PATH,
+                  reactive_path=REACTIVE_TABLE_PATH, write=True):
+    """
+    원본 엑셀과 일치하는 스냅샷이 있으면 반환하고, 없거나 오래되었으면 None을 반환합니다.
+    수정 시각과 크기가 같으면 바로 사용하고, 다르면 내용 해시까지 비교합니다.
+    """
+    if not os.path.exists(snapshot_path):
+        return None
+    with open(snapshot_path, "rb") as f:
+        data = pickle.load(f)
+    if data.get("version") != SNAPSHOT_VERSION or set(data["sources"]) != {character_path, reactive_path}:
+        return None
+
+    touched = False
+    for path, recorded in data["sources"].items():
+        current = file_fingerprint(path)
+        if current["mtime_ns"] == recorded["mtime_ns"] and current["size"] == recorded["size"]:
+            continue
+        if file_digest(path) != recorded["sha256"]:
+            return None
+        # 내용은 같고 수정 시각만 바뀐 경우: 다음 시작 때 해시를 다시 계산하지 않도록 기록 갱신
+        recorded.update(current)
+        touched = True
+    if touched and write:
+        _write_snapshot(data, snapshot_path)
+    return data
+
+
+def load_dialogue_data(snapshot_path=DEFAULT_SNAPSHOT_PATH, character_path=CHARACTER_TABLE_PATH,
+                       reactive_path=REACTIVE_TABLE_PATH, write=True):
+    """
+    스냅샷을 우선 사용하고, 원본 엑셀이 바뀌었으면 다시 파싱해 스냅샷을 갱신합니다.
+    write=False이면 스냅샷을 읽기만 하고, 오래되었으면 엑셀을 파싱한 결과를 기록하지 않고 반환합니다
+    (여러 프로세스가 스냅샷 하나를 공유하고 갱신은 한 곳에서만 할 때).
+    """
+    try:
+        data = load_snapshot(snapshot_path, character_path, reactive_path, write)
+        if data is not None:
+            return data
+    except Exception as e:
+        logger.warning(f"대사 스냅샷 읽기 실패, 엑셀을 다시 파싱합니다: {str(e)}")
+
+    logger.info("대사 엑셀 파싱 및 스냅샷 생성" if write else "대사 엑셀 파싱 (스냅샷 읽기 전용)")
+    return build_snapshot(snapshot_path, character_path, reactive_path, write)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="대사 엑셀을 스냅샷으로 컴파일합니다.")
+    parser.add_argument("--snapshot", default=os.getenv("DIALOGUE_SNAPSHOT_PATH", DEFAULT_SNAPSHOT_PATH))
+    parser.add_argument("--force", action="store_true", help="변경 여부와 관계없이 다시 컴파일")
+    args = parser.parse_args()
+
+    started_at = time.perf_counter()
+    if args.force or load_snapshot(args.snapshot) is None:
+        data = build_snapshot(args.snapshot)
+        print(f"엑셀 파싱 및 스냅샷 생성: {time.perf_counter() - started_at:.3f}초")
+    else:
+        print("스냅샷이 최신 상태입니다.")
+
+    started_at = time.perf_counter()
+    data = load_snapshot(args.snapshot)
+    line_count = len(next(iter(data["lines"].values()), []))
+    print(f"스냅샷 로드: {time.perf_counter() - started_at:.3f}초 (대사 {line_count}개)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+실행 중에 쓰는 대사 저장소입니다. 봇이 쓰는 컬럼(대사, 감정, 대화 흐름, 상황, is_initiator)만 컬럼 단위로 보관합니다.
+감정/대화 흐름/상황은 정수 코드로 바꿔 배열에 담고, 대사 문장은 해시 집합으로 중복을 확인합니다.
+pandas는 가져오기/내보내기(from_dataframe, to_dataframe)에서만 사용합니다.
+
+    python dialogue_store.py --lines 100000
+"""
+import argparse
+import logging
+import pickle
+import random
+import time
+import tracemalloc
+from array import array
+
+logger = logging.getLogger('린_봇')
+
+STORE_COLUMNS = ("대사", "감정", "대화 흐름", "상황", "is_initiator")
+_INITIATOR_CODES = {None: 0, False: 1, True: 2}
+_INITIATOR_VALUES = (None, False, True)
+
+
+def normalize_label(value):
+    """
+    빈 값(NaN/None)은 None으로, 나머지는 문자열로 통일합니다.
+    """
+    if value is None or value != value:  # NaN은 자기 자신과 같지 않음
+        return None
+    return str(value)
+
+
+def normalize_initiator(value):
+    if value is None or value != value:
+        return None
+    if value == True:
+        return True
+    if value == False:
+        return False
+    return None
+
+
+class LabelTable:
+    """
+    라벨 문자열과 정수 코드를 서로 바꿔 줍니다. 코드 0은 빈 값(None)입니다.
+    """
+
+    def __init__(self):
+        self.values = [None]
+        self._codes = {None: 0}
+
+    def __len__(self):
+        return len(self.values)
+
+    def find(self, value):
+        """
+        값의 코드를 반환합니다. 없는 값이면 추가하지 않고 None을 반환합니다.
+        """
+        return self._codes.get(normalize_label(value))
+
+    def code(self, value):
+        value = normalize_label(value)
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class DialogueStore:
+    """
+    대사 행을 컬럼별 배열로 보관하는 추가 전용 저장소입니다. 행 위치는 추가된 순서이며 바뀌지 않습니다.
+    """
+
+    def __init__(self):
+        self.lines = []
+        self.emotions = LabelTable()
+        self.flows = LabelTable()
+        self.situations = LabelTable()
+        self._emotion_codes = array("I")
+        self._flow_codes = array("I")
+        self._situation_codes = array("I")
+        self._initiator_codes = array("B")
+        self._line_set = set()
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __contains__(self, line):
+        return line in self._line_set
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        {컬럼 이름: 값 목록} 형태(대사 스냅샷)에서 저장소를 만듭니다. 없는 컬럼은 빈 값으로 채웁니다.
+        """
+        store = cls()
+        length = len(columns.get("대사", ()))
+        values = [columns.get(name) or [None] * length for name in STORE_COLUMNS]
+        for line, emotion, flow, situation, is_initiator in zip(*values):
+            store._append(line, emotion, flow, situation, is_initiator)
+        return store
+
+    @classmethod
+    def from_dataframe(cls, df_lines):
+        return cls.from_columns({name: df_lines[name].tolist() for name in STORE_COLUMNS if name in df_lines.columns})
+
+    def _append(self, line, emotion, flow, situation, is_initiator):
+        line = "" if line is None or line != line else str(line)
+        self.lines.append(line)
+        self._line_set.add(line)
+        self._emotion_codes.append(self.emotions.code(emotion))
+        self._flow_codes.append(self.flows.code(flow))
+        self._situation_codes.append(self.situations.code(situation))
+        self._initiator_codes.append(_INITIATOR_CODES[normalize_initiator(is_initiator)])
+        return len(self.lines) - 1
+
+    def append(self, row):
+        """
+        행 하나(dict)를 추가하고 그 위치를 반환합니다.
+        """
+        return self._append(row.get("대사"), row.get("감정"), row.get("대화 흐름"), row.get("상황"), row.get("is_initiator"))
+
+    def emotion(self, position):
+        return self.emotions.values[self._emotion_codes[position]]
+
+    def flow(self, position):
+        return self.flows.values[self._flow_codes[position]]
+
+    def situation(self, position):
+        return self.situations.values[self._situation_codes[position]]
+
+    @property
+    def flow_codes(self):
+        # 행별 대화 흐름 코드 (flows 라벨 표 기준), 읽기 전용으로 사용
+        return self._flow_codes
+
+    @property
+    def emotion_codes(self):
+        return self._emotion_codes
+
+    def is_initiator(self, position):
+        return _INITIATOR_VALUES[self._initiator_codes[position]]
+
+    def record(self, position):
+        return {
+            "대사": self.lines[position],
+            "감정": self.emotion(position),
+            "대화 흐름": self.flow(position),
+            "상황": self.situation(position),
+            "is_initiator": self.is_initiator(position),
+        }
+
+    def records(self, start=0):
+        """
+        start 위치부터 끝까지의 행을 dict 목록으로 반환합니다.
+        """
+        return [self.record(position) for position in range(start, len(self.lines))]
+
+    def lines_at(self, positions):
+        return [self.lines[position] for position in positions]
+
+    def candidate_rows(self, positions):
+        """
+        후보 선택에 쓰는 (대사, 대화 흐름, 감정) 튜플 목록을 반환합니다.
+        """
+        return [(self.lines[position], self.flow(position), self.emotion(position)) for position in positions]
+
+    def index_keys(self):
+        """
+        색인 생성용으로 행마다 (is_initiator, 감정, 대화 흐름, 상황)을 순서대로 돌려줍니다.
+        """
+        for position in range(len(self.lines)):
+            yield self.is_initiator(position), self.emotion(position), self.flow(position), self.situation(position)
+
+    def to_dataframe(self):
+        import pandas as pd  # 내보낼 때만 로드
+
+        return pd.DataFrame({
+            "대사": self.lines,
+            "감정": [self.emotions.values[code] for code in self._emotion_codes],
+            "대화 흐름": [self.flows.values[code] for code in self._flow_codes],
+            "상황": [self.situations.values[code] for code in self._situation_codes],
+            "is_initiator": [_INITIATOR_VALUES[code] for code in self._initiator_codes],
+        })
+
+
+def _synthetic_rows(count, rng):
+    # 실제 대사 시트와 같은 컬럼 구성 (봇이 쓰지 않는 컬럼 포함)
+    emotions = ["기쁨", "애정", "설렘", "감동", "조심스러움", "슬픔"]
+    flows = ["반응형", "자기감정표현", "질문형", "회피형", "일반"]
+    situations = ["인사", "애정 표현", "기념일/축하", "질문 응답", "일반"]
+    styles = ["시크", "츤데레", "다정", "장난", "Claude"]
+    times = ["아침", "점심", "저녁", "밤", None]
+    for i in range(count):
+        style = rng.choice(styles)
+        yield {
+            "상황": rng.choice(situations),
+            "말투/성격": style,
+            "대사": f"흥, 그런 말 한다고 내가 좋아할 줄 알았어? {i}",
+            "감정": rng.choice(emotions),
+            "톤": rng.choice(emotions),
+            "is_initiator": rng.random() < 0.1,
+            "시간": rng.choice(times),
+            "말투/성격_정제": style,
+            "대화 흐름": rng.choice(flows),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DataFrame과 대사 저장소의 메모리와 추가/중복 확인 비용을 비교합니다.")
+    parser.add_argument("--lines", type=int, default=100000, help="미리 채워 둘 대사 수")
+    parser.add_argument("--appends", type=int, default=1000, help="측정할 추가 횟수 (메시지마다 한 번)")
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    rng = random.Random(0)
+    rows = list(_synthetic_rows(args.lines + args.appends, rng))
+    base_rows, new_rows = rows[:args.lines], rows[args.lines:]
+
+    # 스냅샷에서 읽어 들이는 것과 같이 새로 만든 객체로 각각 측정
+    snapshot = pickle.dumps({name: [row[name] for row in base_rows] for name in base_rows[0]})
+    tracemalloc.start()
+    df_lines = pd.DataFrame(pickle.loads(snapshot))
+    df_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    store = DialogueStore.from_columns(pickle.loads(snapshot))
+    store_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"메모리 (대사 {args.lines}개): DataFrame {df_memory / 2**20:.1f}MB, 저장소 {store_memory / 2**20:.1f}MB")
+
+    appends = min(args.appends, 200)  # DataFrame 행 추가는 느려서 일부만 측정
+    started_at = time.perf_counter()
+    for row in new_rows[:appends]:
+        if row["대사"] not in df_lines["대사"].values:
+            df_lines.loc[len(df_lines)] = row
+    df_cost = (time.perf_counter() - started_at) / appends
+
+    started_at = time.perf_counter()
+    for row in new_rows:
+        if row["대사"] not in store:
+            store.append(row)
+    store_cost = (time.perf_counter() - started_at) / len(new_rows)
+    print(f"메시지당 중복 확인+추가: DataFrame {df_cost * 1000:.3f}ms, 저장소 {store_cost * 1e6:.2f}µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+여러 키워드 분류표를 한 번에 분류하는 분류기입니다.
+
+    python keyword_classifier.py --messages 20000
+"""
+import argparse
+import json
+import logging
+import random
+import time
+
+logger = logging.getLogger('린_봇')
+
+
+class KeywordClassifier:
+    """
+    여러 키워드 분류표의 키워드를 중복 없이 한 번씩만 찾아, 요청한 분류 결과를 한꺼번에 돌려주는 분류기입니다.
+    각 분류표는 라벨 우선순위를 유지하며, 앞선 라벨의 키워드가 하나라도 나오면 그 라벨을 선택합니다.
+    """
+
+    def __init__(self, tables):
+        self.tables = tables
+        self._tasks = []
+        for task, table in tables.items():
+            labels = []
+            for entry in table["labels"]:
+                labels.append((entry["label"], frozenset(entry.get("keywords", [])), tuple(entry.get("suffixes", []))))
+            self._tasks.append((task, table["default"], labels))
+        self._keyword_sets = {}  # 요청한 분류표 조합 -> 찾아야 할 키워드 (여러 분류표에 나오는 키워드는 한 번만)
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def _keywords(self, tasks):
+        if tasks is not None:
+            tasks = tuple(tasks)
+        keywords = self._keyword_sets.get(tasks)
+        if keywords is None:
+            found = set()
+            for task, _, labels in self._tasks:
+                if tasks is None or task in tasks:
+                    for _, entry_keywords, _ in labels:
+                        found.update(entry_keywords)
+            keywords = self._keyword_sets[tasks] = tuple(sorted(found))
+        return keywords
+
+    def scan(self, text, tasks=None):
+        """
+        텍스트에 등장하는 키워드 집합을 반환합니다. tasks를 주면 그 분류표의 키워드만 찾습니다.
+        정규식 하나로 합친 패턴은 위치마다 분기를 시도해 긴 텍스트에서 느리므로, 키워드마다 문자열 검색을 씁니다.
+        """
+        return {kw for kw in self._keywords(tasks) if kw in text}
+
+    def classify(self, text, tasks=None):
+        """
+        요청한 분류표의 키워드를 한 번씩만 찾아 분류표(기본값은 전체)의 라벨을 {분류표: 라벨} 형태로 반환합니다.
+        """
+        text = str(text).lower()
+        found = self.scan(text, tasks)
+        stripped = text.strip()
+        results = {}
+        for task, default, labels in self._tasks:
+            if tasks is not None and task not in tasks:
+                continue
+            results[task] = default
+            for label, keywords, suffixes in labels:
+                if not keywords.isdisjoint(found) or (suffixes and stripped.endswith(suffixes)):
+                    results[task] = label
+                    break
+        return results
+
+
+def _keyword_loop(tables, text, tasks):
+    # 이전 방식: 분류 함수마다 라벨 순서대로 any(kw in text ...)를 돌림
+    text = str(text).lower()
+    results = {}
+    for task in tasks:
+        table = tables[task]
+        results[task] = table["default"]
+        for entry in table["labels"]:
+            if any(kw in text for kw in entry.get("keywords", [])) or text.strip().endswith(tuple(entry.get("suffixes", []))):
+                results[task] = entry["label"]
+                break
+    return results
+
+
+def _sample_messages(count, rng):
+    # 실제 대사와 예시 발화를 섞어 메시지를 만듦
+    try:
+        from dialogue_snapshot import parse_sources
+
+        texts = [str(line) for line in parse_sources()["lines"]["대사"] if line == line]
+    except Exception:
+        texts = ["안녕 린아 잘 잤어?", "오늘 너무 피곤해서 같이 좀 쉬자", "보고 싶어서 연락했어", "흥, 그런 말 한다고 좋아할 줄 알았어?"]
+    return [rng.choice(texts) for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="키워드 반복 방식과 키워드 분류기의 초당 처리 메시지 수를 비교합니다.")
+    parser.add_argument("--messages", type=int, default=20000, help="분류할 메시지 수")
+    parser.add_argument("--keywords", default="classifier_keywords.json")
+    parser.add_argument("--repeat", type=int, nargs="+", default=[1, 4, 16], help="메시지를 이어 붙여 길이를 늘릴 배수")
+    args = parser.parse_args()
+
+    classifier = KeywordClassifier.from_file(args.keywords)
+    samples = _sample_messages(args.messages, random.Random(0))
+    # 유저 메시지 분석(감정, 감정 강도, 흐름), 대사 분류(상황, 대화 흐름), 감정 하나만 보는 호출을 각각 측정
+    task_sets = (("유저 메시지", ("emotion", "emotion_level", "user_flow")),
+                 ("대사", ("situation", "conversational_flow")),
+                 ("감정만", ("emotion",)))
+    for repeat in args.repeat:
+        messages = [" ".join([text] * repeat) for text in samples]
+        print(f"평균 {sum(map(len, messages)) / len(messages):.0f}자")
+        for name, tasks in task_sets:
+            started_at = time.perf_counter()
+            old_results = [_keyword_loop(classifier.tables, text, tasks) for text in messages]
+            loop_seconds = time.perf_counter() - started_at
+
+            started_at = time.perf_counter()
+            new_results = [classifier.classify(text, tasks) for text in messages]
+            scan_seconds = time.perf_counter() - started_at
+
+            mismatches = sum(a != b for a, b in zip(old_results, new_results))
+            print(f"  {name}: 키워드 반복 {len(messages) / loop_seconds:,.0f}개/초, 분류기 {len(messages) / scan_seconds:,.0f}개/초 "
+                  f"(결과가 다른 메시지 {mismatches}개)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+새로 생성된 대사를 SQLite 저널에 모아 두었다가 백그라운드에서 엑셀에 반영하는 저장소입니다.
+
+    python line_store.py --lines 1000 10000 100000
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger('린_봇')
+
+
+class LineJournal:
+    """
+    새로 생성된 대사를 SQLite 저널에 추가 전용으로 쌓아 두는 저장소입니다.
+    on_message에서는 메모리에만 추가하고, 디스크 기록과 엑셀 반영은 백그라운드에서 묶어서 처리합니다.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lines ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " line TEXT NOT NULL UNIQUE,"
+            " row_json TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " compacted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.commit()
+
+    def append(self, row):
+        """
+        대사 한 줄을 대기열에 추가합니다. 디스크 I/O 없이 바로 반환합니다.
+        """
+        with self._pending_lock:
+            self._pending.append(dict(row))
+
+    def pending_count(self):
+        with self._pending_lock:
+            return len(self._pending)
+
+    def flush(self):
+        """
+        대기 중인 대사를 한 번의 트랜잭션으로 저널에 기록합니다. 기록한 줄 수를 반환합니다.
+        """
+        # 저널 잠금을 먼저 잡아, 대기열에서 꺼낸 대사가 기록되기 전에 rows()가 누락하지 않도록 함
+        with self._db_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR IGNORE INTO lines (line, row_json, created_at) VALUES (?, ?, ?)",
+                        [(row["대사"], json.dumps(row, ensure_ascii=False), time.time()) for row in batch]
+                    )
+            except Exception:
+                # 기록에 실패한 대사는 다음 주기에 다시 시도
+                with self._pending_lock:
+                    self._pending = batch + self._pending
+                raise
+        return len(batch)
+
+    def rows(self):
+        """
+        아직 엑셀에 반영되지 않은 대사(대기열 포함)를 추가된 순서대로 반환합니다.
+        """
+        with self._db_lock:
+            stored = self._conn.execute(
+                "SELECT row_json FROM lines WHERE compacted = 0 ORDER BY id"
+            ).fetchall()
+        with self._pending_lock:
+            pending = list(self._pending)
+        return [json.loads(row_json) for (row_json,) in stored] + pending
+
+    def compact(self, excel_path, sheet_name):
+        """
+        저널에 쌓인 대사를 엑셀 시트에 한 번에 반영합니다. 반영한 줄 수를 반환합니다.
+        원본 파일은 임시 파일에 기록한 뒤 교체하므로, 기록 도중 다른 곳에서 읽어도 깨진 파일을 보지 않습니다.
+        """
+        self.flush()
+        with self._db_lock:
+            stored = self._conn.execute(
+                "SELECT id, row_json FROM lines WHERE compacted = 0 ORDER BY id"
+            ).fetchall()
+        if not stored:
+            return 0
+
+        import pandas as pd  # 엑셀 반영할 때만 로드
+
+        df_sheet = pd.read_excel(excel_path, sheet_name=sheet_name)
+        existing = set(df_sheet["대사"].astype(str)) if "대사" in df_sheet.columns else set()
+        new_rows = [row for row in (json.loads(row_json) for _, row_json in stored) if row["대사"] not in existing]
+        if new_rows:
+            df_sheet = pd.concat([df_sheet, pd.DataFrame(new_rows)], ignore_index=True)
+            base, ext = os.path.splitext(excel_path)
+            tmp_path = f"{base}.tmp{ext}"  # openpyxl은 확장자로 형식을 판별하므로 확장자 유지
+            shutil.copy2(excel_path, tmp_path)
+            with pd.ExcelWriter(tmp_path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
+                df_sheet.to_excel(writer, sheet_name=sheet_name, index=False)
+            os.replace(tmp_path, excel_path)
+
+        with self._db_lock:
+            with self._conn:
+                self._conn.executemany(
+                    "UPDATE lines SET compacted = 1 WHERE id = ?",
+                    [(row_id,) for row_id, _ in stored]
+                )
+        return len(new_rows)
+
+    def close(self):
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+
+def _synthetic_rows(count, start=0):
+    # 실제 대사 시트와 같은 컬럼 구성
+    emotions = ["기쁨", "애정", "설렘", "감동", "조심스러움"]
+    flows = ["반응형", "자기감정표현", "질문형", "회피형", "일반"]
+    for i in range(start, start + count):
+        yield {
+            "상황": "일반",
+            "말투/성격": "Claude",
+            "대사": f"흥, 그런 말 한다고 내가 좋아할 줄 알았어? {i}",
+            "감정": emotions[i % len(emotions)],
+            "감정/톤": emotions[i % len(emotions)],
+            "대화 흐름": flows[i % len(flows)],
+            "is_initiator": False,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="새 대사 저장 경로의 메시지당 지연 시간을 엑셀 전체 재기록 방식과 비교합니다.")
+    parser.add_argument("--lines", type=int, nargs="+", default=[1000, 10000, 100000], help="미리 채워 둘 대사 수")
+    parser.add_argument("--messages", type=int, default=1000, help="저널 경로에서 측정할 새 대사 수")
+    parser.add_argument("--excel-messages", type=int, default=3, help="엑셀 재기록 경로에서 측정할 새 대사 수 (느림)")
+    args = parser.parse_args()
+
+    import pandas as pd
+
+    for size in args.lines:
+        with tempfile.TemporaryDirectory(prefix="rin_line_store_") as workdir:
+            excel_path = os.path.join(workdir, "lines.xlsx")
+            df_lines = pd.DataFrame(list(_synthetic_rows(size)))
+            df_lines.to_excel(excel_path, sheet_name="lines_린", index=False)
+
+            # 이전 방식: 메시지마다 DataFrame에 행을 추가하고 시트 전체를 다시 기록 (이벤트 루프에서 실행)
+            started_at = time.perf_counter()
+            for row in _synthetic_rows(args.excel_messages, size):
+                if row["대사"] not in df_lines["대사"].values:
+                    df_lines.loc[len(df_lines)] = row
+                    with pd.ExcelWriter(excel_path, engine="openpyxl", mode="a", if_sheet_exists="replace") as writer:
+                        df_lines.to_excel(writer, sheet_name="lines_린", index=False)
+            excel_cost = (time.perf_counter() - started_at) / args.excel_messages
+
+            # 저널: 메시지마다 대기열에 추가만 하고, 기록과 엑셀 반영은 백그라운드 주기 작업에서 처리
+            journal = LineJournal(os.path.join(workdir, "journal.sqlite3"))
+            new_rows = list(_synthetic_rows(args.messages, size + args.excel_messages))
+            started_at = time.perf_counter()
+            for row in new_rows:
+                journal.append(row)
+            append_cost = (time.perf_counter() - started_at) / len(new_rows)
+            started_at = time.perf_counter()
+            journal.flush()
+            flush_seconds = time.perf_counter() - started_at
+            started_at = time.perf_counter()
+            journal.compact(excel_path, "lines_린")
+            compact_seconds = time.perf_counter() - started_at
+            journal.close()
+
+        print(f"대사 {size}개: 메시지당 엑셀 재기록 {excel_cost * 1000:.1f}ms, 저널 추가 {append_cost * 1e6:.2f}µs "
+              f"(백그라운드: 기록 {len(new_rows)}개 {flush_seconds * 1000:.1f}ms, 엑셀 반영 {compact_seconds:.2f}초)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+import asyncio
+import bisect
+import collections
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('린_봇')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Counter:
+    """
+    라벨별 누적 값입니다. callback을 주면 수집할 때마다 callback()의 값을 사용합니다(다른 객체가 세는 값을 노출할 때).
+    """
+    type_name = "counter"
+
+    def __init__(self, name, help_text, callback=None):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+        self.values = collections.defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        self.values[_label_key(labels)] += amount
+
+    def value(self, **labels):
+        return self.values.get(_label_key(labels), 0.0)
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                yield self.name, (), float(self.callback())
+            except Exception as e:
+                logger.error(f"지표 {self.name} 수집 중 오류: {str(e)}")
+            return
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        self.values[_label_key(labels)] = value
+
+
+class Histogram:
+    type_name = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}  # 라벨 -> [버킷별 개수..., 합계, 개수]
+
+    def observe(self, value, **labels):
+        series = self.series.setdefault(_label_key(labels), [0] * len(self.buckets) + [0.0, 0])
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def quantile(self, q, **labels):
+        """
+        버킷 경계 기준으로 근사한 분위수를 반환합니다.
+        """
+        series = self.series.get(_label_key(labels))
+        if not series or not series[-1]:
+            return None
+        target = q * series[-1]
+        cumulative = 0
+        for bound, count in zip(self.buckets, series):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+    def samples(self):
+        for key, series in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket", key + (("le", repr(bound)),), cumulative
+            yield f"{self.name}_bucket", key + (("le", "+Inf"),), series[-1]
+            yield f"{self.name}_sum", key, series[-2]
+            yield f"{self.name}_count", key, series[-1]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, callback=None):
+        return self._register(Counter(name, help_text, callback))
+
+    def gauge(self, name, help_text, callback=None):
+        return self._register(Gauge(name, help_text, callback))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def render(self):
+        """
+        Prometheus 텍스트 형식으로 모든 지표를 반환합니다.
+        """
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, key, value in metric.samples():
+                lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+async def start_http_server(registry, host="127.0.0.1", port=9108):
+    """
+    GET /metrics 요청에 Prometheus 형식으로 응답하는 최소한의 HTTP 서버를 시작합니다.
+    """
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # 헤더는 사용하지 않음
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", registry.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.error(f"지표 요청 처리 중 오류: {str(e)}")
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+class SamplingProfiler:
+    """
+    별도 스레드에서 대상 스레드(기본값은 이벤트 루프가 도는 현재 스레드)의 호출 스택을 일정 간격으로 수집합니다.
+    focus에 함수 이름을 주면 그 함수가 스택에 있는 표본만 남기며, 결과는 flamegraph용 collapsed 형식으로 저장합니다.
+    """
+
+    def __init__(self, interval=0.005, focus=(), thread_id=None):
+        self.interval = interval
+        self.focus = set(focus)
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self.stacks.clear()
+        self.samples = 0
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.samples += 1
+            if self.focus and not any(entry.split(" ", 1)[0] in self.focus for entry in stack):
+                continue
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def write_collapsed(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top_functions(self, limit=10):
+        """
+        표본에서 가장 많이 실행 중이던 함수(스택 맨 위)와 표본 수를 반환합니다.
+        """
+        leaves = collections.Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
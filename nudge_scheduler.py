@@ -0,0 +1,134 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+logger = logging.getLogger('린_봇')
+
+KST = timezone(timedelta(hours=9))  # 한국은 서머타임이 없으므로 고정 오프셋 사용
+# 자동 메시지에 쓰는 대사의 상황 값: (린이 먼저 말 걸 때, 유저가 오래 답하지 않을 때)
+NUDGE_SITUATIONS = ("린이 먼저 말 거는", "무시당함")
+
+
+class NudgeScheduler:
+    """
+    린이 마지막으로 말한 뒤 유저가 답하지 않은 채널에 자동 메시지를 보내는 스케줄러입니다.
+    채널마다 자동 메시지 시각을 힙에 넣어 두고 가장 이른 시각까지만 잠들며, 유저가 답하면 예약을 취소합니다.
+
+    send_nudge(channel_id, situation)는 메시지를 보냈으면 True를 반환해야 하며, 그 시각부터 다시 예약됩니다.
+    예약이 더 이상 없는 채널은 상태를 남기지 않습니다.
+    """
+
+    def __init__(self, send_nudge, first_delay=3600, ignored_after=5400, window_end=7200,
+                 quiet_hours=(1, 9), tz=KST, clock=time.time):
+        self.send_nudge = send_nudge
+        self.first_delay = first_delay
+        self.ignored_after = ignored_after
+        self.window_end = window_end
+        self.quiet_hours = quiet_hours
+        self.tz = tz
+        self.clock = clock
+        self.sent = 0
+        self._heap = []  # (예약 시각, 순번, 채널 ID)
+        self._entries = {}  # 채널 ID -> (예약 시각, 순번, 린이 마지막으로 말한 시각)
+        self._counter = itertools.count()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _push(self, channel_id, due_at, last_bot_at):
+        seq = next(self._counter)
+        self._entries[channel_id] = (due_at, seq, last_bot_at)
+        heapq.heappush(self._heap, (due_at, seq, channel_id))
+        # 취소된 예약이 힙에 너무 많이 쌓이면 정리
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(due, s, ch) for ch, (due, s, _) in self._entries.items()]
+            heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def bot_spoke(self, channel_id, at=None):
+        """
+        린이 채널에 말했음을 기록하고 first_delay 뒤로 자동 메시지를 예약합니다.
+        """
+        at = self.clock() if at is None else at
+        self._push(channel_id, at + self.first_delay, at)
+
+    def user_spoke(self, channel_id):
+        """
+        유저가 답했으므로 채널의 예약을 취소합니다.
+        """
+        self._entries.pop(channel_id, None)
+
+    def _is_quiet(self, timestamp):
+        start, end = self.quiet_hours
+        return start <= datetime.fromtimestamp(timestamp, self.tz).hour < end
+
+    def _quiet_end(self, timestamp):
+        local = datetime.fromtimestamp(timestamp, self.tz)
+        return local.replace(hour=self.quiet_hours[1], minute=0, second=0, microsecond=0).timestamp()
+
+    def situation_for(self, elapsed):
+        """
+        린이 마지막으로 말한 뒤 지난 시간(초)에 맞는 상황을 반환합니다. 보낼 시간대가 지났으면 None입니다.
+        """
+        if self.first_delay <= elapsed <= self.ignored_after:
+            return NUDGE_SITUATIONS[0]
+        if self.ignored_after < elapsed <= self.window_end:
+            return NUDGE_SITUATIONS[1]
+        return None
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, seq, channel_id = heapq.heappop(self._heap)
+            entry = self._entries.get(channel_id)
+            if entry is None or entry[1] != seq:
+                continue  # 취소되었거나 다시 예약된 항목
+            del self._entries[channel_id]
+            due.append((channel_id, entry[2]))
+        return due
+
+    async def _fire(self, channel_id, last_bot_at, now):
+        if self._is_quiet(now):
+            # 취침 시간이 끝나는 시각에도 보낼 시간대 안이라면 그때로 미룸
+            resume_at = self._quiet_end(now)
+            if self.situation_for(resume_at - last_bot_at) is not None:
+                self._push(channel_id, resume_at, last_bot_at)
+            return
+
+        situation = self.situation_for(now - last_bot_at)
+        if situation is None:
+            return
+        try:
+            if await self.send_nudge(channel_id, situation):
+                self.sent += 1
+                self.bot_spoke(channel_id, now)
+        except Exception as e:
+            logger.error(f"자동 메시지 전송 중 오류 (채널: {channel_id}): {str(e)}")
+
+    async def run_once(self, now=None):
+        """
+        지금 시각까지 예약된 자동 메시지를 처리합니다.
+        """
+        now = self.clock() if now is None else now
+        for channel_id, last_bot_at in self._pop_due(now):
+            await self._fire(channel_id, last_bot_at, now)
+
+    async def run(self):
+        """
+        다음 예약 시각까지 잠들었다가 처리하기를 반복합니다. 새 예약이 들어오면 깨어나 대기 시간을 다시 계산합니다.
+        """
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"자동 메시지 스케줄러 오류: {str(e)}")
+            timeout = self._heap[0][0] - self.clock() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,124 @@
+import logging
+
+from conversation_memory import estimate_tokens, summary_block
+
+logger = logging.getLogger('린_봇')
+
+CACHE_CONTROL = {"type": "ephemeral"}
+# 캐시할 수 있는 최소 앞부분 길이(토큰). claude-3-haiku는 2048, Sonnet/Opus는 1024이며 이보다 짧으면 표시해도 캐시되지 않음
+MIN_CACHE_TOKENS = 2048
+
+
+def build_cached_request(system_prompt, history, user_message, summary=None, **params):
+    """
+    시스템 프롬프트와 대화 이력을 캐시 가능한 앞부분으로, 이번 유저 메시지를 뒷부분으로 배치한 요청 인자를 만듭니다.
+    캐시 구간은 매 턴 같은 바이트가 되도록 항상 같은 형태의 텍스트 블록으로 구성합니다.
+    지난 대화 요약은 시스템 프롬프트 바로 뒤 블록에 넣어, 요약이 바뀌어도 시스템 프롬프트 캐시는 유지되게 합니다.
+    캐시 표시는 길이와 관계없이 항상 붙입니다. 최소 캐시 길이보다 짧으면 API가 표시를 무시할 뿐 비용은 늘지 않습니다.
+    """
+    system = [{"type": "text", "text": system_prompt, "cache_control": CACHE_CONTROL}]
+    if summary:
+        system.append({"type": "text", "text": summary_block(summary)})
+
+    messages = []
+    for item in history:
+        messages.append({"role": item["role"], "content": [{"type": "text", "text": item["content"]}]})
+    if messages:
+        # 마지막 이력 메시지까지를 캐시 구간으로 지정 (시스템 프롬프트와 요약 포함)
+        last_block = messages[-1]["content"][-1]
+        messages[-1]["content"][-1] = {**last_block, "cache_control": CACHE_CONTROL}
+    messages.append({"role": "user", "content": user_message})
+
+    return {"system": system, "messages": messages, **params}
+
+
+def cached_prefix_blocks(request):
+    """
+    요청에서 마지막 cache_control 표시까지의 텍스트 블록 목록을 반환합니다. 표시가 없으면 빈 목록입니다.
+    """
+    blocks = []
+    system = request.get("system")
+    if isinstance(system, list):
+        blocks.extend(system)
+    for message in request.get("messages", []):
+        if isinstance(message["content"], list):
+            blocks.extend(message["content"])
+        else:
+            blocks.append({"type": "text", "text": message["content"]})
+    marked = [i for i, block in enumerate(blocks) if "cache_control" in block]
+    return blocks[:marked[-1] + 1] if marked else []
+
+
+def cached_prefix_tokens(request):
+    """
+    캐시 구간의 추정 토큰 수를 반환합니다. 보고용이며 캐시 표시 여부에는 쓰지 않습니다.
+    """
+    return sum(estimate_tokens(block["text"]) for block in cached_prefix_blocks(request))
+
+
+class UsageTracker:
+    """
+    Claude 호출별 캐시/비캐시 입력 토큰과 지연 시간을 누적합니다.
+    """
+
+    # 기본 입력 단가 대비 캐시 쓰기/읽기 단가 비율
+    CACHE_WRITE_RATE = 1.25
+    CACHE_READ_RATE = 0.1
+
+    def __init__(self):
+        self.calls = 0
+        self.input_tokens = 0
+        self.cache_creation_input_tokens = 0
+        self.cache_read_input_tokens = 0
+        self.output_tokens = 0
+        self.latency_total = 0.0
+        self.cached_latency_total = 0.0
+        self.cached_calls = 0
+        self.prefix_requests = 0
+        self.prefix_tokens = 0
+        self.short_prefix_requests = 0
+
+    def record(self, usage, latency):
+        uncached = getattr(usage, "input_tokens", 0) or 0
+        written = getattr(usage, "cache_creation_input_tokens", 0) or 0
+        read = getattr(usage, "cache_read_input_tokens", 0) or 0
+        self.calls += 1
+        self.input_tokens += uncached
+        self.cache_creation_input_tokens += written
+        self.cache_read_input_tokens += read
+        self.output_tokens += getattr(usage, "output_tokens", 0) or 0
+        self.latency_total += latency
+        if read:
+            self.cached_calls += 1
+            self.cached_latency_total += latency
+        logger.info(f"Claude 토큰 사용량: 비캐시 {uncached}, 캐시 쓰기 {written}, 캐시 읽기 {read}, 지연 {latency:.2f}초")
+
+    def record_prefix(self, prefix_tokens, min_cache_tokens=MIN_CACHE_TOKENS):
+        """
+        보낼 요청의 캐시 구간 추정 토큰 수를 기록합니다. min_cache_tokens보다 짧으면 캐시되지 않을 요청으로 셉니다.
+        """
+        self.prefix_requests += 1
+        self.prefix_tokens += prefix_tokens
+        if prefix_tokens < min_cache_tokens:
+            self.short_prefix_requests += 1
+
+    def summary(self):
+        """
+        캐시를 쓰지 않았을 때와 비교한 입력 비용 절감률과 평균 지연 시간, 캐시 구간 길이를 반환합니다.
+        """
+        total_input = self.input_tokens + self.cache_creation_input_tokens + self.cache_read_input_tokens
+        billed_input = (self.input_tokens
+                        + self.cache_creation_input_tokens * self.CACHE_WRITE_RATE
+                        + self.cache_read_input_tokens * self.CACHE_READ_RATE)
+        uncached_calls = self.calls - self.cached_calls
+        return {
+            "calls": self.calls,
+            "input_tokens": total_input,
+            "cache_read_ratio": self.cache_read_input_tokens / total_input if total_input else 0.0,
+            "input_cost_saving": 1 - billed_input / total_input if total_input else 0.0,
+            "avg_latency_cached": self.cached_latency_total / self.cached_calls if self.cached_calls else 0.0,
+            "avg_latency_uncached": ((self.latency_total - self.cached_latency_total) / uncached_calls
+                                     if uncached_calls else 0.0),
+            "avg_prefix_tokens": self.prefix_tokens / self.prefix_requests if self.prefix_requests else 0.0,
+            "short_prefix_ratio": self.short_prefix_requests / self.prefix_requests if self.prefix_requests else 0.0,
+        }
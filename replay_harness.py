@@ -0,0 +1,809 @@
+"""
+디스코드 게이트웨이와 Claude API 없이 메시지 처리 전체 경로(on_message → 대기열 → 응답 전송)를 재생하는 부하 테스트 도구입니다.
+가짜 채널/메시지 객체와 지연 시간·오류율을 정할 수 있는 Claude 대역 클라이언트를 사용하며,
+처리량, 지연 시간 분위수, API 호출 수, 메모리 증가량을 보고합니다. 기준을 넘으면 종료 코드 1로 끝나 CI에서 성능 회귀 검사에 쓸 수 있습니다.
+
+    python replay_harness.py --messages 2000 --channels 50 --latency 0.3 --error-rate 0.02
+    python replay_harness.py --corpus recorded.jsonl --max-p95 2.5 --min-throughput 20 --json report.json
+    python replay_harness.py --messages 2000 --reload-every 2 --max-reload-loop-lag 0.5
+    python replay_harness.py --startup
+
+--corpus는 한 줄에 메시지 하나인 텍스트 파일이나, {"content": ..., "channel": ..., "guild": ..., "at": 초} 형식의 JSONL 파일입니다.
+--reload-every를 주면 재생 중에 캐릭터 데이터를 주기적으로 강제 리로드하면서, 턴마다 대사 저장소와 두 색인이 같은 세대인지,
+리로드 전후로 새 대사가 빠지지 않았는지, 리로드 동안 이벤트 루프가 얼마나 멈췄는지를 보고합니다. 세대가 섞이면 기준 미달로 처리합니다.
+--shard-count/--shard-ids를 주면 디스코드와 같은 방식((서버 ID >> 22) % 샤드 수)으로 자기 샤드의 메시지만 재생하며,
+여러 프로세스로 나눠 돌리려면 shard_launcher.py --replay를 사용합니다.
+--startup은 메시지를 재생하지 않고 봇 시작 비용(모듈 import, 캐릭터 데이터 로드, 첫 응답)만 잽니다.
+스냅샷이 최신인데도 import 뒤에 pandas/openpyxl이 올라와 있으면 기준 미달로 처리합니다.
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import json
+import logging
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, deque
+from types import SimpleNamespace
+
+from conversation_memory import SUMMARY_SYSTEM_PROMPT
+from prompt_builder import MIN_CACHE_TOKENS, cached_prefix_blocks, cached_prefix_tokens
+
+# 스냅샷이 최신이면 봇 시작 시 불러오지 않아야 하는 엑셀 파싱용 모듈
+EXCEL_MODULES = ("pandas", "openpyxl")
+SELECTION_SYSTEM_PROMPT = "후보 대사 중에서 가장 적절한 것을 선택하세요."
+STUB_SUMMARY = "유저는 린에게 하루 일과와 기분을 자주 이야기하고, 린은 툴툴대면서도 챙겨 주는 중이다."
+CANDIDATE_LINE = re.compile(r"^\d+\. ", re.MULTILINE)
+UNLIMITED_TOP_K = 10**9  # --candidate-top-k 0일 때 봇에 넘기는 값 (후보를 줄이지 않음)
+
+SYNTHETIC_OPENERS = ["", "린아 ", "있잖아 ", "음 ", "오늘 ", "근데 "]
+SYNTHETIC_BODIES = [
+    "안녕", "좋은 아침", "잘 잤어?", "보고 싶어", "사랑해", "오늘 뭐 했어?", "왜 연락 안 했어?",
+    "이것 좀 도와줘", "같이 영화 볼래?", "오늘 너무 슬퍼", "짜증나는 일이 있었어", "고마워",
+    "생일 축하해줘", "두근거려", "언제 만날 수 있어?", "그냥 심심해서", "밥 먹었어?", "내일 시험이라 긴장돼",
+]
+SYNTHETIC_CLOSERS = ["", "!", "~", "..", " ㅎㅎ", " ㅠㅠ"]
+STUB_REPLIES = [
+    "흥, 그런 말 한다고 내가 좋아할 줄 알았어?",
+    "뭐, 네가 그렇게까지 말한다면 들어줄게.",
+    "바보. 그런 건 먼저 물어보지 않아도 알잖아.",
+    "진짜, 너는 가끔 귀엽다니까. 가끔만이야!",
+    "그 말, 한 번만 더 해봐. 못 들은 척해 줄 테니까.",
+]
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+def synthetic_corpus(count, channels, distinct, rng):
+    """
+    키워드 분류표에 걸리는 표현을 섞은 메시지를 distinct종류 만들고, 그중에서 count개를 채널에 골고루 뿌립니다.
+    """
+    pool = [rng.choice(SYNTHETIC_OPENERS) + rng.choice(SYNTHETIC_BODIES) + rng.choice(SYNTHETIC_CLOSERS)
+            for _ in range(distinct)]
+    # 디스코드 ID처럼 샤드 계산에 쓰이는 상위 비트에 채널 번호를 넣음
+    return [{"content": rng.choice(pool), "channel": rng.randrange(channels) << 22} for _ in range(count)]
+
+
+def load_corpus(path, channels):
+    """
+    녹화된 메시지 파일을 읽습니다. 채널이 없는 항목은 순서대로 채널을 돌아가며 배정합니다.
+    """
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line) if path.endswith(".jsonl") else {"content": line}
+            entry.setdefault("channel", (len(entries) % channels) << 22)
+            entries.append(entry)
+    return entries
+
+
+def shard_for(entry, shard_count):
+    """
+    메시지가 속한 샤드 번호를 반환합니다. 서버 ID가 없으면 채널 ID를 서버 ID 대신 사용합니다.
+    """
+    return (entry.get("guild", entry["channel"]) >> 22) % shard_count
+
+
+class StubMessages:
+    """
+    anthropic.AsyncAnthropic().messages를 흉내 내는 대역입니다. 시드를 고정하면 같은 순서의 요청에 같은 응답을 돌려줍니다.
+    후보 평가 요청에는 후보 번호나 "없음"을, 대사 생성 요청에는 매번 다른 대사를 반환합니다.
+    """
+
+    def __init__(self, latency, jitter, error_rate, none_rate, chunk_delay, make_error, rng, input_latency=0.0):
+        self.latency = latency
+        self.input_latency = input_latency  # 입력 토큰 1000개당 추가 지연(초)
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.none_rate = none_rate
+        self.chunk_delay = chunk_delay
+        self.make_error = make_error
+        self.rng = rng
+        self.calls = Counter()
+        self.errors = 0
+        self.generated = 0
+
+    async def _respond(self, kind, kwargs):
+        self.calls[kind] += 1
+        delay = self.rng.gauss(self.latency, self.jitter) + self.input_latency * self._prompt_size(kwargs) / 1000
+        await asyncio.sleep(max(0.0, delay))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            raise self.make_error()
+        if kwargs.get("system") == SELECTION_SYSTEM_PROMPT:
+            candidate_count = len(CANDIDATE_LINE.findall(kwargs["messages"][0]["content"]))
+            if not candidate_count or self.rng.random() < self.none_rate:
+                return "없음"
+            return str(self.rng.randint(1, candidate_count))
+        if kwargs.get("system") == SUMMARY_SYSTEM_PROMPT:
+            return STUB_SUMMARY
+        self.generated += 1
+        return f"{self.rng.choice(STUB_REPLIES)} ({self.generated})"
+
+    @staticmethod
+    def _prompt_size(kwargs):
+        # 한국어는 대략 글자 하나가 토큰 하나이므로 글자 수를 입력 토큰 수로 씀
+        return len(str(kwargs.get("system", ""))) + len(str(kwargs.get("messages", "")))
+
+    @staticmethod
+    def _cached_prefix(kwargs):
+        """
+        마지막 cache_control 표시까지의 앞부분 크기를 반환합니다. 그 앞부분의 추정 토큰 수가 모델의 최소 캐시 길이보다 짧으면
+        실제 API처럼 캐시되지 않은 것으로 보고 0을 반환합니다.
+        """
+        if cached_prefix_tokens(kwargs) < MIN_CACHE_TOKENS:
+            return 0
+        return sum(len(block["text"]) for block in cached_prefix_blocks(kwargs))
+
+    def _usage(self, kwargs, text):
+        prompt_size = self._prompt_size(kwargs)
+        cached = min(prompt_size, self._cached_prefix(kwargs))
+        return SimpleNamespace(
+            input_tokens=prompt_size - cached,
+            output_tokens=len(text),
+            cache_creation_input_tokens=0,
+            cache_read_input_tokens=cached,
+        )
+
+    async def create(self, timeout=None, **kwargs):
+        text = await self._respond("create", kwargs)
+        return SimpleNamespace(content=[SimpleNamespace(text=text)], usage=self._usage(kwargs, text))
+
+    def stream(self, timeout=None, **kwargs):
+        return StubStream(self, kwargs)
+
+
+class StubStream:
+    def __init__(self, messages, kwargs):
+        self.messages = messages
+        self.kwargs = kwargs
+        self.text = ""
+
+    async def __aenter__(self):
+        self.text = await self.messages._respond("stream", self.kwargs)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @property
+    async def text_stream(self):
+        for start in range(0, len(self.text), 6):
+            await asyncio.sleep(self.messages.chunk_delay)
+            yield self.text[start:start + 6]
+
+    async def get_final_message(self):
+        return SimpleNamespace(content=[SimpleNamespace(text=self.text)],
+                               usage=self.messages._usage(self.kwargs, self.text))
+
+
+class LatencyRecorder:
+    def __init__(self):
+        self.latencies = []
+        self.turns = 0
+        self.sends = 0
+        self.edits = 0
+        self.shed = 0
+        self.unanswered = 0
+        self.reload = None  # --reload-every를 줬을 때의 ReloadMonitor
+        self.selection_latencies = []  # 후보 평가 API 요청별 소요 시간 (캐시 적중 제외)
+        self.selection_candidates = []  # 후보 평가 요청에 넣은 후보 수
+        self.ranking_latencies = []  # 로컬 점수로 후보를 줄이는 데 걸린 시간
+
+
+class ReloadMonitor:
+    """
+    재생 중에 refresh_character_data를 주기적으로 강제 실행하고, 처리 중인 턴이 쓰는 대사 저장소/후보 색인/유사도 색인이
+    항상 같은 세대인지 확인합니다. 짧은 주기로 잠드는 태스크의 기상 지연으로 이벤트 루프 정지 시간도 잽니다.
+    """
+
+    def __init__(self, rin, interval, tick=0.01):
+        self.rin = rin
+        self.interval = interval
+        self.tick = tick
+        self.reloading = False
+        self.reloads = 0
+        self.reload_seconds = []
+        self.turns_overlapped = 0  # 처리 도중 리로드가 진행되었거나 데이터가 교체된 턴
+        self.loop_lag = {"reloading": 0.0, "idle": 0.0}  # 상태별 최대 이벤트 루프 지연(초)
+        self.inconsistencies = []
+        self.lost_lines = None
+
+    def check(self, where, store, index, similarity):
+        rin = self.rin
+        if store is not rin.dialogue_store or index is not rin.candidate_index:
+            self.inconsistencies.append(f"{where}: 교체 전 대사 저장소나 후보 색인을 사용")
+        elif not len(store) == index.size == len(similarity):
+            self.inconsistencies.append(f"{where}: 대사 {len(store)}개, 후보 색인 {index.size}개, 유사도 색인 {len(similarity)}개")
+
+    def install(self):
+        """
+        후보 검색 함수를 감싸, 검색할 때 넘겨받은 저장소와 색인이 현재 세대인지 확인합니다.
+        """
+        rin = self.rin
+        lookup = rin.get_response_by_emotion_and_context
+
+        def checked_lookup(dialogue_store, candidate_index, *args, **kwargs):
+            self.check("후보 검색", dialogue_store, candidate_index, rin.similarity_index)
+            return lookup(dialogue_store, candidate_index, *args, **kwargs)
+
+        rin.get_response_by_emotion_and_context = checked_lookup
+
+    async def run_turn(self, turn):
+        reloads_before = self.reloads
+        reloading_before = self.reloading
+        try:
+            await turn
+        finally:
+            if reloading_before or self.reloading or self.reloads != reloads_before:
+                self.turns_overlapped += 1
+            self.check("턴 종료", self.rin.dialogue_store, self.rin.candidate_index, self.rin.similarity_index)
+
+    async def reload_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            started_at = time.perf_counter()
+            self.reloading = True
+            try:
+                await self.rin.refresh_character_data(force=True)
+            finally:
+                self.reloading = False
+            self.reloads += 1
+            self.reload_seconds.append(time.perf_counter() - started_at)
+
+    async def watch_loop(self):
+        while True:
+            state = "reloading" if self.reloading else "idle"
+            started_at = time.perf_counter()
+            await asyncio.sleep(self.tick)
+            lag = time.perf_counter() - started_at - self.tick
+            self.loop_lag[state] = max(self.loop_lag[state], lag)
+
+    def finish(self, check_lines):
+        """
+        재생이 끝난 뒤 이 프로세스가 저널에 추가한 대사가 모두 현재 저장소에 남아 있는지 셉니다.
+        """
+        if check_lines:
+            self.lost_lines = sum(row["대사"] not in self.rin.dialogue_store for row in self.rin.line_journal.rows())
+        self.check("재생 종료", self.rin.dialogue_store, self.rin.candidate_index, self.rin.similarity_index)
+
+    def report(self):
+        durations = sorted(self.reload_seconds)
+        return {
+            "interval_seconds": self.interval,
+            "reloads": self.reloads,
+            "reload_p50_seconds": percentile(durations, 0.50),
+            "reload_max_seconds": durations[-1] if durations else None,
+            "turns_overlapped": self.turns_overlapped,
+            "max_loop_lag_seconds": dict(self.loop_lag),
+            "inconsistencies": len(self.inconsistencies),
+            "inconsistency_examples": self.inconsistencies[:5],
+            "lost_lines": self.lost_lines,
+        }
+
+
+class FakeSentMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content):
+        await asyncio.sleep(self.channel.send_latency)
+        self.channel.recorder.edits += 1
+        self.content = content
+
+
+class FakeChannel:
+    """
+    discord 채널 대역입니다. 도착한 메시지 시각을 보관했다가, 그 메시지들이 합쳐진 턴의 첫 전송 시점에 지연 시간을 기록합니다.
+    """
+
+    def __init__(self, channel_id, recorder, send_latency):
+        self.id = channel_id
+        self.recorder = recorder
+        self.send_latency = send_latency
+        self.arrivals = deque()
+        self.turn_arrivals = []
+
+    async def send(self, content):
+        await asyncio.sleep(self.send_latency)
+        now = time.perf_counter()
+        self.recorder.sends += 1
+        self.recorder.latencies.extend(now - arrived_at for arrived_at in self.turn_arrivals)
+        self.turn_arrivals = []
+        return FakeSentMessage(self, content)
+
+
+class FakeMessage:
+    def __init__(self, content, author, channel):
+        self.content = content
+        self.author = author
+        self.channel = channel
+
+
+def configure_environment(args, workdir):
+    """
+    봇 모듈을 불러오기 전에 대역 실행용 환경 변수를 설정합니다. 저널과 스냅샷은 임시 디렉터리에 만듭니다.
+    """
+    os.environ.update({
+        "DISCORD_BOT_TOKEN": "replay",
+        "CLAUDE_API_KEY": "replay",
+        "LINE_JOURNAL_PATH": os.path.join(workdir, "lines_journal.sqlite3"),
+        "DIALOGUE_SNAPSHOT_PATH": args.snapshot or os.path.join(workdir, "dialogue_snapshot.pkl"),
+        "SESSION_SNAPSHOT_PATH": "",
+        "METRICS_PORT": "0",
+        "STREAM_REPLIES": "1" if args.stream else "0",
+        "STREAM_EDIT_INTERVAL": str(args.stream_edit_interval),
+        "MESSAGE_DEBOUNCE": str(args.debounce),
+        "MESSAGE_MAX_WAIT": str(max(args.debounce, args.max_wait)),
+        "CLAUDE_RPM": str(args.rpm),
+        "CLAUDE_TPM": str(args.tpm),
+        "SHARD_COUNT": str(args.shard_count),
+        "SHARD_IDS": ",".join(str(shard_id) for shard_id in args.shard_ids),
+        "LINE_STORE_WRITER": "1" if not args.shard_ids or 0 in args.shard_ids else "0",
+        "RETRIEVAL_MIN_POOL": "0" if args.no_retrieval else str(args.retrieval_min_pool),
+        "CANDIDATE_TOP_K": str(args.candidate_top_k or UNLIMITED_TOP_K),
+        "SPECULATIVE_GENERATION": args.speculative,
+        "SPECULATIVE_MAX_HIT_RATE": str(args.speculative_max_hit_rate),
+    })
+
+
+async def replay(rin, corpus, args, stub):
+    recorder = LatencyRecorder()
+    channels = {}
+
+    def channel_for(channel_id):
+        channel = channels.get(channel_id)
+        if channel is None:
+            channel = channels[channel_id] = FakeChannel(channel_id, recorder, args.send_latency)
+        return channel
+
+    rin.bot.get_channel = channels.get
+
+    async def no_commands(message):
+        return None
+
+    # 로그인하지 않은 봇으로는 명령어 컨텍스트를 만들 수 없으므로 명령어 처리는 건너뜀
+    rin.bot.process_commands = no_commands
+
+    respond_to_turn = rin.channel_queue.handler
+    monitor = None
+    background = []
+    if args.reload_every > 0:
+        monitor = recorder.reload = ReloadMonitor(rin, args.reload_every)
+        monitor.install()
+        background = [asyncio.create_task(monitor.reload_forever()), asyncio.create_task(monitor.watch_loop())]
+
+    async def timed_turn(channel_id, user_inputs):
+        channel = channels[channel_id]
+        arrivals = list(channel.arrivals)
+        channel.arrivals.clear()
+        # 대기열이 가득 차면 가장 오래된 메시지부터 버리므로, 처리되는 것은 마지막 len(user_inputs)개
+        channel.turn_arrivals = arrivals[-len(user_inputs):]
+        recorder.shed += len(arrivals) - len(channel.turn_arrivals)
+        recorder.turns += 1
+        try:
+            if monitor is not None:
+                await monitor.run_turn(respond_to_turn(channel_id, user_inputs))
+            else:
+                await respond_to_turn(channel_id, user_inputs)
+        finally:
+            recorder.unanswered += len(channel.turn_arrivals)
+            channel.turn_arrivals = []
+
+    rin.channel_queue.handler = timed_turn
+
+    rank_positions = rin.rank_positions
+    evaluate_candidate_responses = rin.evaluate_candidate_responses
+
+    def timed_rank(*args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return rank_positions(*args, **kwargs)
+        finally:
+            recorder.ranking_latencies.append(time.perf_counter() - started_at)
+
+    async def timed_evaluate(user_input, candidates, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await evaluate_candidate_responses(user_input, candidates, *args, **kwargs)
+        finally:
+            recorder.selection_latencies.append(time.perf_counter() - started_at)
+            recorder.selection_candidates.append(len(candidates))
+
+    rin.rank_positions = timed_rank
+    rin.evaluate_candidate_responses = timed_evaluate
+
+    authors = {}
+    started_at = time.perf_counter()
+    for i, entry in enumerate(corpus):
+        if "at" in entry and args.speed > 0:
+            delay = started_at + entry["at"] / args.speed - time.perf_counter()
+        elif args.rate > 0:
+            delay = started_at + i / args.rate - time.perf_counter()
+        else:
+            delay = 0
+        await asyncio.sleep(max(0.0, delay))
+
+        channel = channel_for(entry["channel"])
+        author = authors.setdefault(entry["channel"], SimpleNamespace(id=entry["channel"], bot=False, name="replay"))
+        channel.arrivals.append(time.perf_counter())
+        await rin.on_message(FakeMessage(entry["content"], author, channel))
+
+    await rin.channel_queue.join()
+    elapsed = time.perf_counter() - started_at
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    if monitor is not None:
+        monitor.finish(check_lines=not args.shard_ids)
+    recorder.shed += sum(len(channel.arrivals) for channel in channels.values())
+    return recorder, elapsed
+
+
+def build_report(rin, recorder, elapsed, stub, memory, corpus_size, journal_rows):
+    latencies = sorted(recorder.latencies)
+    answered = len(latencies)
+    stages = {}
+    for stage in rin.PIPELINE_STAGES:
+        p50 = rin.stage_latency.quantile(0.5, stage=stage)
+        if p50 is not None:
+            stages[stage] = {"p50_le": p50, "p95_le": rin.stage_latency.quantile(0.95, stage=stage)}
+    if rin.first_visible_latency.quantile(0.5) is not None:
+        stages["stream_first_visible"] = {"p50_le": rin.first_visible_latency.quantile(0.5),
+                                          "p95_le": rin.first_visible_latency.quantile(0.95)}
+    api_calls = sum(stub.calls.values())
+    selection_latencies = sorted(recorder.selection_latencies)
+    ranking_latencies = sorted(recorder.ranking_latencies)
+    selection_calls = len(selection_latencies)
+    selection_input_tokens = int(rin.claude_tokens.value(kind="selection", type="input_tokens")
+                                 + rin.claude_tokens.value(kind="selection", type="cache_read_input_tokens"))
+    return {
+        "messages": corpus_size,
+        "answered": answered,
+        "turns": recorder.turns,
+        "shed": recorder.shed,
+        "unanswered": recorder.unanswered,
+        "elapsed_seconds": elapsed,
+        "throughput_messages_per_second": answered / elapsed if elapsed else 0.0,
+        "latency_seconds": {
+            "mean": sum(latencies) / answered if answered else None,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "stages": stages,
+        "api": {
+            "calls": dict(stub.calls),
+            "calls_by_kind": {kind: int(rin.claude_api_calls.value(kind=kind)) for kind in rin.CLAUDE_CALL_KINDS},
+            "injected_errors": stub.errors,
+            "retries": rin.claude_governor.retries,
+            "circuit_rejected": rin.claude_governor.rejected,
+            "calls_per_message": api_calls / corpus_size if corpus_size else 0.0,
+            "input_tokens_by_kind": {kind: int(rin.claude_tokens.value(kind=kind, type="input_tokens")
+                                                + rin.claude_tokens.value(kind=kind, type="cache_read_input_tokens"))
+                                     for kind in rin.CLAUDE_CALL_KINDS},
+            "tokens": {token_type: int(sum(rin.claude_tokens.value(kind=kind, type=token_type) for kind in rin.CLAUDE_CALL_KINDS))
+                       for token_type in ("input_tokens", "output_tokens", "cache_read_input_tokens")},
+        },
+        "selection": {
+            "top_k": rin.CANDIDATE_TOP_K if rin.CANDIDATE_TOP_K < UNLIMITED_TOP_K else None,
+            "calls": selection_calls,
+            "avg_candidates": sum(recorder.selection_candidates) / selection_calls if selection_calls else None,
+            "input_tokens_per_call": selection_input_tokens / selection_calls if selection_calls else None,
+            "p50_seconds": percentile(selection_latencies, 0.50),
+            "p95_seconds": percentile(selection_latencies, 0.95),
+            "ranking_p50_seconds": percentile(ranking_latencies, 0.50),
+            "ranking_p95_seconds": percentile(ranking_latencies, 0.95),
+        },
+        "speculation": rin.speculation_policy.stats(),
+        "retrieval": {result: int(rin.retrievals.value(result=result)) for result in ("added", "empty")},
+        "reply_sources": {source: int(rin.reply_sources.value(source=source))
+                          for source in ("candidate", "selection_cache", "stream", "generation", "local")},
+        "discord": {"sends": recorder.sends, "edits": recorder.edits},
+        "conversation_memory": rin.memory_stats.summary(),
+        "memory": memory,
+        "shard_ids": rin.SHARD_IDS,
+        "journal_rows": journal_rows,
+        "reload": recorder.reload.report() if recorder.reload is not None else None,
+    }
+
+
+def prepare_snapshot(snapshot_path):
+    """
+    시작 비용을 재기 전에 별도 프로세스에서 대사 스냅샷을 최신 상태로 만들어, 이 프로세스에는 pandas가 올라오지 않게 합니다.
+    걸린 시간(초)과 dialogue_snapshot.py의 출력을 반환합니다.
+    """
+    started_at = time.perf_counter()
+    result = subprocess.run([sys.executable, "dialogue_snapshot.py", "--snapshot", snapshot_path],
+                            check=True, capture_output=True, text=True)
+    return time.perf_counter() - started_at, result.stdout.strip().replace("\n", ", ")
+
+
+def startup_benchmark(args):
+    """
+    봇 시작 비용을 잽니다. 스냅샷이 최신인 상태에서 봇 모듈 import(캐릭터 데이터 로드 포함), 캐릭터 데이터 로드만 다시 한 시간,
+    Claude 대역으로 처리한 첫 respond_to_turn 시간을 보고서로 반환합니다.
+    """
+    snapshot_seconds, snapshot_output = prepare_snapshot(os.environ["DIALOGUE_SNAPSHOT_PATH"])
+    preloaded = {name for name in EXCEL_MODULES if name in sys.modules}
+
+    started_at = time.perf_counter()
+    import bot_rin_contextual_memory_full as rin
+    import_seconds = time.perf_counter() - started_at
+    excel_modules = [name for name in EXCEL_MODULES if name in sys.modules and name not in preloaded]
+    logging.getLogger('린_봇').setLevel(args.log_level)
+
+    started_at = time.perf_counter()
+    rin.load_character_data()
+    load_seconds = time.perf_counter() - started_at
+
+    stub = StubMessages(args.latency, 0.0, 0.0, args.none_rate, args.chunk_delay, None, random.Random(args.seed),
+                        args.input_latency)
+    rin.client = SimpleNamespace(messages=stub)
+    recorder = LatencyRecorder()
+    channel = FakeChannel(1, recorder, args.send_latency)
+    rin.bot.get_channel = {channel.id: channel}.get
+    started_at = time.perf_counter()
+    asyncio.run(rin.respond_to_turn(channel.id, [args.startup_message]))
+    first_turn_seconds = time.perf_counter() - started_at
+    rin.line_journal.flush()
+    rin.line_journal.close()
+
+    return {
+        "snapshot_prepare_seconds": snapshot_seconds,
+        "snapshot_prepare_output": snapshot_output,
+        "import_seconds": import_seconds,
+        "load_seconds": load_seconds,
+        "excel_modules_loaded": excel_modules,
+        "first_turn_seconds": first_turn_seconds,
+        "first_turn_api_calls": dict(stub.calls),
+        "first_turn_sends": recorder.sends,
+        "lines": len(rin.dialogue_store),
+    }
+
+
+def print_startup_report(report):
+    print(f"스냅샷 준비(별도 프로세스): {report['snapshot_prepare_seconds']:.3f}초 - {report['snapshot_prepare_output']}")
+    excel = ", ".join(report["excel_modules_loaded"]) or "없음"
+    print(f"봇 모듈 import: {report['import_seconds']:.3f}초 (캐릭터 데이터 로드 포함, 불러온 엑셀 모듈: {excel})")
+    print(f"캐릭터 데이터 로드: {report['load_seconds']:.3f}초 (대사 {report['lines']}개)")
+    print(f"첫 respond_to_turn: {report['first_turn_seconds']:.3f}초 (Claude 대역 호출 {report['first_turn_api_calls']}, "
+          f"전송 {report['first_turn_sends']}회)")
+
+
+def check_gates(report, args):
+    """
+    지정한 성능 기준을 넘은 항목을 설명하는 문자열 목록을 반환합니다.
+    """
+    failures = []
+    latency = report["latency_seconds"]
+    if args.max_p95 is not None and (latency["p95"] is None or latency["p95"] > args.max_p95):
+        failures.append(f"p95 지연 {latency['p95']}초 > 기준 {args.max_p95}초")
+    if args.max_p99 is not None and (latency["p99"] is None or latency["p99"] > args.max_p99):
+        failures.append(f"p99 지연 {latency['p99']}초 > 기준 {args.max_p99}초")
+    if args.min_throughput is not None and report["throughput_messages_per_second"] < args.min_throughput:
+        failures.append(f"처리량 {report['throughput_messages_per_second']:.2f}개/초 < 기준 {args.min_throughput}개/초")
+    if args.max_api_calls_per_message is not None and report["api"]["calls_per_message"] > args.max_api_calls_per_message:
+        failures.append(f"메시지당 API 호출 {report['api']['calls_per_message']:.2f}회 > 기준 {args.max_api_calls_per_message}회")
+    reload = report["reload"]
+    if reload is not None:
+        if reload["inconsistencies"]:
+            failures.append(f"리로드 중 대사 저장소와 색인의 세대가 섞인 경우 {reload['inconsistencies']}회")
+        if reload["lost_lines"]:
+            failures.append(f"리로드 후 사라진 새 대사 {reload['lost_lines']}개")
+        lag = reload["max_loop_lag_seconds"]["reloading"]
+        if args.max_reload_loop_lag is not None and lag > args.max_reload_loop_lag:
+            failures.append(f"리로드 중 이벤트 루프 정지 {lag:.3f}초 > 기준 {args.max_reload_loop_lag}초")
+    growth = report["memory"].get("growth_mb")
+    if args.max_memory_growth_mb is not None and growth is not None and growth > args.max_memory_growth_mb:
+        failures.append(f"메모리 증가 {growth:.2f}MB > 기준 {args.max_memory_growth_mb}MB")
+    return failures
+
+
+def print_report(report):
+    latency = report["latency_seconds"]
+
+    def seconds(value):
+        return "-" if value is None else f"{value:.3f}초"
+
+    if report["shard_ids"]:
+        print(f"샤드 {report['shard_ids']} 재생, 공유 저널의 미반영 대사 {report['journal_rows']}개")
+    print(f"메시지 {report['messages']}개 중 응답 {report['answered']}개 (턴 {report['turns']}개, 버림 {report['shed']}개, "
+          f"무응답 {report['unanswered']}개), {report['elapsed_seconds']:.2f}초")
+    print(f"처리량: {report['throughput_messages_per_second']:.2f}개/초")
+    print(f"지연 시간: 평균 {seconds(latency['mean'])}, p50 {seconds(latency['p50'])}, p95 {seconds(latency['p95'])}, "
+          f"p99 {seconds(latency['p99'])}, 최대 {seconds(latency['max'])}")
+    for stage, values in report["stages"].items():
+        print(f"  - {stage}: p50 ≤{values['p50_le']}초, p95 ≤{values['p95_le']}초")
+    api = report["api"]
+    print(f"API 호출: {api['calls']} (용도별 {api['calls_by_kind']}), 주입한 오류 {api['injected_errors']}회, "
+          f"재시도 {api['retries']}회, 회로 차단 {api['circuit_rejected']}회, 메시지당 {api['calls_per_message']:.2f}회")
+    selection = report["selection"]
+    if selection["calls"]:
+        top_k = "제한 없음" if selection["top_k"] is None else f"상위 {selection['top_k']}개"
+        print(f"후보 평가({top_k}): {selection['calls']}회, 평균 후보 {selection['avg_candidates']:.1f}개, "
+              f"요청당 입력 {selection['input_tokens_per_call']:.0f}토큰, 지연 p50 {seconds(selection['p50_seconds'])} "
+              f"p95 {seconds(selection['p95_seconds'])}, 로컬 순위 p50 {selection['ranking_p50_seconds'] * 1000:.2f}ms "
+              f"p95 {selection['ranking_p95_seconds'] * 1000:.2f}ms")
+    speculation = report["speculation"]
+    if speculation["started"]:
+        hit_rate = "-" if speculation["hit_rate"] is None else f"{speculation['hit_rate']:.1%}"
+        print(f"동시 생성({speculation['mode']}): 시작 {speculation['started']}회, 사용 {speculation['used']}회, "
+              f"취소 {speculation['cancelled']}회, 폐기 {speculation['discarded']}회 (낭비 {speculation['wasted_ratio']:.1%}), "
+              f"후보 평가 적중률 {hit_rate}")
+    print(f"API 토큰: {api['tokens']}")
+    retrieval = report["retrieval"]
+    if retrieval["added"] or retrieval["empty"]:
+        print(f"유사 대사 보충: {retrieval['added']}회, 못 찾음 {retrieval['empty']}회")
+    print(f"응답 경로: {report['reply_sources']}, 전송 {report['discord']['sends']}회, 수정 {report['discord']['edits']}회")
+    conversation_memory = report["conversation_memory"]
+    if conversation_memory["requests"]:
+        print(f"대화 기억: 생성 요청 {conversation_memory['requests']}회, 요청당 평균 {conversation_memory['avg_sent_tokens']:.0f}토큰 전송 "
+              f"(요약 없이 전체 대화 {conversation_memory['avg_full_tokens']:.0f}토큰), 요약 갱신 {conversation_memory['summary_calls']}회 "
+              f"{conversation_memory['summary_tokens']}토큰 포함 요청당 {conversation_memory['saved_tokens_per_request']:.0f}토큰 절약")
+    reload = report["reload"]
+    if reload is not None:
+        durations = "-" if reload["reload_p50_seconds"] is None else (
+            f"p50 {reload['reload_p50_seconds']:.2f}초, 최대 {reload['reload_max_seconds']:.2f}초")
+        lag = reload["max_loop_lag_seconds"]
+        lost = "-" if reload["lost_lines"] is None else f"{reload['lost_lines']}개"
+        print(f"리로드: {reload['reloads']}회 ({durations}), 리로드와 겹친 턴 {reload['turns_overlapped']}개, "
+              f"세대 불일치 {reload['inconsistencies']}회, 사라진 새 대사 {lost}, "
+              f"이벤트 루프 최대 정지 리로드 중 {lag['reloading']:.3f}초 / 평소 {lag['idle']:.3f}초")
+        for example in reload["inconsistency_examples"]:
+            print(f"  - {example}")
+    memory = report["memory"]
+    if "growth_mb" in memory:
+        print(f"메모리: 증가 {memory['growth_mb']:.2f}MB, 최고 {memory['peak_mb']:.2f}MB "
+              f"(메시지당 {memory['growth_kb_per_message']:.2f}KB)")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="가짜 디스코드/Claude로 메시지 처리 경로를 재생하고 성능을 측정합니다.")
+    parser.add_argument("--corpus", help="녹화된 메시지 파일 (텍스트 또는 JSONL). 없으면 합성 메시지 사용")
+    parser.add_argument("--messages", type=int, default=1000, help="합성 메시지 수")
+    parser.add_argument("--distinct", type=int, default=300, help="합성 메시지 종류 수 (작을수록 캐시 적중이 늘어남)")
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=50.0, help="초당 메시지 도착 수 (0이면 한꺼번에 투입)")
+    parser.add_argument("--speed", type=float, default=1.0, help="JSONL의 at 시각을 재생할 배속")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.2, help="Claude 대역의 평균 응답 지연(초)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Claude 대역 지연의 표준편차(초)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Claude 대역이 재시도 가능한 오류를 낼 확률")
+    parser.add_argument("--none-rate", type=float, default=0.1, help="후보 평가에서 '없음'을 답할 확률")
+    parser.add_argument("--input-latency", type=float, default=0.0,
+                        help="Claude 대역의 입력 토큰 1000개당 추가 지연(초). 0이면 프롬프트 크기와 무관하게 같은 지연")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="스트리밍 조각 사이 지연(초)")
+    parser.add_argument("--send-latency", type=float, default=0.03, help="디스코드 전송/수정 지연(초)")
+    parser.add_argument("--stream", action="store_true", help="대사 생성 응답을 스트리밍으로 보냄")
+    parser.add_argument("--stream-edit-interval", type=float, default=1.2)
+    parser.add_argument("--candidate-top-k", type=int, default=12, help="후보 평가에 넣을 최대 후보 수 (0이면 제한 없음)")
+    parser.add_argument("--no-retrieval", action="store_true", help="후보가 부족할 때 유사 대사로 보충하지 않음")
+    parser.add_argument("--retrieval-min-pool", type=int, default=3)
+    parser.add_argument("--speculative", choices=("off", "on", "auto"), default="off",
+                        help="후보 평가와 대사 생성을 동시에 시작 (auto는 평가 적중률이 기준 이하일 때만)")
+    parser.add_argument("--speculative-max-hit-rate", type=float, default=0.5)
+    parser.add_argument("--reload-every", type=float, default=0.0, help="재생 중 캐릭터 데이터를 강제 리로드할 주기(초, 0이면 안 함)")
+    parser.add_argument("--debounce", type=float, default=0.0, help="채널 대기열의 메시지 병합 대기 시간(초)")
+    parser.add_argument("--max-wait", type=float, default=4.0)
+    parser.add_argument("--rpm", type=int, default=1000000, help="Claude 분당 요청 수 제한")
+    parser.add_argument("--tpm", type=int, default=1000000000, help="Claude 분당 토큰 수 제한")
+    parser.add_argument("--snapshot", help="사용할 대사 스냅샷 경로 (기본값은 작업 디렉터리의 스냅샷)")
+    parser.add_argument("--workdir", help="저널과 스냅샷을 둘 디렉터리 (여러 프로세스가 공유할 때 지정, 기본값은 임시 디렉터리)")
+    parser.add_argument("--shard-count", type=int, default=0)
+    parser.add_argument("--shard-ids", type=lambda value: [int(shard_id) for shard_id in value.split(",") if shard_id],
+                        default=[], help="이 프로세스가 재생할 샤드 번호 (쉼표 구분)")
+    parser.add_argument("--no-memory", action="store_true", help="tracemalloc을 끄고 측정 (메모리 보고 생략)")
+    parser.add_argument("--log-level", default="ERROR")
+    parser.add_argument("--json", help="보고서를 JSON으로 저장할 경로")
+    parser.add_argument("--max-p95", type=float, help="p95 지연 기준(초)")
+    parser.add_argument("--max-p99", type=float, help="p99 지연 기준(초)")
+    parser.add_argument("--min-throughput", type=float, help="최소 처리량(개/초)")
+    parser.add_argument("--max-api-calls-per-message", type=float)
+    parser.add_argument("--max-memory-growth-mb", type=float)
+    parser.add_argument("--max-reload-loop-lag", type=float, help="리로드 중 이벤트 루프 최대 정지 기준(초)")
+    parser.add_argument("--startup", action="store_true", help="재생 대신 봇 시작 비용(import, 로드, 첫 응답)만 측정")
+    parser.add_argument("--startup-message", default="안녕, 오늘 뭐 했어?", help="--startup에서 첫 턴으로 보낼 메시지")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    for name in ("corpus", "snapshot", "json", "workdir"):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    if args.json and args.shard_ids:
+        base, ext = os.path.splitext(args.json)
+        args.json = f"{base}.shard{'-'.join(map(str, args.shard_ids))}{ext}"
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))  # 엑셀과 분류표는 저장소 기준 상대 경로
+
+    workdir_context = contextlib.nullcontext(args.workdir) if args.workdir else tempfile.TemporaryDirectory(prefix="rin_replay_")
+    with workdir_context as workdir:
+        configure_environment(args, workdir)
+        if args.startup:
+            return run_startup(args)
+        import bot_rin_contextual_memory_full as rin
+        import anthropic
+        import httpx
+
+        logging.getLogger('린_봇').setLevel(args.log_level)
+        random.seed(args.seed)
+        rng = random.Random(args.seed)
+        corpus = load_corpus(args.corpus, args.channels) if args.corpus else synthetic_corpus(args.messages, args.channels, args.distinct, rng)
+        if args.shard_count and args.shard_ids:
+            corpus = [entry for entry in corpus if shard_for(entry, args.shard_count) in args.shard_ids]
+
+        def make_error():
+            return anthropic.APITimeoutError(request=httpx.Request("POST", "https://api.anthropic.com/v1/messages"))
+
+        stub = StubMessages(args.latency, args.jitter, args.error_rate, args.none_rate, args.chunk_delay, make_error,
+                            random.Random(args.seed), args.input_latency)
+        rin.client = SimpleNamespace(messages=stub)
+
+        memory = {}
+        if not args.no_memory:
+            gc.collect()
+            tracemalloc.start()
+            baseline = tracemalloc.get_traced_memory()[0]
+        try:
+            recorder, elapsed = asyncio.run(replay(rin, corpus, args, stub))
+        finally:
+            if not args.no_memory:
+                gc.collect()
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                memory = {
+                    "growth_mb": (current - baseline) / 2**20,
+                    "peak_mb": (peak - baseline) / 2**20,
+                    "growth_kb_per_message": (current - baseline) / 1024 / max(1, len(corpus)),
+                }
+            rin.line_journal.flush()
+            journal_rows = len(rin.line_journal.rows())
+            rin.line_journal.close()
+
+    report = build_report(rin, recorder, elapsed, stub, memory, len(corpus), journal_rows)
+    print_report(report)
+    failures = check_gates(report, args)
+    report["gate_failures"] = failures
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    for failure in failures:
+        print(f"기준 미달: {failure}")
+    return 1 if failures else 0
+
+
+def run_startup(args):
+    report = startup_benchmark(args)
+    print_startup_report(report)
+    failures = []
+    if report["excel_modules_loaded"]:
+        failures.append(f"스냅샷이 최신인데 봇 시작 시 엑셀 모듈을 불러옴: {', '.join(report['excel_modules_loaded'])}")
+    report["gate_failures"] = failures
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    for failure in failures:
+        print(f"기준 미달: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,78 @@
+import logging
+import re
+import time
+
+logger = logging.getLogger('린_봇')
+
+# 문장 끝: 마침표/느낌표/물음표/물결/말줄임표/줄바꿈과 그 뒤의 닫는 따옴표·괄호·공백
+SENTENCE_END = re.compile(r'[.!?~…\n]+["\'”’)\]]*\s*')
+
+
+class StreamingReply:
+    """
+    스트리밍으로 도착하는 응답을 문장 단위로 후처리해 디스코드에 보여줍니다.
+    첫 문장이 완성되면 바로 메시지를 보내고, 이후 문장은 min_edit_interval 간격으로 모아서 메시지를 수정합니다.
+
+    process_sentence(sentence)는 완성된 문장마다 한 번만 적용되고(무작위 치환이 다시 바뀌지 않도록),
+    clean(text, final)은 화면에 보일 텍스트를 정리합니다. final=False일 때는 앞부분만 정리해야 합니다.
+    """
+
+    def __init__(self, channel, process_sentence, clean, min_edit_interval=1.2, clock=time.monotonic):
+        self.channel = channel
+        self.process_sentence = process_sentence
+        self.clean = clean
+        self.min_edit_interval = min_edit_interval
+        self.clock = clock
+        self.started_at = clock()
+        self.first_visible_latency = None
+        self.completed = False  # 응답을 끝까지 받았고 내용이 있으면 True (대사로 저장해도 되는지)
+        self.message = None
+        self.raw_text = ""
+        self.processed_text = ""
+        self._consumed = 0
+        self._shown = ""
+        self._last_edit_at = None
+
+    def _take_sentences(self):
+        while True:
+            match = SENTENCE_END.search(self.raw_text, self._consumed)
+            # 문장 부호가 버퍼 끝에 걸쳐 있으면 뒤에 부호가 더 올 수 있으므로 다음 조각을 기다림
+            if match is None or match.end() == len(self.raw_text):
+                return
+            self.processed_text += self.process_sentence(self.raw_text[self._consumed:match.end()])
+            self._consumed = match.end()
+
+    async def _show(self, final=False):
+        visible = self.clean(self.processed_text.strip(), final)
+        if not visible or visible == self._shown:
+            return
+        now = self.clock()
+        if self.message is None:
+            self.message = await self.channel.send(visible)
+            self.first_visible_latency = now - self.started_at
+        elif final or now - self._last_edit_at >= self.min_edit_interval:
+            await self.message.edit(content=visible)
+        else:
+            return
+        self._shown = visible
+        self._last_edit_at = now
+
+    async def feed(self, delta):
+        """
+        새로 도착한 텍스트 조각을 반영합니다.
+        """
+        self.raw_text += delta
+        self._take_sentences()
+        await self._show()
+
+    async def finish(self, completed=True):
+        """
+        남은 텍스트를 마지막 문장으로 처리하고 최종 내용을 보여줍니다.
+        스트림이 중간에 끊겼으면 completed=False로 호출해, 받은 데까지만 보여주고 완성된 응답으로 치지 않습니다.
+        """
+        self.completed = completed and bool(self.raw_text.strip())
+        tail = self.raw_text[self._consumed:]
+        if tail:
+            self.processed_text += self.process_sentence(tail)
+            self._consumed = len(self.raw_text)
+        await self._show(final=True)
@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import time
+from collections import Counter, OrderedDict, deque
+
+from conversation_memory import estimate_tokens, message_tokens
+
+logger = logging.getLogger('린_봇')
+
+
+class RecentResponses:
+    """
+    최근 응답을 창 크기만큼 보관하면서, 각 응답에 들어 있는 prefix_len 길이의 부분 문자열을 세어 둡니다.
+    후보 대사의 앞부분이 최근 응답 어딘가에 들어 있는지를 응답 수와 관계없이 해시 조회 한 번으로 확인합니다.
+    """
+
+    def __init__(self, window=10, responses=(), prefix_len=10):
+        self.window = window
+        self.prefix_len = prefix_len
+        self._responses = deque()
+        self._substrings = Counter()
+        for response in responses:
+            self.append(response)
+
+    def __iter__(self):
+        return iter(self._responses)
+
+    def __len__(self):
+        return len(self._responses)
+
+    def _substrings_of(self, response):
+        n = self.prefix_len
+        return {response[i:i + n] for i in range(len(response) - n + 1)}
+
+    def append(self, response):
+        self._responses.append(response)
+        self._substrings.update(self._substrings_of(response))
+        while len(self._responses) > self.window:
+            oldest = self._responses.popleft()
+            for substring in self._substrings_of(oldest):
+                self._substrings[substring] -= 1
+                if not self._substrings[substring]:
+                    del self._substrings[substring]
+
+    def contains_prefix(self, reply):
+        """
+        reply의 앞 prefix_len 글자가 최근 응답 중 하나에 들어 있으면 True를 반환합니다.
+        """
+        prefix = reply[:self.prefix_len]
+        if len(prefix) == self.prefix_len:
+            return prefix in self._substrings
+        # prefix_len보다 짧은 대사는 드물기 때문에 직접 비교
+        return any(prefix in r for r in self._responses)
+
+
+class ConversationSession:
+    """
+    채널(또는 DM) 하나의 대화 이력과 최근 응답 목록입니다.
+    이력이 recent_messages + fold_batch개에 닿으면 오래된 fold_batch개를 요약 대기열(pending_summary)로 옮기고,
+    요약이 갱신되면 summary에 합쳐집니다. 요약이 밀려 대기열이 max_pending개를 넘으면 가장 오래된 대화부터 버립니다.
+    """
+
+    COUNT_WINDOW = 16  # 대화 누적 횟수는 최근 16개 메시지까지만 셈
+
+    def __init__(self, recent_messages=8, fold_batch=4, max_pending=32, response_window=10, history=(),
+                 recent_responses=(), last_active=0.0, total_messages=None, summary="", pending_summary=(),
+                 summarized_tokens=0):
+        self.recent_messages = recent_messages
+        self.fold_batch = fold_batch
+        self.max_pending = max_pending
+        self.history = deque(history)
+        # 세션 시작 이후 쌓인 전체 메시지 수
+        self.total_messages = len(self.history) if total_messages is None else total_messages
+        self.summary = summary
+        self.pending_summary = list(pending_summary)
+        self.summarized_tokens = summarized_tokens  # 요약에 반영된 원래 대화의 토큰 수
+        self.recent_responses = RecentResponses(response_window, recent_responses)
+        self.last_active = last_active
+        self._fold()
+
+    @property
+    def conversation_count(self):
+        # 유저와 린 간의 대화 횟수
+        return min(self.total_messages, self.COUNT_WINDOW) // 2
+
+    def _fold(self):
+        # 한 번에 fold_batch개씩 옮겨, 그 사이에는 이력 앞부분이 바뀌지 않아 프롬프트 캐시를 재사용할 수 있음
+        while len(self.history) >= self.recent_messages + self.fold_batch:
+            for _ in range(self.fold_batch):
+                self.pending_summary.append(self.history.popleft())
+        self._trim_pending()
+
+    def _trim_pending(self):
+        overflow = len(self.pending_summary) - self.max_pending
+        if overflow > 0:
+            del self.pending_summary[:overflow]
+            logger.warning(f"요약이 밀려 오래된 대화 {overflow}개를 요약하지 않고 버립니다")
+
+    def add_turn(self, user_input, reply):
+        self.history.append({"role": "user", "content": user_input, "tokens": estimate_tokens(user_input)})
+        self.history.append({"role": "assistant", "content": reply, "tokens": estimate_tokens(reply)})
+        self.total_messages += 2
+        self._fold()
+
+    def memory_window(self, budget):
+        """
+        요청에 그대로 넣을 최근 이력을 반환합니다. 요약과 합쳐 budget 토큰을 넘으면 오래된 대화부터 요약 대기열로 옮깁니다.
+        """
+        total = self.summary_tokens + sum(message_tokens(message) for message in self.history)
+        while total > budget and len(self.history) > 2:
+            for _ in range(2):
+                message = self.history.popleft()
+                total -= message_tokens(message)
+                self.pending_summary.append(message)
+        self._trim_pending()
+        return list(self.history)
+
+    @property
+    def summary_tokens(self):
+        return estimate_tokens(self.summary) if self.summary else 0
+
+    def memory_usage(self, window):
+        """
+        (실제로 보내는 기억 토큰, 요약 없이 지금까지의 대화를 모두 보냈을 때의 토큰)을 반환합니다.
+        """
+        window_tokens = sum(message_tokens(message) for message in window)
+        pending_tokens = sum(message_tokens(message) for message in self.pending_summary)
+        return self.summary_tokens + window_tokens, self.summarized_tokens + pending_tokens + window_tokens
+
+    def apply_summary(self, summary, folded):
+        """
+        folded 메시지들을 반영해 새로 만든 요약으로 교체하고, 그 메시지들을 요약 대기열에서 뺍니다.
+        요약하는 동안 대기열에 추가되거나 버려진 메시지가 있어도 folded에 든 것만 뺍니다.
+        """
+        folded_ids = {id(message) for message in folded}
+        remaining = [message for message in self.pending_summary if id(message) not in folded_ids]
+        self.summarized_tokens += sum(message_tokens(message) for message in folded)
+        self.pending_summary = remaining
+        self.summary = summary
+
+    def is_redundant_response(self, reply):
+        return self.recent_responses.contains_prefix(reply)
+
+    def update_response_cache(self, reply):
+        self.recent_responses.append(reply)
+
+    def to_dict(self):
+        return {
+            "history": list(self.history),
+            "recent_responses": list(self.recent_responses),
+            "last_active": self.last_active,
+            "total_messages": self.total_messages,
+            "summary": self.summary,
+            "pending_summary": self.pending_summary,
+            "summarized_tokens": self.summarized_tokens,
+        }
+
+
+class SessionStore:
+    """
+    대화 세션을 채널 ID별로 보관하는 저장소입니다.
+    세션 수에 상한을 두고 가장 오래 쉬고 있는 세션부터 내보내며, 일정 시간 활동이 없는 세션도 정리합니다.
+    """
+
+    def __init__(self, max_sessions=5000, idle_ttl=86400, recent_messages=8, fold_batch=4, max_pending=32,
+                 response_window=10, clock=time.time):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.recent_messages = recent_messages
+        self.fold_batch = fold_batch
+        self.max_pending = max_pending
+        self.response_window = response_window
+        self.clock = clock
+        self._sessions = OrderedDict()  # 최근 활동 순서 유지
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, key):
+        return key in self._sessions
+
+    def history_size(self):
+        """
+        모든 세션의 대화 이력에 들어 있는 메시지 수를 반환합니다.
+        """
+        return sum(len(session.history) for session in self._sessions.values())
+
+    def _new_session(self, data=None):
+        data = data or {}
+        return ConversationSession(
+            recent_messages=self.recent_messages,
+            fold_batch=self.fold_batch,
+            max_pending=self.max_pending,
+            response_window=self.response_window,
+            history=data.get("history", ()),
+            recent_responses=data.get("recent_responses", ()),
+            last_active=data.get("last_active", self.clock()),
+            total_messages=data.get("total_messages"),
+            summary=data.get("summary", ""),
+            pending_summary=data.get("pending_summary", ()),
+            summarized_tokens=data.get("summarized_tokens", 0),
+        )
+
+    def get(self, key):
+        """
+        세션을 가져오고 최근 활동 시각을 갱신합니다. 없으면 새로 만듭니다.
+        """
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._new_session()
+            self._sessions[key] = session
+            while len(self._sessions) > self.max_sessions:
+                evicted_key, _ = self._sessions.popitem(last=False)
+                logger.info(f"세션 수 상한 초과로 세션 정리 (채널: {evicted_key})")
+        else:
+            self._sessions.move_to_end(key)
+        session.last_active = self.clock()
+        return session
+
+    def evict_idle(self):
+        """
+        idle_ttl 동안 활동이 없는 세션을 정리하고, 정리한 개수를 반환합니다.
+        """
+        cutoff = self.clock() - self.idle_ttl
+        evicted = 0
+        while self._sessions:
+            key, session = next(iter(self._sessions.items()))
+            if session.last_active > cutoff:
+                break
+            del self._sessions[key]
+            evicted += 1
+        return evicted
+
+    def to_snapshot(self):
+        return [[key, session.to_dict()] for key, session in self._sessions.items()]
+
+    @staticmethod
+    def write_snapshot(snapshot, path):
+        """
+        to_snapshot()의 결과를 파일에 기록합니다. 임시 파일에 쓴 뒤 교체하므로 중간에 끊겨도 이전 스냅샷이 남습니다.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def restore(self, path):
+        """
+        스냅샷 파일에서 세션을 복원하고, 복원한 세션 수를 반환합니다. 이미 만료된 세션은 건너뜁니다.
+        """
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        cutoff = self.clock() - self.idle_ttl
+        restored = 0
+        for key, data in sorted(snapshot, key=lambda item: item[1].get("last_active", 0)):
+            if data.get("last_active", 0) <= cutoff:
+                continue
+            self._sessions[key] = self._new_session(data)
+            restored += 1
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+        return restored
@@ -0,0 +1,115 @@
+"""
+봇을 여러 프로세스로 나눠 실행합니다. 프로세스마다 디스코드 샤드 일부를 맡아 AutoShardedBot으로 접속하고,
+대사 스냅샷은 시작 전에 한 번만 만들어 모든 프로세스가 읽기 전용으로 공유합니다.
+새 대사는 모든 프로세스가 같은 SQLite 저널(WAL)에 기록하고, 엑셀 반영과 스냅샷 갱신은 첫 번째 프로세스만 담당합니다.
+
+    python shard_launcher.py --processes 2 --shards 4
+    python shard_launcher.py --processes 2 --shards 4 --replay -- --messages 2000 --channels 50
+
+--replay를 주면 봇 대신 replay_harness.py를 샤드별로 실행해, 가짜 게이트웨이와 가짜 Claude 클라이언트로 같은 구성을 확인합니다.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from dialogue_snapshot import DEFAULT_SNAPSHOT_PATH, build_snapshot, load_snapshot
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def assign_shards(shard_count, processes):
+    """
+    샤드 번호를 프로세스에 골고루 나눕니다.
+    """
+    return [[shard_id for shard_id in range(shard_count) if shard_id % processes == index] for index in range(processes)]
+
+
+def prepare_snapshot(snapshot_path):
+    """
+    자식 프로세스들이 엑셀을 각자 파싱하지 않도록 스냅샷을 미리 최신 상태로 만듭니다.
+    """
+    started_at = time.perf_counter()
+    if load_snapshot(snapshot_path) is None:
+        build_snapshot(snapshot_path)
+        print(f"대사 스냅샷 생성: {time.perf_counter() - started_at:.3f}초")
+
+
+def worker_command(args, shard_ids, workdir, extra_args):
+    if args.replay:
+        return [sys.executable, os.path.join(REPO_DIR, "replay_harness.py"), "--shard-count", str(args.shards),
+                "--shard-ids", ",".join(map(str, shard_ids)), "--workdir", workdir, *extra_args]
+    return [sys.executable, os.path.join(REPO_DIR, "bot_rin_contextual_memory_full.py")]
+
+
+def worker_environment(args, index, shard_ids, snapshot_path):
+    env = dict(os.environ)
+    env.update({
+        "SHARD_COUNT": str(args.shards),
+        "SHARD_IDS": ",".join(map(str, shard_ids)),
+        "LINE_STORE_WRITER": "1" if index == 0 else "0",
+        "DIALOGUE_SNAPSHOT_PATH": snapshot_path,
+    })
+    metrics_port = int(env.get("METRICS_PORT", "9108"))
+    if metrics_port:
+        env["METRICS_PORT"] = str(metrics_port + index)  # 프로세스마다 다른 포트
+    return env
+
+
+def supervise(workers):
+    """
+    자식 프로세스가 모두 끝날 때까지 기다립니다. 하나가 오류로 끝나거나 종료 신호를 받으면 나머지도 종료합니다.
+    가장 큰 종료 코드를 반환합니다.
+    """
+    def terminate_all(*_):
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+
+    signal.signal(signal.SIGTERM, terminate_all)
+    signal.signal(signal.SIGINT, terminate_all)
+
+    while any(worker.poll() is None for worker in workers):
+        if any(worker.poll() not in (None, 0) for worker in workers):
+            terminate_all()
+        time.sleep(0.5)
+    return max(worker.returncode for worker in workers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="봇을 샤드별 여러 프로세스로 실행합니다.")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--shards", type=int, help="전체 샤드 수 (기본값은 프로세스 수)")
+    parser.add_argument("--replay", action="store_true", help="봇 대신 replay_harness.py를 샤드별로 실행")
+    args, extra_args = parser.parse_known_args(argv)
+    extra_args = [value for value in extra_args if value != "--"]
+    args.shards = args.shards or args.processes
+    if args.processes > args.shards:
+        parser.error("프로세스 수는 샤드 수보다 많을 수 없습니다.")
+    # 재생 도구는 넘겨받은 상대 경로를 해석하도록 현재 디렉터리에서, 봇은 엑셀이 있는 저장소 디렉터리에서 실행
+    invocation_dir = os.getcwd()
+    os.chdir(REPO_DIR)
+
+    with tempfile.TemporaryDirectory(prefix="rin_shards_") as replay_dir:
+        # 재생 모드에서는 저널과 스냅샷을 임시 디렉터리에서 공유
+        workdir = replay_dir if args.replay else os.getcwd()
+        snapshot_path = (os.path.join(replay_dir, "dialogue_snapshot.pkl") if args.replay
+                         else os.path.abspath(os.getenv("DIALOGUE_SNAPSHOT_PATH", DEFAULT_SNAPSHOT_PATH)))
+        prepare_snapshot(snapshot_path)
+
+        workers = []
+        for index, shard_ids in enumerate(assign_shards(args.shards, args.processes)):
+            print(f"프로세스 {index}: 샤드 {shard_ids}{' (엑셀 기록 담당)' if index == 0 else ''}")
+            workers.append(subprocess.Popen(
+                worker_command(args, shard_ids, workdir, extra_args),
+                env=worker_environment(args, index, shard_ids, snapshot_path),
+                cwd=invocation_dir if args.replay else REPO_DIR,
+            ))
+        return supervise(workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
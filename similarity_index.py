@@ -0,0 +1,295 @@
+"""
+대사 문장의 문자 n-gram을 해시해 만든 벡터를 NumPy 행렬로 보관하고, 유저 발화와 비슷한 대사를 내적으로 찾는 색인입니다.
+행은 n-gram 출현 벡터를 길이 1로 정규화한 값이고, IDF 가중치는 질의 쪽에만 곱하므로 대사를 추가해도 기존 행을 다시 계산하지 않습니다.
+해시 충돌로 순위가 흔들리므로 내적으로 top_k의 몇 배를 먼저 고른 뒤, 그 후보만 실제 n-gram으로 다시 점수를 매깁니다.
+행 위치는 DialogueStore의 행 위치와 같습니다.
+후보 순위 계산(candidate_ranker.rank_positions)에 쓰도록 대사마다 문자 2-gram을 정수 ID로 바꿔 한 번만 저장해 둡니다.
+
+    python similarity_index.py --lines 100000 --queries 200
+"""
+import argparse
+import math
+import random
+import time
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from candidate_ranker import char_ngrams
+
+NGRAM_SIZES = (2, 3)
+DEFAULT_DIMS = 256
+DEFAULT_OVERSAMPLE = 8  # 실제 n-gram으로 다시 점수를 매길 후보 수 (top_k의 배수)
+_SUBSET_RATIO = 0.25  # 후보 행이 이 비율보다 적으면 그 행만 골라서 곱하고, 많으면 전체 행렬과 곱한 뒤 골라냄
+
+
+def line_ngrams(text):
+    grams = set()
+    for n in NGRAM_SIZES:
+        grams |= char_ngrams(text, n)
+    return grams
+
+
+def _segments(starts, counts):
+    """
+    (시작 위치, 길이) 구간들을 이어 붙인 원소 위치 배열과, 그 배열 안에서 각 구간이 시작하는 위치를 반환합니다.
+    """
+    segment_starts = np.cumsum(counts) - counts
+    flat = np.repeat(starts - segment_starts, counts) + np.arange(int(counts.sum()))
+    return flat, segment_starts
+
+
+def _segment_sums(values, segment_starts, counts):
+    # 길이가 0인 구간의 합은 0
+    totals = np.concatenate(([0], np.cumsum(values, dtype=np.int64)))
+    return totals[segment_starts + counts] - totals[segment_starts]
+
+
+class SimilarityIndex:
+    """
+    해시한 문자 n-gram 벡터로 대사 간 코사인 유사도를 근사하는 색인입니다. 해시는 프로세스마다 달라지므로 파일로 저장하지 않고 매번 만듭니다.
+    """
+
+    def __init__(self, dims=DEFAULT_DIMS, capacity=1024):
+        self.dims = dims
+        self.size = 0
+        self._lines = []  # 다시 점수를 매길 때 쓰는 대사 문장 (저장소와 같은 문자열 객체를 참조)
+        self._matrix = np.zeros((capacity, dims), dtype=np.float32)
+        self._doc_freq = Counter()  # n-gram -> 그 n-gram이 들어 있는 대사 수
+        # 대사별 문자 2-gram ID: _bigram_ids[_bigram_starts[p]:_bigram_starts[p] + _bigram_counts[p]]
+        self._bigram_vocab = {}
+        self._bigram_ids = array("I")
+        self._bigram_starts = array("I")
+        self._bigram_counts = array("I")
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def from_store(cls, store, dims=DEFAULT_DIMS):
+        index = cls(dims, capacity=max(1024, len(store)))
+        index.add_many(0, store.lines)
+        return index
+
+    @property
+    def nbytes(self):
+        bigrams = (len(self._bigram_ids) + len(self._bigram_starts) + len(self._bigram_counts)) * self._bigram_ids.itemsize
+        return self._matrix.nbytes + bigrams
+
+    def _hashed_vector(self, weights):
+        """
+        n-gram마다 해시 버킷에 가중치를 더한 벡터를 반환합니다. 부호도 해시로 정해 충돌한 n-gram끼리 내적이 부풀지 않게 합니다.
+        """
+        vector = np.zeros(self.dims, dtype=np.float32)
+        for gram, weight in weights.items():
+            h = hash(gram)
+            vector[h % self.dims] += weight if (h >> 32) & 1 else -weight
+        return vector
+
+    def idf(self, gram):
+        return math.log((1.0 + self.size) / (1.0 + self._doc_freq.get(gram, 0))) + 1.0
+
+    def query_weights(self, text):
+        return {gram: self.idf(gram) for gram in line_ngrams(text)}
+
+    def _reserve(self, size):
+        if size <= len(self._matrix):
+            return
+        capacity = len(self._matrix)
+        while capacity < size:
+            capacity *= 2
+        grown = np.zeros((capacity, self.dims), dtype=np.float32)
+        grown[:self.size] = self._matrix[:self.size]
+        self._matrix = grown
+
+    def add(self, position, line):
+        """
+        position 위치의 대사 하나를 색인에 반영합니다.
+        """
+        self.add_many(position, [line])
+
+    def add_many(self, start, lines):
+        """
+        start 위치부터 이어지는 대사들을 색인에 반영합니다. 건너뛴 위치가 있으면 빈 행(어떤 질의와도 유사도 0)으로 둡니다.
+        """
+        if not lines:
+            return
+        end = start + len(lines)
+        self._reserve(end)
+        if len(self._lines) < end:
+            self._lines.extend([""] * (end - len(self._lines)))
+        self._lines[start:end] = lines
+        if len(self._bigram_starts) < end:
+            missing = end - len(self._bigram_starts)
+            self._bigram_starts.extend([0] * missing)
+            self._bigram_counts.extend([0] * missing)
+        rows = self._matrix[start:end]
+        for i, line in enumerate(lines):
+            bigrams = char_ngrams(line, 2)
+            grams = bigrams | char_ngrams(line, 3)
+            self._doc_freq.update(grams)
+            self._bigram_starts[start + i] = len(self._bigram_ids)
+            self._bigram_counts[start + i] = len(bigrams)
+            self._bigram_ids.extend(self._bigram_vocab.setdefault(gram, len(self._bigram_vocab)) for gram in bigrams)
+            rows[i] = self._hashed_vector(dict.fromkeys(grams, 1.0))
+        norms = np.linalg.norm(rows, axis=1, keepdims=True)
+        np.divide(rows, norms, out=rows, where=norms > 0)
+        self.size = max(self.size, end)
+
+    def query_vectors(self, weights):
+        """
+        질의별 n-gram IDF 가중치를 길이 1로 정규화한 행렬(질의 수 x dims)로 바꿉니다.
+        """
+        queries = np.stack([self._hashed_vector(query_weights) for query_weights in weights])
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        np.divide(queries, norms, out=queries, where=norms > 0)
+        return queries
+
+    def _scores(self, queries, positions):
+        if positions is None:
+            return queries @ self._matrix[:self.size].T
+        positions = np.asarray(positions, dtype=np.intp)
+        if len(positions) < self.size * _SUBSET_RATIO:
+            return queries @ self._matrix[positions].T
+        return (queries @ self._matrix[:self.size].T)[:, positions]
+
+    def bigram_overlaps(self, positions, *gram_sets):
+        """
+        positions의 대사마다 문자 2-gram 수와, gram_sets 각각과 겹치는 2-gram 수를 NumPy 배열로 반환합니다.
+        """
+        positions = np.asarray(positions, dtype=np.intp)
+        starts = np.frombuffer(self._bigram_starts, dtype=np.uint32)[positions].astype(np.intp)
+        counts = np.frombuffer(self._bigram_counts, dtype=np.uint32)[positions].astype(np.intp)
+        flat, segment_starts = _segments(starts, counts)
+        ids = np.frombuffer(self._bigram_ids, dtype=np.uint32)[flat]
+        shared = []
+        for grams in gram_sets:
+            marks = np.zeros(len(self._bigram_vocab), dtype=np.int8)
+            marks[[self._bigram_vocab[gram] for gram in grams if gram in self._bigram_vocab]] = 1
+            shared.append(_segment_sums(marks[ids], segment_starts, counts))
+        return (counts, *shared)
+
+    def _rescore(self, query_weights, position):
+        """
+        질의와 대사가 실제로 함께 가진 n-gram의 IDF 합을 대사 벡터 길이로 나눈 값입니다. 질의 벡터 길이로는 호출한 쪽에서 나눕니다.
+        """
+        grams = line_ngrams(self._lines[position])
+        shared = sum(weight for gram, weight in query_weights.items() if gram in grams)
+        return shared / math.sqrt(len(grams)) if grams else 0.0
+
+    def search_batch(self, texts, positions=None, top_k=10, min_score=None, oversample=DEFAULT_OVERSAMPLE):
+        """
+        질의마다 positions 안에서 유사도가 높은 순으로 (행 위치, 유사도) 목록을 최대 top_k개 반환합니다.
+        positions가 None이면 전체 행에서 찾고, min_score보다 낮은 결과는 뺍니다.
+        """
+        if (positions is not None and len(positions) == 0) or not self.size or not texts:
+            return [[] for _ in texts]
+        candidates = np.arange(self.size) if positions is None else np.asarray(positions, dtype=np.intp)
+        weights = [self.query_weights(text) for text in texts]
+        scores = self._scores(self.query_vectors(weights), positions)
+        k = min(top_k * max(1, oversample), scores.shape[1])
+        shortlists = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for query_weights, shortlist in zip(weights, shortlists):
+            query_norm = math.sqrt(sum(weight * weight for weight in query_weights.values())) or 1.0
+            scored = [(self._rescore(query_weights, int(candidates[i])) / query_norm, int(candidates[i])) for i in shortlist]
+            scored.sort(key=lambda item: item[0], reverse=True)
+            results.append([(position, score) for score, position in scored[:top_k]
+                            if min_score is None or score >= min_score])
+        return results
+
+    def search(self, text, positions=None, top_k=10, min_score=None):
+        return self.search_batch([text], positions, top_k, min_score)[0]
+
+
+def exact_search(postings, line_grams, idf, query, positions, top_k):
+    """
+    해시 없이 실제 n-gram으로 같은 점수(질의 쪽 IDF 가중 코사인)를 계산해 상위 top_k개의 행 위치를 반환합니다. 재현율 측정용입니다.
+    """
+    weights = {gram: idf.get(gram, 0.0) for gram in line_ngrams(query)}
+    allowed = set(positions)
+    scores = {}
+    for gram, weight in weights.items():
+        for position in postings.get(gram, ()):
+            if position in allowed:
+                scores[position] = scores.get(position, 0.0) + weight
+    ranked = sorted(scores, key=lambda position: scores[position] / math.sqrt(len(line_grams[position])), reverse=True)
+    return ranked[:top_k]
+
+
+def _synthetic_lines(count, rng):
+    # 실제 대사 시트의 어절을 다시 섞어 한국어 n-gram 분포를 흉내 냄
+    try:
+        from dialogue_snapshot import parse_sources
+
+        words = " ".join(str(line) for line in parse_sources()["lines"]["대사"] if line == line).split()
+    except Exception:
+        words = "흥 그런 말 한다고 내가 좋아할 줄 알았어 뭐 네가 그렇게까지 말한다면 들어줄게 바보 먼저 물어보지 않아도 알잖아".split()
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(4, 10))) for _ in range(count)]
+
+
+def _perturb(line, rng):
+    # 일부 어절을 빼고 순서를 약간 바꾼 유저 발화 흉내
+    words = line.split()
+    kept = [word for word in words if rng.random() > 0.3] or words[:1]
+    if len(kept) > 2:
+        i = rng.randrange(len(kept) - 1)
+        kept[i], kept[i + 1] = kept[i + 1], kept[i]
+    return " ".join(kept)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="해시 n-gram 유사도 색인의 재현율과 질의 지연 시간을 측정합니다.")
+    parser.add_argument("--lines", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dims", type=int, nargs="+", default=[128, 256, 512])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--subset", type=float, default=0.4, help="감정/흐름 조건에 맞는 것으로 칠 행의 비율")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    lines = _synthetic_lines(args.lines, rng)
+    queries = [_perturb(rng.choice(lines), rng) for _ in range(args.queries)]
+    subset = sorted(rng.sample(range(args.lines), int(args.lines * args.subset)))
+
+    line_grams = [line_ngrams(line) or {""} for line in lines]
+    postings = {}
+    for position, grams in enumerate(line_grams):
+        for gram in grams:
+            postings.setdefault(gram, []).append(position)
+    idf = {gram: math.log((1.0 + args.lines) / (1.0 + len(rows))) + 1.0 for gram, rows in postings.items()}
+    truth = [exact_search(postings, line_grams, idf, query, subset, args.top_k) for query in queries]
+
+    for dims in args.dims:
+        started_at = time.perf_counter()
+        index = SimilarityIndex(dims)
+        index.add_many(0, lines)
+        build_seconds = time.perf_counter() - started_at
+
+        latencies = []
+        found = []
+        for query in queries:
+            started_at = time.perf_counter()
+            found.append([position for position, _ in index.search(query, subset, args.top_k)])
+            latencies.append(time.perf_counter() - started_at)
+        latencies.sort()
+        recall = sum(len(set(a) & set(b)) for a, b in zip(found, truth)) / sum(len(b) for b in truth)
+
+        started_at = time.perf_counter()
+        index.search_batch(queries, subset, args.top_k)
+        batch_seconds = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        for line in lines[:1000]:
+            index.add(len(index), line)
+        add_cost = (time.perf_counter() - started_at) / 1000
+
+        print(f"dims {dims}: 행렬 {index.nbytes / 2**20:.1f}MB, n-gram {len(index._doc_freq)}종, 구축 {build_seconds:.2f}초, 대사 추가 {add_cost * 1e6:.1f}µs, "
+              f"recall@{args.top_k} {recall:.3f}, 질의 p50 {latencies[len(latencies) // 2] * 1000:.2f}ms "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f}ms, "
+              f"일괄 질의 {batch_seconds / len(queries) * 1000:.2f}ms/개")
+
+
+if __name__ == "__main__":
+    main()
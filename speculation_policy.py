@@ -0,0 +1,66 @@
+from collections import deque
+
+
+class SpeculationPolicy:
+    """
+    후보 평가 요청을 보낼 때 대사 생성 요청도 함께 시작할지 정합니다.
+    mode가 "on"이면 항상, "off"이면 시작하지 않고, "auto"이면 최근 window번의 후보 평가 중 적절한 대사를 고른 비율(적중률)이
+    max_hit_rate 이하일 때만 시작합니다. 적중률이 낮을수록 생성 요청이 어차피 필요할 가능성이 커서 취소되는 요청이 적습니다.
+    """
+
+    MODES = ("off", "on", "auto")
+
+    def __init__(self, mode="off", max_hit_rate=0.5, window=200, min_samples=20):
+        if mode not in self.MODES:
+            raise ValueError(f"알 수 없는 동시 생성 모드입니다: {mode}")
+        self.mode = mode
+        self.max_hit_rate = max_hit_rate
+        self.min_samples = min_samples
+        self.outcomes = deque(maxlen=window)  # 최근 후보 평가 결과 (적절한 대사를 골랐으면 True)
+        self.started = 0
+        self.used = 0
+        self.cancelled = 0
+        self.discarded = 0  # 후보 평가보다 먼저 끝나 비용은 다 들었지만 쓰지 않은 생성 요청
+
+    def record_selection(self, hit):
+        self.outcomes.append(bool(hit))
+
+    def hit_rate(self):
+        if not self.outcomes:
+            return None
+        return sum(self.outcomes) / len(self.outcomes)
+
+    def should_speculate(self):
+        if self.mode != "auto":
+            return self.mode == "on"
+        # 표본이 적을 때는 적중률을 믿을 수 없으므로 순서대로 호출
+        if len(self.outcomes) < self.min_samples:
+            return False
+        return self.hit_rate() <= self.max_hit_rate
+
+    def record_start(self):
+        self.started += 1
+
+    def record_result(self, used, finished):
+        """
+        동시에 시작한 생성 요청의 결말을 기록합니다. 쓰지 않은 요청은 이미 끝났는지에 따라 취소/폐기로 나눕니다.
+        """
+        if used:
+            self.used += 1
+        elif finished:
+            self.discarded += 1
+        else:
+            self.cancelled += 1
+
+    def stats(self):
+        hit_rate = self.hit_rate()
+        return {
+            "mode": self.mode,
+            "hit_rate": hit_rate,
+            "speculating": self.should_speculate(),
+            "started": self.started,
+            "used": self.used,
+            "cancelled": self.cancelled,
+            "discarded": self.discarded,
+            "wasted_ratio": (self.cancelled + self.discarded) / self.started if self.started else 0.0,
+        }
@@ -0,0 +1,28 @@
+import importlib
+import os
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="session")
+def rin(tmp_path_factory):
+    """
+    봇 모듈을 대역 실행용 환경 변수로 한 번만 불러옵니다. 저널과 스냅샷은 임시 디렉터리에 만듭니다.
+    """
+    workdir = tmp_path_factory.mktemp("rin")
+    os.environ.update({
+        "DISCORD_BOT_TOKEN": "test",
+        "CLAUDE_API_KEY": "test",
+        "LINE_JOURNAL_PATH": str(workdir / "lines_journal.sqlite3"),
+        "DIALOGUE_SNAPSHOT_PATH": str(workdir / "dialogue_snapshot.pkl"),
+        "SESSION_SNAPSHOT_PATH": "",
+        "METRICS_PORT": "0",
+    })
+    cwd = os.getcwd()
+    os.chdir(REPO_ROOT)  # 엑셀과 분류표는 저장소 기준 상대 경로
+    try:
+        return importlib.import_module("bot_rin_contextual_memory_full")
+    finally:
+        os.chdir(cwd)
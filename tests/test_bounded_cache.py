@@ -0,0 +1,85 @@
+import os
+import tracemalloc
+
+from bounded_cache import BoundedCache, cached
+
+
+# tracemalloc을 켜면 느려지므로 기본은 10만 개, 백만 개 재생은 환경 변수로 켬
+REPLAY_MESSAGES = int(os.getenv("BOUNDED_CACHE_REPLAY_MESSAGES", "100000"))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+def unique_messages(count, length=40):
+    for i in range(count):
+        yield f"오늘 있었던 일 얘기해줄게 {i} " + "정말 " * (i % length)
+
+
+def classify(message):
+    return {"emotion": "기쁨", "emotion_level": "low", "user_flow": "일반"}
+
+
+def test_memory_stays_flat_when_replaying_unique_messages():
+    cache = BoundedCache(maxsize=1000)
+    analyze = cached(cache)(classify)
+
+    tracemalloc.start()
+    try:
+        # 캐시가 가득 찬 뒤의 메모리를 기준으로 삼음
+        for message in unique_messages(10_000):
+            analyze(message)
+        warm, _ = tracemalloc.get_traced_memory()
+        for message in unique_messages(REPLAY_MESSAGES):
+            analyze(message)
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert len(cache) == 1000
+    assert cache.evictions == 10_000 + REPLAY_MESSAGES - 1000
+    assert current - warm < 256 * 1024
+
+
+def test_memory_bytes_counts_key_and_value_contents():
+    cache = BoundedCache(maxsize=5000)
+    analyze = cached(cache)(classify)
+    messages = list(unique_messages(5000, length=200))
+
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        for message in messages:
+            analyze(message)
+        after, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    traced = after - before
+    reported = cache.stats()["memory_bytes"]
+    # 공유 문자열을 항목마다 더하므로 실제보다 크게 잡힐 수는 있어도 작게 잡히면 안 됨
+    assert traced * 0.9 <= reported <= traced * 2
+    cache.clear()
+    assert cache.stats()["memory_bytes"] == 0
+
+
+def test_ttl_expiry_and_eviction_release_entry_sizes():
+    clock = FakeClock()
+    cache = BoundedCache(maxsize=2, ttl=10, clock=clock.monotonic)
+    cache.set(("f", "a"), {"emotion": "기쁨"})
+    cache.set(("f", "b"), {"emotion": "슬픔"})
+    size = cache.stats()["memory_bytes"]
+    cache.set(("f", "c"), {"emotion": "애정"})
+    assert cache.get(("f", "a")) is None
+    assert cache.stats()["memory_bytes"] == size
+
+    clock.now = 11
+    assert cache.get(("f", "b")) is None
+    assert cache.get(("f", "c")) is None
+    assert len(cache) == 0
+    assert cache.stats()["memory_bytes"] == 0
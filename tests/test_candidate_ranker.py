@@ -0,0 +1,49 @@
+import random
+
+from candidate_ranker import rank_candidates, rank_positions
+from dialogue_store import DialogueStore
+from similarity_index import SimilarityIndex
+
+USER_INPUT = "오늘 회사에서 너무 힘들었어"
+ROWS = [
+    ("오늘 회사에서 너무 힘들었구나", "반응형", "슬픔"),
+    ("회사에서 힘들었어? 무슨 일 있었어", "질문형", "걱정"),
+    ("오늘 너무 힘들었지", "반응형", "걱정"),
+    ("힘든 하루였네", "자기감정표현", "슬픔"),
+    ("밥은 먹었어?", "질문형", "애정"),
+    ("흥, 딱히 걱정한 건 아니야", "일반", "츤데레"),
+    ("", "일반", "기쁨"),
+]
+
+
+def build(rows):
+    store = DialogueStore()
+    for line, flow, emotion in rows:
+        store.append({"대사": line, "대화 흐름": flow, "감정": emotion})
+    return store, SimilarityIndex.from_store(store, 256)
+
+
+def test_rank_positions_matches_rank_candidates():
+    store, index = build(ROWS)
+    recent = ["오늘은 좀 쉬어"]
+    # 동점 순서는 무작위이므로 경계에 동점이 없는 조합만 비교
+    for user_flow, emotion in [("감정표현", "슬픔"), ("질문형", "걱정"), ("요청형", "없는 감정")]:
+        for top_k in (1, 2, 3, 4):
+            for seed in range(5):
+                expected = rank_candidates(USER_INPUT, ROWS, top_k, user_flow, emotion, recent, rng=random.Random(seed))
+                positions = rank_positions(USER_INPUT, list(range(len(ROWS))), store, index, top_k, user_flow, emotion,
+                                           recent, rng=random.Random(seed))
+                assert store.lines_at(positions) == expected
+
+
+def test_rank_positions_skips_until_top_k_and_treats_zero_as_unlimited():
+    store, index = build(ROWS)
+    positions = list(range(len(ROWS)))
+    assert rank_positions(USER_INPUT, positions, store, index, 0) == positions
+    assert rank_positions(USER_INPUT, positions, store, index, -1) == positions
+
+    ranked = rank_positions(USER_INPUT, positions, store, index, 2, "감정표현", "슬픔",
+                            skip=lambda line: line.startswith("오늘"))
+    assert len(ranked) == 2
+    assert not any(line.startswith("오늘") for line in store.lines_at(ranked))
+    assert rank_candidates(USER_INPUT, ROWS, 0) == [line for line, _, _ in ROWS]
@@ -0,0 +1,42 @@
+import json
+
+from prompt_builder import CACHE_CONTROL, MIN_CACHE_TOKENS, UsageTracker, build_cached_request, cached_prefix_blocks, \
+    cached_prefix_tokens
+
+HISTORY = [{"role": "user", "content": "안녕"}, {"role": "assistant", "content": "흥, 왔어?"}]
+
+
+def prefix_bytes(blocks):
+    # 캐시 표시 위치는 턴마다 뒤로 옮겨 가므로 내용만 비교
+    plain = [{key: value for key, value in block.items() if key != "cache_control"} for block in blocks]
+    return json.dumps(plain, ensure_ascii=False, sort_keys=True).encode("utf-8")
+
+
+def test_marks_system_and_last_history_block_even_when_short():
+    request = build_cached_request("짧은 시스템 프롬프트", HISTORY, "뭐해?", summary="유저는 린과 자주 이야기한다.")
+
+    assert request["system"][0]["cache_control"] == CACHE_CONTROL
+    assert "cache_control" not in request["system"][1]
+    assert request["messages"][1]["content"][-1]["cache_control"] == CACHE_CONTROL
+    assert request["messages"][-1] == {"role": "user", "content": "뭐해?"}
+    assert cached_prefix_tokens(request) < MIN_CACHE_TOKENS
+
+    tracker = UsageTracker()
+    tracker.record_prefix(cached_prefix_tokens(request))
+    tracker.record_prefix(MIN_CACHE_TOKENS)
+    assert tracker.summary()["short_prefix_ratio"] == 0.5
+
+
+def test_consecutive_turns_keep_cached_prefix_byte_identical(rin):
+    session = rin.session_store.get("prompt-cache-test")
+    session.add_turn("오늘 회사에서 너무 힘들었어", "고생했네. 딱히 걱정한 건 아니지만.")
+
+    _, first = rin.build_generation_request(session, "저녁은 뭐 먹지?", "기쁨", "low", "질문형")
+    session.add_turn("저녁은 뭐 먹지?", "라면이라도 먹어. 굶지 말고.")
+    _, second = rin.build_generation_request(session, "라면 먹을게", "기쁨", "low", "일반")
+
+    assert json.dumps(first["system"], ensure_ascii=False) == json.dumps(second["system"], ensure_ascii=False)
+    first_prefix = cached_prefix_blocks(first)
+    second_prefix = cached_prefix_blocks(second)
+    assert len(second_prefix) == len(first_prefix) + 2
+    assert prefix_bytes(second_prefix[:len(first_prefix)]) == prefix_bytes(first_prefix)
@@ -0,0 +1,177 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from reply_streamer import StreamingReply
+
+REQUEST = {"model": "test", "max_tokens": 50, "system": "", "messages": [{"role": "user", "content": "안녕"}]}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+class FakeSentMessage:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content):
+        self.channel.edits.append(content)
+        self.content = content
+
+
+class FakeChannel:
+    """
+    보낸 메시지와 수정 내용을 기록합니다. before_send가 있으면 전송 전에 기다립니다(느린 디스코드 흉내).
+    """
+
+    def __init__(self, before_send=None):
+        self.sent = []
+        self.edits = []
+        self.before_send = before_send
+
+    async def send(self, content):
+        if self.before_send is not None:
+            await self.before_send()
+        self.sent.append(content)
+        return FakeSentMessage(self, content)
+
+
+class FakeStream:
+    def __init__(self, client, chunks, fail_after):
+        self.client = client
+        self.chunks = chunks
+        self.fail_after = fail_after
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.client.closed.set()
+
+    @property
+    async def text_stream(self):
+        for index, chunk in enumerate(self.chunks):
+            if index == self.fail_after:
+                raise ConnectionError("stream reset")
+            await asyncio.sleep(0.01)
+            self.client.sent_counts.append(len(self.client.channel.sent))
+            yield chunk
+
+    async def get_final_message(self):
+        text = "".join(self.chunks)
+        return SimpleNamespace(content=[SimpleNamespace(text=text)],
+                               usage=SimpleNamespace(input_tokens=10, output_tokens=len(text)))
+
+
+class FakeStreamingClient:
+    """
+    messages.stream만 흉내 내는 Claude 클라이언트입니다. 조각을 내보낼 때마다 그때까지 채널에 보낸 메시지 수를 기록합니다.
+    """
+
+    def __init__(self, channel, chunks, fail_after=None):
+        self.channel = channel
+        self.sent_counts = []
+        self.closed = asyncio.Event()
+        self.messages = SimpleNamespace(stream=lambda timeout=None, **request: FakeStream(self, chunks, fail_after))
+
+
+@pytest.fixture
+def streaming(rin, monkeypatch):
+    def install(channel, chunks, fail_after=None):
+        fake = FakeStreamingClient(channel, chunks, fail_after)
+        monkeypatch.setattr(rin, "client", fake)
+        monkeypatch.setattr(rin, "claude_semaphore", asyncio.Semaphore(1))
+        monkeypatch.setattr(rin, "STREAM_EDIT_INTERVAL", 0.0)
+        return fake
+    return install
+
+
+def test_first_sentence_is_sent_while_stream_continues(rin, streaming):
+    channel = FakeChannel()
+    fake = streaming(channel, ['"안녕! 오', '늘은 뭐 ', '했어? ', '나는 심심했어."'])
+
+    streamer = asyncio.run(rin.stream_claude_reply(channel, REQUEST))
+
+    assert channel.sent == ["안녕!"]
+    assert fake.sent_counts[-1] == 1  # 마지막 조각이 오기 전에 첫 문장이 이미 전송됨
+    assert channel.edits[-1] == "안녕! 오늘은 뭐 했어? 나는 심심했어."
+    assert streamer.completed
+
+
+def test_semaphore_is_released_while_discord_send_is_slow(rin, streaming):
+    async def wait_for_stream_end():
+        # 제한을 잡은 채로 전송하면 스트림이 끝나지 않아 시간 초과로 실패함
+        await asyncio.wait_for(fake.closed.wait(), timeout=1)
+        assert not rin.claude_semaphore.locked()
+
+    channel = FakeChannel(before_send=wait_for_stream_end)
+    fake = streaming(channel, ["첫 문장이야. ", "두 번째 ", "문장이야."])
+
+    streamer = asyncio.run(rin.stream_claude_reply(channel, REQUEST))
+
+    assert channel.sent == ["첫 문장이야."]
+    assert channel.edits == ["첫 문장이야. 두 번째 문장이야."]
+    assert streamer.completed
+
+
+def test_interrupted_stream_is_not_completed(rin, streaming):
+    channel = FakeChannel()
+    streaming(channel, ["끝까지 ", "못 들었어. ", "미안", "해."], fail_after=3)
+
+    streamer = asyncio.run(rin.stream_claude_reply(channel, REQUEST))
+
+    assert not streamer.completed
+    assert channel.sent == ["끝까지 못 들었어."]
+    assert channel.edits == ["끝까지 못 들었어. 미안"]
+
+
+def test_stream_failing_before_anything_is_shown_raises(rin, streaming):
+    channel = FakeChannel()
+    streaming(channel, ["아무것도 ", "못 보냄"], fail_after=1)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(rin.stream_claude_reply(channel, REQUEST))
+    assert channel.sent == []
+
+
+def test_edits_respect_min_interval():
+    clock = FakeClock()
+    channel = FakeChannel()
+    streamer = StreamingReply(channel, lambda sentence: sentence, lambda text, final: text,
+                              min_edit_interval=1.0, clock=clock.monotonic)
+
+    async def play():
+        for at, delta in [(0.0, "하나. "), (0.1, "둘. "), (0.5, "셋. "), (1.2, "넷. "), (1.5, "다섯. "), (1.6, "끝")]:
+            clock.now = at
+            await streamer.feed(delta)
+        await streamer.finish()
+
+    asyncio.run(play())
+
+    assert channel.sent == ["하나."]
+    # 0.1초에 첫 문장을 보낸 뒤 0.5초에 완성된 문장은 모아 두었다가 1.2초에 수정하고, 1.5초는 간격이 짧아 건너뜀
+    assert channel.edits == ["하나. 둘. 셋.", "하나. 둘. 셋. 넷. 다섯. 끝"]
+    assert streamer.completed
+
+
+def test_closing_quote_is_stripped_only_on_final_edit(rin):
+    channel = FakeChannel()
+    streamer = StreamingReply(channel, lambda sentence: sentence, rin.clean_reply_text, min_edit_interval=0.0)
+
+    async def play():
+        await streamer.feed('"좋아." ')
+        await streamer.feed('너도?"')
+        await streamer.finish()
+
+    asyncio.run(play())
+
+    # 생성 중에는 뒤따옴표가 응답 끝인지 알 수 없으므로 남기고, 마지막 수정에서만 지움
+    assert channel.sent == ['좋아."']
+    assert channel.edits == ['좋아." 너도?']
@@ -0,0 +1,184 @@
+import asyncio
+
+import pytest
+
+from upstream_governor import CircuitBreaker, CircuitOpenError, TokenBucket, UpstreamGovernor
+
+
+class FakeClock:
+    """
+    sleep하면 그만큼 시간이 흐른 것으로 치는 시계입니다. block=True이면 sleep이 끝나지 않아 취소를 시험할 수 있습니다.
+    """
+
+    def __init__(self, block=False):
+        self.now = 0.0
+        self.block = block
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        if self.block:
+            await asyncio.Event().wait()
+        self.now += seconds
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class FakeClient:
+    """
+    정해 둔 순서대로 예외를 던지거나 값을 돌려주는 Claude 호출 대역입니다.
+    """
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+def make_governor(clock, failure_threshold=2, reset_timeout=30.0, retry_after=lambda exc: None, rpm=1000):
+    breaker = CircuitBreaker(failure_threshold=failure_threshold, reset_timeout=reset_timeout, clock=clock)
+    return UpstreamGovernor(requests_per_minute=rpm, tokens_per_minute=10**9, breaker=breaker, clock=clock,
+                            is_retryable=lambda exc: isinstance(exc, UpstreamError), retry_after=retry_after)
+
+
+def test_breaker_opens_then_half_opens_and_closes():
+    async def scenario():
+        clock = FakeClock()
+        governor = make_governor(clock)
+        client = FakeClient(UpstreamError(), UpstreamError(), "ok")
+
+        for _ in range(2):
+            with pytest.raises(UpstreamError):
+                await governor.call(client, max_retries=1)
+        assert governor.breaker.state == CircuitBreaker.OPEN
+
+        with pytest.raises(CircuitOpenError):
+            await governor.call(client, max_retries=1)
+        assert client.calls == 2 and governor.rejected == 1
+
+        clock.now += 30.0
+        assert await governor.call(client, max_retries=1) == "ok"
+        assert governor.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
+
+
+def test_failed_half_open_trial_reopens():
+    async def scenario():
+        clock = FakeClock()
+        governor = make_governor(clock, failure_threshold=1)
+        client = FakeClient(UpstreamError(), UpstreamError())
+
+        with pytest.raises(UpstreamError):
+            await governor.call(client, max_retries=1)
+        clock.now += 30.0
+        with pytest.raises(UpstreamError):
+            await governor.call(client, max_retries=1)
+        assert governor.breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            await governor.call(client, max_retries=1)
+
+    asyncio.run(scenario())
+
+
+def test_retry_waits_for_retry_after():
+    async def scenario():
+        clock = FakeClock()
+        governor = make_governor(clock, failure_threshold=5, retry_after=lambda exc: 2.5)
+        client = FakeClient(UpstreamError(), "ok")
+
+        assert await governor.call(client, max_retries=3) == "ok"
+        assert clock.sleeps == [2.5]
+        assert governor.retries == 1 and client.calls == 2
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_is_capped_by_max_delay():
+    async def scenario():
+        clock = FakeClock()
+        governor = make_governor(clock, failure_threshold=5, retry_after=lambda exc: 600.0)
+        assert await governor.call(FakeClient(UpstreamError(), "ok"), max_retries=2) == "ok"
+        assert clock.sleeps == [governor.max_delay]
+
+    asyncio.run(scenario())
+
+
+def test_token_bucket_waits_for_refill():
+    async def scenario():
+        clock = FakeClock()
+        bucket = TokenBucket(60, capacity=1, clock=clock)  # 초당 1개
+        await bucket.acquire(1)
+        assert clock.sleeps == []
+        await bucket.acquire(1)
+        assert clock.sleeps == [pytest.approx(1.0)]
+
+    asyncio.run(scenario())
+
+
+def test_request_bucket_delays_calls_over_the_rate():
+    async def scenario():
+        clock = FakeClock()
+        governor = make_governor(clock, rpm=2)
+        client = FakeClient("a", "b", "c")
+        for _ in range(3):
+            await governor.call(client, max_retries=1)
+        assert clock.sleeps == [pytest.approx(30.0)]
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_half_open_trial_waiting_on_bucket_releases_the_slot():
+    async def scenario():
+        clock = FakeClock(block=True)
+        governor = make_governor(clock, failure_threshold=1, rpm=1)
+        await governor.request_bucket.acquire(1)  # 버킷을 비워 다음 호출이 기다리게 함
+        governor.breaker.record_failure()
+        clock.now += 30.0
+
+        task = asyncio.create_task(governor.call(FakeClient("ok"), max_retries=1))
+        await asyncio.sleep(0)
+        assert clock.sleeps  # 시험 호출 자리를 잡고 버킷을 기다리는 중
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert governor.breaker.state == CircuitBreaker.HALF_OPEN
+        assert governor.breaker.allow()
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_half_open_trial_in_flight_releases_the_slot():
+    async def scenario():
+        clock = FakeClock()
+        governor = make_governor(clock, failure_threshold=1)
+        governor.breaker.record_failure()
+        clock.now += 30.0
+        started = asyncio.Event()
+
+        async def slow_call():
+            started.set()
+            await asyncio.Event().wait()
+
+        task = asyncio.create_task(governor.call(slow_call, max_retries=1))
+        await started.wait()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        assert await governor.call(FakeClient("ok"), max_retries=1) == "ok"
+        assert governor.breaker.state == CircuitBreaker.CLOSED
+
+    asyncio.run(scenario())
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger('린_봇')
+
+
+class SystemClock:
+    """
+    실제 시간을 사용하는 시계입니다. 테스트에서는 같은 메서드를 가진 가짜 시계로 바꿔 끼울 수 있습니다.
+    """
+
+    def monotonic(self):
+        return time.monotonic()
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+class CircuitOpenError(Exception):
+    """
+    업스트림이 불안정해 회로 차단기가 열려 있어 호출하지 않았음을 나타냅니다.
+    """
+
+
+class TokenBucket:
+    """
+    분당 허용량만큼 토큰이 차오르는 버킷입니다. 부족하면 채워질 때까지 기다립니다.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None, clock=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.clock = clock or SystemClock()
+        self.tokens = self.capacity
+        self._updated_at = self.clock.monotonic()
+
+    def _refill(self):
+        now = self.clock.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    async def acquire(self, amount=1):
+        amount = min(amount, self.capacity)  # 한 번에 버킷보다 큰 요청도 언젠가는 통과하도록
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await self.clock.sleep((amount - self.tokens) / self.rate)
+
+
+class CircuitBreaker:
+    """
+    연속 실패가 failure_threshold에 닿으면 열려서 reset_timeout 동안 호출을 막습니다.
+    그 뒤에는 시험 호출 하나만 통과시키고, 성공하면 닫고 실패하면 다시 엽니다.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=None):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock or SystemClock()
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    def allow(self):
+        if self.state == self.OPEN and self.clock.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Claude API 회로 차단기 닫힘")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Claude API 회로 차단기 열림 (연속 실패 {self.failures}회)")
+            self.state = self.OPEN
+            self._opened_at = self.clock.monotonic()
+            self._trial_in_flight = False
+
+    def record_cancelled(self):
+        """
+        취소된 호출은 업스트림 상태를 알려주지 않으므로, 시험 호출이었다면 다음 호출이 다시 시험할 수 있게만 합니다.
+        """
+        self._trial_in_flight = False
+
+
+class UpstreamGovernor:
+    """
+    모든 Claude 호출이 함께 쓰는 업스트림 관리자입니다.
+    요청 수/토큰 수 버킷으로 속도를 제한하고, 재시도는 지터를 넣은 지수 백오프(또는 retry-after 헤더)를 따르며,
+    회로 차단기가 열려 있으면 호출하지 않고 바로 CircuitOpenError를 발생시킵니다.
+
+    is_retryable(exc)는 재시도할 예외인지, retry_after(exc)는 서버가 알려준 대기 시간(초, 없으면 None)을 반환합니다.
+    """
+
+    def __init__(self, requests_per_minute=50, tokens_per_minute=50000, max_retries=3, base_delay=1.0,
+                 max_delay=20.0, breaker=None, clock=None, rng=None,
+                 is_retryable=lambda exc: True, retry_after=lambda exc: None):
+        self.clock = clock or SystemClock()
+        self.request_bucket = TokenBucket(requests_per_minute, clock=self.clock)
+        self.token_bucket = TokenBucket(tokens_per_minute, clock=self.clock)
+        self.breaker = breaker or CircuitBreaker(clock=self.clock)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.rng = rng or random.Random()
+        self.is_retryable = is_retryable
+        self.retry_after = retry_after
+        self.calls = 0
+        self.retries = 0
+        self.rejected = 0
+
+    def backoff_delay(self, attempt, exc):
+        """
+        서버가 retry-after를 주면 그 값을, 아니면 0부터 지수 상한 사이의 무작위 값을 대기 시간으로 사용합니다.
+        """
+        server_delay = self.retry_after(exc)
+        if server_delay is not None:
+            return min(server_delay, self.max_delay)
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def call(self, fn, estimated_tokens=0, max_retries=None):
+        """
+        fn()을 호출해 결과를 반환합니다. 재시도할 수 없는 오류나 마지막 시도의 오류는 그대로 전달합니다.
+        """
+        max_retries = max_retries or self.max_retries
+        for attempt in range(max_retries):
+            if not self.breaker.allow():
+                self.rejected += 1
+                raise CircuitOpenError("Claude API가 불안정해 호출을 잠시 중단했습니다.")
+
+            try:
+                await self.request_bucket.acquire(1)
+                await self.token_bucket.acquire(estimated_tokens)
+                self.calls += 1
+                result = await fn()
+            except asyncio.CancelledError:
+                # allow()로 시험 호출 자리를 잡은 뒤라면 버킷을 기다리는 중에 취소되어도 자리를 돌려줘야 함
+                self.breaker.record_cancelled()
+                raise
+            except Exception as e:
+                if not self.is_retryable(e):
+                    # 요청 자체의 문제(잘못된 인자 등)는 업스트림 상태와 무관하므로 차단기에 반영하지 않음
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                if attempt == max_retries - 1:
+                    logger.error("최대 재시도 횟수 초과")
+                    raise
+                delay = self.backoff_delay(attempt, e)
+                self.retries += 1
+                logger.warning(f"Claude API 호출 오류: {str(e)}. {delay:.1f}초 후 재시도 {attempt+1}/{max_retries}")
+                await self.clock.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            return result